@@ -0,0 +1,89 @@
+# A small HTTPS server which stands in for a Foreman frontend during benchmarks
+# It answers every GET with a small json record and keeps connections alive (HTTP/1.1)
+# so that the cost of TLS handshakes can be compared with pooled connections
+# A self signed certificate is generated with the openssl binary when the server starts
+
+import json
+import os
+import shutil
+import ssl
+import subprocess
+import tempfile
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _ForemanRequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def _send_json(self, status, obj):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._send_json(200, {"id": 1, "name": "foreman.foobar.com", "url": "https://foreman.foobar.com:8443"})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalHttpsServer:
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self._cert_dir = None
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return "https://{0}:{1}".format(self.host, self._server.server_address[1])
+
+    def _create_certificate(self):
+        if shutil.which("openssl") is None:
+            raise Exception("The openssl binary is required to generate a certificate for the local https server.")
+
+        self._cert_dir = tempfile.mkdtemp()
+        cert_file = os.path.join(self._cert_dir, "cert.pem")
+        key_file = os.path.join(self._cert_dir, "key.pem")
+        subprocess.check_call(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+             "-subj", "/CN={0}".format(self.host), "-keyout", key_file, "-out", cert_file],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL)
+        return cert_file, key_file
+
+    def start(self):
+        cert_file, key_file = self._create_certificate()
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert_file, key_file)
+
+        self._server = ThreadingHTTPServer((self.host, self.port), _ForemanRequestHandler)
+        self._server.daemon_threads = True
+        self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._cert_dir is not None:
+            shutil.rmtree(self._cert_dir, ignore_errors=True)
+            self._cert_dir = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
@@ -0,0 +1,57 @@
+# Compares the per call latency of the module level requests functions (a new TCP + TLS connection per call)
+# with the pooled keep-alive session owned by the ForemanApiWrapper
+#
+# Usage:
+#   PYTHONPATH=src python benchmarks/benchmark_connection_pooling.py [number_of_calls]
+
+import statistics
+import sys
+import time
+
+import requests
+
+from LocalHttpsServer import LocalHttpsServer
+from ForemanApiWrapper.ForemanApiUtilities.ForemanApiWrapper import ForemanApiWrapper
+
+
+def _time_calls(function, number_of_calls):
+    timings = []
+    for x in range(0, number_of_calls):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _report(label, timings):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print("{0:<28} mean {1:7.2f} ms   median {2:7.2f} ms   p95 {3:7.2f} ms".format(
+        label,
+        statistics.mean(timings) * 1000,
+        statistics.median(timings) * 1000,
+        p95 * 1000))
+
+
+def main():
+    number_of_calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    endpoint = "/api/smart_proxies/1"
+
+    with LocalHttpsServer() as server:
+        auth = requests.auth.HTTPBasicAuth("admin", "password")
+
+        def unpooled_call():
+            requests.get(server.url + endpoint, auth=auth, verify=False).json()
+
+        with ForemanApiWrapper("admin", "password", server.url, False) as api_wrapper:
+
+            def pooled_call():
+                api_wrapper.make_api_call(endpoint, "GET")
+
+            print("{0} GET calls against {1}".format(number_of_calls, server.url))
+            _report("before (requests.get)", _time_calls(unpooled_call, number_of_calls))
+            _report("after (pooled session)", _time_calls(pooled_call, number_of_calls))
+
+
+if __name__ == "__main__":
+    main()
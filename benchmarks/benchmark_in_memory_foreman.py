@@ -0,0 +1,50 @@
+# Measures the throughput and the number of api calls made by the ForemanApiWrapper and the ApiStateEnforcer
+# against the InMemoryForemanTransport, so that no Foreman server is needed
+# The latency of the stand-in models the time a Foreman server takes to answer an api call
+#
+# Usage:
+#   PYTHONPATH=src python benchmarks/benchmark_in_memory_foreman.py [hosts] [latency in ms]
+
+import sys
+import time
+
+from ForemanApiWrapper.ForemanApiUtilities.ForemanApiWrapper import ForemanApiWrapper
+from ForemanApiWrapper.ForemanApiUtilities.InMemoryForemanTransport import InMemoryForemanTransport
+from ForemanApiWrapper.ApiStateEnforcer.ApiStateEnforcer import ApiStateEnforcer
+
+
+def _host(x):
+    return {"host": {"name": "web{0}".format(x), "mac": "52:54:00:{0:02x}:{1:02x}:{2:02x}".format(x // 65536 % 256, x // 256 % 256, x % 256)}}
+
+
+def _run(label, transport, api_wrapper, function):
+    transport.reset_calls()
+    api_wrapper.metrics.reset()
+    start = time.perf_counter()
+    count = function()
+    elapsed = time.perf_counter() - start
+    print("  {0:<40} {1:8.1f} ms {2:8.0f} records/s {3:6} api calls".format(label, elapsed * 1000, count / elapsed, transport.get_call_count()))
+
+
+def main():
+    hosts = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.002
+
+    transport = InMemoryForemanTransport(latency=latency)
+    api_wrapper = ForemanApiWrapper("admin", "password", "https://foreman.example.com", False, transport=transport)
+    api_state_enforcer = ApiStateEnforcer(api_wrapper)
+    desired = [("present", _host(x)) for x in range(0, hosts)]
+
+    print("{0} hosts, {1:.1f} ms latency".format(hosts, latency * 1000))
+    _run("ensure_states (create)", transport, api_wrapper, lambda: len(api_state_enforcer.ensure_states(desired, max_workers=8)))
+    _run("ensure_states (unchanged)", transport, api_wrapper, lambda: len(api_state_enforcer.ensure_states(desired, max_workers=8)))
+    _run("list_records", transport, api_wrapper, lambda: len(list(api_wrapper.list_records("host", per_page=100))))
+    _run("list_records (4 pages at once)", transport, api_wrapper, lambda: len(list(api_wrapper.list_records("host", per_page=100, page_concurrency=4))))
+
+    # A fresh wrapper has no index of the hosts, so the reads have to search for them
+    api_wrapper = ForemanApiWrapper("admin", "password", "https://foreman.example.com", False, transport=transport)
+    _run("read_records", transport, api_wrapper, lambda: len(api_wrapper.read_records([_host(x) for x in range(0, hosts)])))
+
+
+if __name__ == "__main__":
+    main()
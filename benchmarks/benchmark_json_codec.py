@@ -0,0 +1,93 @@
+# Compares decoding api call responses the way make_api_call used to (content.decode("utf-8") followed by json.loads)
+# with the JsonCodec backends, which parse straight from the response bytes
+# Request bodies are compared in the same way (json.dumps as done by requests versus JsonCodec.dumps)
+#
+# By default the payloads are generated to resemble Foreman responses (a page of hosts, a host with its parameters
+# and a provisioning template). Responses recorded from a Foreman server can be passed as json files instead.
+#
+# Usage:
+#   PYTHONPATH=src python benchmarks/benchmark_json_codec.py [recorded_response.json ...]
+
+import json
+import sys
+import time
+
+from ForemanApiWrapper.ForemanApiUtilities.JsonCodec import JsonCodec
+
+
+def _host(x):
+    return {
+        "id": x,
+        "name": "web{0}.foobar.com".format(x),
+        "ip": "15.4.{0}.{1}".format(x // 250, x % 250 + 1),
+        "mac": "52:54:00:{0:02x}:{1:02x}:{2:02x}".format(x // 65536 % 256, x // 256 % 256, x % 256),
+        "environment_name": "production",
+        "operatingsystem_id": 19,
+        "operatingsystem_name": "CentOS 7.6",
+        "architecture_name": "x86_64",
+        "domain_name": "foobar.com",
+        "subnet_name": "foobar-subnet",
+        "build": False,
+        "enabled": True,
+        "managed": True,
+        "comment": "Provisioned by the ApiStateEnforcer",
+        "created_at": "2019-04-01 12:00:00 UTC",
+        "updated_at": "2019-04-02 12:00:00 UTC",
+        "global_status_label": "OK",
+    }
+
+
+def _generate_payloads():
+    host = _host(1)
+    host["parameters"] = [{"id": x, "name": "parameter_{0}".format(x), "value": "value {0}".format(x) * 4} for x in range(0, 200)]
+    host["interfaces"] = [{"id": x, "identifier": "eth{0}".format(x), "mac": host["mac"], "primary": x == 0} for x in range(0, 4)]
+    template_lines = ["<%# line {0} of the kickstart template -%>".format(x) for x in range(0, 5000)]
+    return [
+        ("page of 1000 hosts", {"total": 1000, "subtotal": 1000, "page": 1, "per_page": 1000, "results": [_host(x) for x in range(0, 1000)]}),
+        ("host with parameters", host),
+        ("provisioning template", {"id": 161, "name": "Kickstart default", "template": "\n".join(template_lines), "snippet": False}),
+    ]
+
+
+def _load_payloads(paths):
+    payloads = []
+    for path in paths:
+        with open(path, "rb") as f:
+            payloads.append((path, json.loads(f.read())))
+    return payloads
+
+
+def _time(function, repeat):
+    best = None
+    for x in range(0, repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    payloads = _load_payloads(sys.argv[1:]) if len(sys.argv) > 1 else _generate_payloads()
+    codecs = [JsonCodec("json")]
+    if JsonCodec().backend == "orjson":
+        codecs.append(JsonCodec("orjson"))
+
+    for label, obj in payloads:
+        content = json.dumps(obj).encode("utf-8")
+        repeat = max(5, int(2000000 / len(content)))
+        print("{0} ({1} KB, best of {2})".format(label, len(content) // 1024, repeat))
+        timing = _time(lambda: json.loads(content.decode("utf-8")), repeat)
+        print("  {0:<38} {1:8.3f} ms".format("decode: before (decode + json.loads)", timing * 1000))
+        for codec in codecs:
+            timing = _time(lambda: codec.loads(content), repeat)
+            print("  {0:<38} {1:8.3f} ms".format("decode: JsonCodec(" + codec.backend + ")", timing * 1000))
+        timing = _time(lambda: json.dumps(obj).encode("utf-8"), repeat)
+        print("  {0:<38} {1:8.3f} ms".format("encode: before (json.dumps)", timing * 1000))
+        for codec in codecs:
+            timing = _time(lambda: codec.dumps(obj), repeat)
+            print("  {0:<38} {1:8.3f} ms".format("encode: JsonCodec(" + codec.backend + ")", timing * 1000))
+
+
+if __name__ == "__main__":
+    main()
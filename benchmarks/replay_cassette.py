@@ -0,0 +1,44 @@
+# Replays the api calls of a cassette recorded with ForemanApiWrapper.start_recording through make_api_call
+# and reports the number of api calls made and the wall time, so that library versions can be compared
+# on the same traffic without a Foreman server
+#
+# Usage:
+#   PYTHONPATH=src python benchmarks/replay_cassette.py cassette.jsonl.gz [--emulate-latency]
+
+import sys
+import time
+
+from ForemanApiWrapper.ForemanApiUtilities.ForemanApiWrapper import ForemanApiWrapper
+from ForemanApiWrapper.ForemanApiUtilities.ApiCassette import ApiCassette
+from ForemanApiWrapper.ForemanApiUtilities.ReplayTransport import ReplayTransport
+
+
+def main():
+    paths = [x for x in sys.argv[1:] if not x.startswith("--")]
+    if not paths:
+        print("Usage: replay_cassette.py cassette.jsonl.gz [--emulate-latency]")
+        sys.exit(1)
+    emulate_latency = "--emulate-latency" in sys.argv
+
+    cassette = ApiCassette.load(paths[0])
+    transport = ReplayTransport(cassette, emulate_latency=emulate_latency)
+    api_wrapper = ForemanApiWrapper("admin", "password", "https://foreman.example.com", False, transport=transport)
+
+    failed = 0
+    start = time.perf_counter()
+    for interaction in cassette.interactions:
+        try:
+            api_wrapper.make_api_call(interaction["endpoint"], interaction["method"], interaction["request"])
+        except Exception:
+            failed += 1
+    elapsed = time.perf_counter() - start
+
+    recorded_latency = sum(x["latency"] for x in cassette.interactions)
+    print("{0} interactions recorded ({1:.1f} ms of recorded latency)".format(len(cassette.interactions), recorded_latency * 1000))
+    print("{0} api calls replayed in {1:.1f} ms, {2} failed, {3} unmatched".format(transport.get_call_count(), elapsed * 1000, failed, len(transport.unmatched)))
+    for name, value in sorted(api_wrapper.metrics.snapshot().items()):
+        print("  {0:<24} {1}".format(name, value))
+
+
+if __name__ == "__main__":
+    main()
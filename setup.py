@@ -27,6 +27,11 @@ setuptools.setup(
         "": source_code_dir
     },
     install_requires= install_requires,
+    extras_require={
+        "async": ["aiohttp"],
+        "orjson": ["orjson"],
+        "brotli": ["brotli"]
+    },
     classifiers=[
         "Programming Language :: Python :: 2.7",
         "Programming Language :: Python :: 3",
@@ -1,10 +1,13 @@
 import logging
-import json
-import os
-import yaml
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from ForemanApiWrapper.ForemanApiUtilities.ForemanApiCallException import ForemanApiCallException
+from ForemanApiWrapper.ForemanApiUtilities.ApiDiagnostics import ApiDiagnostics
+from ForemanApiWrapper.ForemanApiUtilities.Deadline import Deadline
+from ForemanApiWrapper.ForemanApiUtilities.ApiEndpointBalancer import ApiEndpointBalancer
 from ForemanApiWrapper.RecordUtilities import RecordComparison
 from ForemanApiWrapper.ApiStateEnforcer.RecordModificationReceipt import RecordModificationReceipt
+from ForemanApiWrapper.ApiStateEnforcer.RecordReference import RecordReference
 from ForemanApiWrapper.RecordUtilities import ForemanApiRecord
 
 
@@ -19,9 +22,19 @@ class ApiStateEnforcer:
     extra_record_message = "The record exists and it should not."
     states_match_message = "The actual state matches the desired state."
 
-    def __init__(self, api_wrapper):
+    def __init__(self, api_wrapper, diagnostics=None, operation_timeout=None):
         self.api_wrapper = api_wrapper
 
+        # The time allowed for the read-compare-write cycle of one ensure_state (None for no limit)
+        self.operation_timeout = operation_timeout
+
+        # By default the diagnostics of the api wrapper are shared
+        if diagnostics is None:
+            diagnostics = getattr(api_wrapper, "diagnostics", None)
+        if diagnostics is None:
+            diagnostics = ApiDiagnostics(logger)
+        self.diagnostics = diagnostics
+
     def _determine_change_required(self, desired_state, minimal_record, actual_record):
 
         # This function will determine whether the minimal record is represented by the actual record.
@@ -56,6 +69,108 @@ class ApiStateEnforcer:
 
         return change_required, reason
 
+    @staticmethod
+    def _is_ignorable_read_exception(e):
+
+        # If the record doesn't exist, the api will throw a 404 which we can ignore
+        ignore_exception = False
+        if type(e.__cause__) == ForemanApiCallException:
+            if e.__cause__.results is not None:
+                if "status_code" in dir(e.__cause__.results):
+                    if e.__cause__.results.status_code == 404:
+                        logger.debug("Ignoring 404 Exception as it indicates the record does not exist.")
+                        ignore_exception = True
+                else:
+                    logger.debug("Ignoring exception raised by API failing to perform query properly.")
+                    logger.debug("Error was as follows:")
+                    logger.exception(e)
+                    ignore_exception = True
+        return ignore_exception
+
+    def _log_change_required(self, change_required, reason, original_record, minimal_record):
+
+        # Print some debug info about the change required
+        # The records are only serialized if debug logging is enabled
+        if not self.diagnostics.is_enabled(logging.DEBUG):
+            return
+        logger.debug("Change required: '%s'", change_required)
+        logger.debug("Reason: '%s'", reason)
+        self.diagnostics.log_json("Actual Record:", original_record)
+        self.diagnostics.log_json("Desired Record:", minimal_record)
+
+    def _prepare_ensure_state(self, desired_state, minimal_record):
+
+        self.diagnostics.log_yaml("Desired state is as follows:", minimal_record)
+
+        if desired_state.lower() not in ["present", "absent"]:
+            raise Exception("The specified desired state '{0}' was not valid.".format(desired_state))
+
+        record_type = ForemanApiRecord.get_record_type_from_record(minimal_record)
+        logger.debug("Ensuring {0} record is '{1}'".format(record_type, desired_state))
+        return record_type
+
+    def _determine_modification(self, reason, minimal_record, record_type, original_record):
+
+        # Determine which CRUD function will bring the actual state in line with the desired state
+        # If a change is required to an existing record, the original record will contain an id
+        # We will need to add this to the minimal_record if it had not already been added
+        if reason.startswith(self.missing_record_message):
+            logger.debug("Creating the missing record.")
+            return "create_record"
+        elif reason.startswith(self.extra_record_message):
+            logger.debug("Deleting the record.")
+            id = ForemanApiRecord.get_id_from_record(original_record)
+            minimal_record[record_type]["id"] = id
+            return "delete_record"
+        elif reason.startswith(self.record_mismatch_message):
+            # Do the update rather than a delete / set
+            id = ForemanApiRecord.get_id_from_record(original_record)
+            minimal_record[record_type]["id"] = id
+            logger.debug("Updating the record.")
+            return "update_record"
+        return None
+
+    @staticmethod
+    def _raise_unless_ignorable_read_exception(e):
+        if not ApiStateEnforcer._is_ignorable_read_exception(e):
+            raise Exception("An unexpected error occurred while reading record.") from e
+
+    def _plan_ensure_state(self, desired_state, minimal_record, record_type, original_record):
+
+        # Determine what change is required (if any)
+        # The actual state needs to be compared with a minimal state to determine if
+        # any fields are missing or need to be changed
+        # The property names change depending on the http method used for
+        # the api endpoint
+        # We will need to do some logic to "normalize the property names"
+        # loop through the properties in the minimal state
+        # If the property is not found, check to see if it has an alternate name
+        # If both the property and the alternate name are not found, return false
+        # Returns whether a change is required, the reason and the name of the api wrapper function which makes it (or None)
+
+        change_required, reason = self._determine_change_required(desired_state, minimal_record, original_record)
+
+        self._log_change_required(change_required, reason, original_record, minimal_record)
+
+        if not change_required:
+            return change_required, reason, None
+        return change_required, reason, self._determine_modification(reason, minimal_record, record_type, original_record)
+
+    @staticmethod
+    def _create_receipt(desired_state, minimal_record, change_required, reason, original_record, modified_record):
+
+        # If no change was required the actual and original records will be the same
+        actual_record = modified_record if change_required else original_record
+        return RecordModificationReceipt(
+            change_required,
+            reason,
+            minimal_record,
+            desired_state,
+            actual_record,
+            original_record)
+
+    @Deadline.operation
+    @ApiEndpointBalancer.pinned
     def ensure_state(self, desired_state, minimal_record):
 
         # This function will ensure that a state for a given record
@@ -68,13 +183,7 @@ class ApiStateEnforcer:
         #
 
         try:
-            logging.debug("Desired state is as follows:" + os.linesep + yaml.dump(minimal_record))
-
-            if desired_state.lower() not in ["present", "absent"]:
-                raise Exception("The specified desired state '{0}' was not valid.".format(desired_state))
-
-            record_type = ForemanApiRecord.get_record_type_from_record(minimal_record)
-            logger.debug("Ensuring {0} record is '{1}'".format(record_type, desired_state))
+            record_type = self._prepare_ensure_state(desired_state, minimal_record)
 
             # Get the current state as some fields may exist which are not present on our minimal state represenation
             # If the record doesn't exist, the api will throw a 404 which we can ignore
@@ -84,85 +193,217 @@ class ApiStateEnforcer:
             try:
                 original_record = self.api_wrapper.read_record(minimal_record)
             except Exception as e:
-                ignore_exception = False
-                if type(e.__cause__) == ForemanApiCallException:
-                    if e.__cause__.results is not None:
-                        if "status_code" in dir(e.__cause__.results):
-                            if e.__cause__.results.status_code == 404:
-                                logger.debug("Ignoring 404 Exception as it indicates the record does not exist.")
-                                ignore_exception = True
-                        else:
-                            logger.debug("Ignoring exception raised by API failing to perform query properly.")
-                            logger.debug("Error was as follows:")
-                            logger.exception(e)
-                            ignore_exception = True
-                if not ignore_exception:
-                    raise Exception("An unexpected error occurred while reading record.") from e
-
-            # Determine what change is required (if any)
-            # The actual state needs to be compared with a minimal state to determine if
-            # any fields are missing or need to be changed
-            # The property names change depending on the http method used for
-            # the api endpoint
-            # We will need to do some logic to "normalize the property names"
-            # loop through the properties in the minimal state
-            # If the property is not found, check to see if it has an alternate name
-            # If both the property and the alternate name are not found, return false
-
-            change_required, reason = self._determine_change_required(desired_state, minimal_record, original_record)
-
-            # Print some debug info about the change required
-            logger.debug("Change required: '{0}'".format(change_required))
-            logger.debug("Reason: '{0}'".format(reason))
-            logger.debug("Actual Record:")
-            obj_json = json.dumps(original_record, indent=4, sort_keys=True)
-            for line in obj_json.split(os.linesep):
-                logger.debug(line)
-            logger.debug("Desired Record:")
-            obj_json = json.dumps(minimal_record, indent=4, sort_keys=True)
-            for line in obj_json.split(os.linesep):
-                logger.debug(line)
-
-            # If not change is required, our work is done
-            if not change_required:
-                return RecordModificationReceipt(
-                    change_required,
-                    reason,
-                    minimal_record,
-                    desired_state,
-                    original_record,
-                    original_record) # The actual and original records will be the same
+                ApiStateEnforcer._raise_unless_ignorable_read_exception(e)
+
+            change_required, reason, modification = self._plan_ensure_state(desired_state, minimal_record, record_type, original_record)
 
             # Do the change
             modified_record = None
-            if reason.startswith(self.missing_record_message):
-                logger.debug("Creating the missing record.")
-                modified_record = self.api_wrapper.create_record(minimal_record)
-            elif reason.startswith(self.extra_record_message):
-                logger.debug("Deleting the record.")
-                # If a change is required, the original record will contain an id
-                # We will need to add this to the minimal_record if it had not already been added
-                id = ForemanApiRecord.get_id_from_record(original_record)
-                minimal_record[record_type]["id"] = id
-                modified_record = self.api_wrapper.delete_record(minimal_record)
-            elif reason.startswith(self.record_mismatch_message):
-                # Do the update rather than a delete / set
-                # If a change is required, the original record will contain an id
-                # We will need to add this to the minimal_record if it had not already been added
-                id = ForemanApiRecord.get_id_from_record(original_record)
-                minimal_record[record_type]["id"] = id
-                logger.debug("Updating the record.")
-                modified_record = self.api_wrapper.update_record(minimal_record)
+            if modification:
+                modified_record = getattr(self.api_wrapper, modification)(minimal_record)
 
             # Return the results
-            return RecordModificationReceipt(
-                change_required,
-                reason,
-                minimal_record,
-                desired_state,
-                modified_record,
-                original_record)
+            return ApiStateEnforcer._create_receipt(desired_state, minimal_record, change_required, reason, original_record, modified_record)
 
         except Exception as e:
             raise Exception("An error occurred while ensuring the api state.") from e
 
+    @staticmethod
+    def _normalize_desired_states(desired):
+
+        # The desired states are supplied as tuples of (desired_state, minimal_record) or (desired_state, minimal_record, key)
+        # The key is used by RecordReferences to refer to the record
+        desired_states = []
+        keys = {}
+        for x in range(0, len(desired)):
+            item = tuple(desired[x])
+            if len(item) not in [2, 3]:
+                raise Exception("The desired state at position {0} was malformed.".format(x))
+            desired_state, minimal_record = item[0], item[1]
+            key = item[2] if len(item) == 3 else None
+            if key is not None:
+                if key in keys.keys():
+                    raise Exception("The key '{0}' was used by more than one desired state.".format(key))
+                keys[key] = x
+            desired_states.append((desired_state, minimal_record, key))
+        return desired_states, keys
+
+    @staticmethod
+    def _find_record_references(obj):
+        if isinstance(obj, RecordReference):
+            return [obj]
+        references = []
+        if isinstance(obj, dict):
+            for value in obj.values():
+                references += ApiStateEnforcer._find_record_references(value)
+        elif isinstance(obj, list):
+            for value in obj:
+                references += ApiStateEnforcer._find_record_references(value)
+        return references
+
+    @staticmethod
+    def _records_identify_same_record(record_a, record_b):
+
+        # Two records identify the same record if they are of the same type and
+        # share a value for the id or one of the other identification properties
+        record_type = ForemanApiRecord.get_record_type_from_record(record_a)
+        if record_type != ForemanApiRecord.get_record_type_from_record(record_b):
+            return False
+        body_a = ForemanApiRecord.get_record_body_from_record(record_a)
+        body_b = ForemanApiRecord.get_record_body_from_record(record_b)
+        for property_name in ["id"] + ForemanApiRecord.get_alternate_identification_properties(record_type):
+            if property_name not in body_a.keys() or property_name not in body_b.keys():
+                continue
+            if isinstance(body_a[property_name], RecordReference) or isinstance(body_b[property_name], RecordReference):
+                continue
+            value_a = ForemanApiRecord.normalize_identification_value(property_name, body_a[property_name])
+            value_b = ForemanApiRecord.normalize_identification_value(property_name, body_b[property_name])
+            if value_a == value_b:
+                return True
+        return False
+
+    @staticmethod
+    def _build_dependency_graph(desired_states, keys):
+
+        # Build the set of desired states each desired state depends on
+        # A desired state depends on another if it contains a RecordReference to it,
+        # or if one of the records in its dependencies identifies the other's record
+        # When both records are being removed the order is reversed so that the dependent record is deleted first
+        predecessors = [set() for x in desired_states]
+        for x in range(0, len(desired_states)):
+            desired_state, minimal_record, key = desired_states[x]
+
+            dependency_positions = set()
+            for reference in ApiStateEnforcer._find_record_references(minimal_record):
+                if reference.key not in keys.keys():
+                    raise Exception("The reference to '{0}' did not match the key of any desired state.".format(reference.key))
+                dependency_positions.add(keys[reference.key])
+
+            for record_dependency in ForemanApiRecord.get_record_dependencies(minimal_record) or []:
+                for y in range(0, len(desired_states)):
+                    if y != x and ApiStateEnforcer._records_identify_same_record(record_dependency, desired_states[y][1]):
+                        dependency_positions.add(y)
+
+            for y in dependency_positions:
+                if y == x:
+                    raise Exception("The desired state at position {0} depends on itself.".format(x))
+                if desired_state.lower() == "absent" and desired_states[y][0].lower() == "absent":
+                    predecessors[y].add(x)
+                else:
+                    predecessors[x].add(y)
+
+        # Make sure the graph can be completed before anything is changed
+        remaining = dict((x, set(predecessors[x])) for x in range(0, len(desired_states)))
+        while remaining:
+            ready = [x for x, y in remaining.items() if not y]
+            if not ready:
+                raise Exception("The desired states contain a dependency cycle between positions {0}.".format(sorted(remaining.keys())))
+            for x in ready:
+                remaining.pop(x)
+            for y in remaining.values():
+                y.difference_update(ready)
+
+        return predecessors
+
+    @staticmethod
+    def _resolve_record_references(obj, receipts, keys):
+
+        # Return a copy of the object with the RecordReferences replaced by the values they refer to
+        if isinstance(obj, RecordReference):
+            receipt = receipts[keys[obj.key]]
+            if receipt is None or not receipt.actual_record:
+                raise Exception("The reference to '{0}' could not be resolved because the record does not exist.".format(obj.key))
+            return ForemanApiRecord.get_record_body_from_record(receipt.actual_record)[obj.property_name]
+        if isinstance(obj, dict):
+            return dict((key, ApiStateEnforcer._resolve_record_references(value, receipts, keys)) for key, value in obj.items())
+        if isinstance(obj, list):
+            return [ApiStateEnforcer._resolve_record_references(value, receipts, keys) for value in obj]
+        return obj
+
+    def ensure_states(self, desired, max_workers=4):
+
+        # This function will ensure the states of many records
+        # desired is a list of (desired_state, minimal_record) or (desired_state, minimal_record, key) tuples
+        # A dependency graph is built from the dependencies of each record and from the RecordReferences it contains
+        # Records which do not depend on each other are ensured concurrently by max_workers threads
+        # A record is only ensured once the records it depends on have been ensured
+        # The receipts are returned in the same order as the desired states
+        # If any record fails, the records which depend on it are skipped and an exception is raised once the others are done
+        # If the scheduling itself fails (or a thread is interrupted), no more records are started and the error is raised
+
+        try:
+            desired_states, keys = ApiStateEnforcer._normalize_desired_states(desired)
+            predecessors = ApiStateEnforcer._build_dependency_graph(desired_states, keys)
+        except Exception as e:
+            raise Exception("An error occurred while ensuring the api states.") from e
+
+        successors = [set() for x in desired_states]
+        for x in range(0, len(desired_states)):
+            for y in predecessors[x]:
+                successors[y].add(x)
+        waiting_on = [len(x) for x in predecessors]
+
+        receipts = [None] * len(desired_states)
+        errors = {}
+        scheduler_errors = []
+        skipped = set()
+        finished_count = [0]
+        lock = threading.Lock()
+        finished = threading.Event()
+
+        def finish(x, executor):
+            # Start the desired states which were only waiting on this one
+            # If this one failed or was skipped, they are skipped as well
+            with lock:
+                if scheduler_errors:
+                    return
+                finished_count[0] += 1
+                ready = []
+                for y in successors[x]:
+                    if x in errors.keys() or x in skipped:
+                        skipped.add(y)
+                    waiting_on[y] -= 1
+                    if waiting_on[y] == 0:
+                        ready.append(y)
+                if finished_count[0] == len(desired_states):
+                    finished.set()
+
+            for y in ready:
+                if y in skipped:
+                    logger.debug("Skipping the desired state at position {0} because a desired state it depends on failed.".format(y))
+                    finish(y, executor)
+                else:
+                    executor.submit(run, y, executor)
+
+        # The threads run under the deadline of the caller (if there is one)
+        @Deadline.bind
+        def run(x, executor):
+            desired_state, minimal_record, key = desired_states[x]
+            try:
+                try:
+                    resolved_record = ApiStateEnforcer._resolve_record_references(minimal_record, receipts, keys)
+                    receipts[x] = self.ensure_state(desired_state, resolved_record)
+                except Exception as e:
+                    with lock:
+                        errors[x] = e
+                finish(x, executor)
+            except BaseException as e:
+                # Otherwise the coordinator would wait forever for a desired state which will never finish
+                with lock:
+                    scheduler_errors.append(e)
+                finished.set()
+
+        if desired_states:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for x in [x for x in range(0, len(desired_states)) if waiting_on[x] == 0]:
+                    executor.submit(run, x, executor)
+                finished.wait()
+
+        if scheduler_errors:
+            raise Exception("An error occurred while scheduling the api states.") from scheduler_errors[0]
+
+        if errors:
+            x = min(errors.keys())
+            raise Exception("An error occurred while ensuring the api states. The desired state at position {0} failed.".format(x)) from errors[x]
+
+        return receipts
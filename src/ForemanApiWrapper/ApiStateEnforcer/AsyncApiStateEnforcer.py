@@ -0,0 +1,96 @@
+import asyncio
+import logging
+from ForemanApiWrapper.ApiStateEnforcer.ApiStateEnforcer import ApiStateEnforcer
+from ForemanApiWrapper.ForemanApiUtilities.Deadline import Deadline
+from ForemanApiWrapper.ForemanApiUtilities.ApiEndpointBalancer import ApiEndpointBalancer
+
+
+logger = logging.getLogger()
+
+
+class AsyncApiStateEnforcer(ApiStateEnforcer):
+
+    # This class is the asyncio twin of the ApiStateEnforcer
+    # It expects an AsyncForemanApiWrapper and exposes ensure_state as a coroutine
+    # Many ensure_state calls can be gathered on one event loop
+    # The number of reconciliations in progress at once is bounded by max_concurrency
+
+    def __init__(self, api_wrapper, max_concurrency=100, diagnostics=None, operation_timeout=None):
+        super().__init__(api_wrapper, diagnostics, operation_timeout)
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+
+    async def ensure_state(self, desired_state, minimal_record):
+
+        # See ApiStateEnforcer.ensure_state for a description of the logic
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async with self._semaphore:
+            # The deadline starts once a slot is free so that time spent queued does not count against it
+            with Deadline.start(self.operation_timeout), ApiEndpointBalancer.pin():
+                try:
+                    record_type = self._prepare_ensure_state(desired_state, minimal_record)
+
+                    logger.debug("Getting the current state.")
+
+                    original_record = None
+                    try:
+                        original_record = await self.api_wrapper.read_record(minimal_record)
+                    except Exception as e:
+                        ApiStateEnforcer._raise_unless_ignorable_read_exception(e)
+
+                    change_required, reason, modification = self._plan_ensure_state(desired_state, minimal_record, record_type, original_record)
+
+                    modified_record = None
+                    if modification:
+                        modified_record = await getattr(self.api_wrapper, modification)(minimal_record)
+
+                    return ApiStateEnforcer._create_receipt(desired_state, minimal_record, change_required, reason, original_record, modified_record)
+
+                except Exception as e:
+                    raise Exception("An error occurred while ensuring the api state.") from e
+
+    async def ensure_states(self, desired):
+
+        # See ApiStateEnforcer.ensure_states, the desired states are ensured by asyncio tasks
+        # A task waits for the tasks of the records it depends on before ensuring its own record
+        # The number of records being ensured at once is bounded by max_concurrency
+
+        try:
+            desired_states, keys = ApiStateEnforcer._normalize_desired_states(desired)
+            predecessors = ApiStateEnforcer._build_dependency_graph(desired_states, keys)
+        except Exception as e:
+            raise Exception("An error occurred while ensuring the api states.") from e
+
+        receipts = [None] * len(desired_states)
+        errors = {}
+        tasks = [None] * len(desired_states)
+
+        async def run(x):
+            predecessor_results = await asyncio.gather(*[tasks[y] for y in predecessors[x]])
+            if not all(predecessor_results):
+                logger.debug("Skipping the desired state at position {0} because a desired state it depends on failed.".format(x))
+                return False
+
+            desired_state, minimal_record, key = desired_states[x]
+            try:
+                resolved_record = ApiStateEnforcer._resolve_record_references(minimal_record, receipts, keys)
+                receipts[x] = await self.ensure_state(desired_state, resolved_record)
+                return True
+            except Exception as e:
+                errors[x] = e
+                return False
+
+        # The graph has no cycles, so creating the tasks in any order is safe
+        # as long as every task exists before any of them starts running
+        for x in range(0, len(desired_states)):
+            tasks[x] = asyncio.ensure_future(run(x))
+        await asyncio.gather(*tasks)
+
+        if errors:
+            x = min(errors.keys())
+            raise Exception("An error occurred while ensuring the api states. The desired state at position {0} failed.".format(x)) from errors[x]
+
+        return receipts
@@ -0,0 +1,14 @@
+class RecordReference:
+
+    # A placeholder for a value which is only known once another record has been ensured
+    # It is used in the records supplied to ApiStateEnforcer.ensure_states, for example:
+    #   ("present", {"domain": {"name": "test.foobar.com", "dns_id": RecordReference("proxy")}}, "domain")
+    # Before the record is ensured, the reference is replaced with the property (the id by default)
+    # of the record returned when the record with the key "proxy" was ensured
+
+    def __init__(self, key, property_name="id"):
+        self.key = key
+        self.property_name = property_name
+
+    def __repr__(self):
+        return "RecordReference({0!r}, {1!r})".format(self.key, self.property_name)
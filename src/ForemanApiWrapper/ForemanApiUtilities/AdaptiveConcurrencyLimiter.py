@@ -0,0 +1,153 @@
+import asyncio
+import collections
+import threading
+import time
+
+
+class AdaptiveConcurrencyLimiter:
+
+    # Limits the number of api calls in flight and adjusts the limit to what the server can handle
+    # The limit is adjusted with an AIMD (additive increase, multiplicative decrease) algorithm:
+    #   - each api call which completes in good time raises the limit by 1 / limit,
+    #     so the limit grows by about one for every "window" of successful calls
+    #     only calls which were made near the limit (with at least half of it in flight) raise it,
+    #     so the limit is not raised during quiet periods without ever having been tested
+    #   - an api call which shows the server is overloaded multiplies the limit by backoff_ratio
+    #     (at most once per round trip so that one burst of failures does not collapse the limit)
+    #
+    # An api call shows the server is overloaded if it failed with a connection error, a 429 or a 5xx
+    # or its latency was more than latency_tolerance times the baseline latency
+    # The baseline is the lowest latency observed, it drifts slowly upwards so that it follows the server
+    # An absolute latency_threshold (in seconds) can be given instead
+    #
+    # The limiter can be shared by threads (acquire/release) and event loops (acquire_async/release)
+    # acquire returns whether the call was made near the limit, which is passed to release
+    # The wait for a slot can be given a timeout (eg. the time left before a deadline), a TimeoutError is raised once it passes
+
+    def __init__(self, initial_limit=4, min_limit=1, max_limit=64, backoff_ratio=0.5, latency_tolerance=2.0, latency_threshold=None, clock=time.monotonic):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.latency_tolerance = latency_tolerance
+        self.latency_threshold = latency_threshold
+        self.clock = clock
+        self._limit = float(initial_limit)
+        self._in_flight = 0
+        self._baseline_latency = None
+        self._last_decrease = None
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._async_waiters = collections.deque()
+
+    @property
+    def limit(self):
+        with self._lock:
+            return int(self._limit)
+
+    @property
+    def in_flight(self):
+        with self._lock:
+            return self._in_flight
+
+    def _try_acquire(self):
+        if self._in_flight < int(self._limit):
+            self._in_flight += 1
+            return True
+        return False
+
+    def _is_near_limit(self, in_flight):
+        return in_flight * 2 >= int(self._limit)
+
+    def acquire(self, timeout=None):
+        with self._condition:
+            if not self._condition.wait_for(self._try_acquire, timeout):
+                raise TimeoutError("No api call slot became free within {0:.2f} seconds.".format(timeout))
+            return self._is_near_limit(self._in_flight)
+
+    async def acquire_async(self, timeout=None):
+        loop = asyncio.get_running_loop()
+        expires_at = loop.time() + timeout if timeout is not None else None
+        while True:
+            with self._lock:
+                if self._try_acquire():
+                    return self._is_near_limit(self._in_flight)
+                future = loop.create_future()
+                self._async_waiters.append((loop, future))
+            try:
+                if expires_at is None:
+                    await future
+                else:
+                    await asyncio.wait_for(future, max(0, expires_at - loop.time()))
+            except asyncio.CancelledError:
+                self._abandon_waiter(loop, future)
+                raise
+            except asyncio.TimeoutError as e:
+                self._abandon_waiter(loop, future)
+                raise TimeoutError("No api call slot became free within {0:.2f} seconds.".format(timeout)) from e
+
+    def cancel(self):
+
+        # Gives back a slot which was not used for an api call (eg. its deadline passed), the limit is not adjusted
+        with self._condition:
+            self._in_flight -= 1
+            self._wake_waiters()
+
+    def _abandon_waiter(self, loop, future):
+
+        # A waiter which is still queued is removed, one which was already woken passes its wake up on
+        # (otherwise the slot it was woken for would go unused until the next release)
+        with self._lock:
+            try:
+                self._async_waiters.remove((loop, future))
+            except ValueError:
+                self._wake_waiters()
+
+    def _wake_waiters(self):
+
+        # Wake as many waiters as there are free slots, the woken waiters compete for the slots
+        free = int(self._limit) - self._in_flight
+        self._condition.notify(max(0, free))
+        while free > 0 and self._async_waiters:
+            loop, future = self._async_waiters.popleft()
+            loop.call_soon_threadsafe(AdaptiveConcurrencyLimiter._resolve_waiter, future)
+            free -= 1
+
+    @staticmethod
+    def _resolve_waiter(future):
+        if not future.done():
+            future.set_result(None)
+
+    def _is_overloaded(self, latency):
+        if self.latency_threshold is not None:
+            return latency > self.latency_threshold
+        if self._baseline_latency is None:
+            return False
+        return latency > self._baseline_latency * self.latency_tolerance
+
+    def _update_baseline(self, latency):
+        if self._baseline_latency is None or latency < self._baseline_latency:
+            self._baseline_latency = latency
+        else:
+            self._baseline_latency += (latency - self._baseline_latency) * 0.01
+
+    def release(self, latency, overloaded=False, near_limit=None):
+
+        # The latency of the api call (in seconds), whether it failed because the server was overloaded
+        # and whether it was made near the limit (as returned by acquire, if None the calls in flight now are used)
+        # Returns the new limit
+        with self._condition:
+            if near_limit is None:
+                near_limit = self._is_near_limit(self._in_flight)
+            self._in_flight -= 1
+            overloaded = overloaded or self._is_overloaded(latency)
+            if not overloaded:
+                self._update_baseline(latency)
+                if near_limit:
+                    self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+            else:
+                now = self.clock()
+                if self._last_decrease is None or now - self._last_decrease >= (self._baseline_latency or 0):
+                    self._limit = max(self.min_limit, self._limit * self.backoff_ratio)
+                    self._last_decrease = now
+            self._wake_waiters()
+            return int(self._limit)
@@ -0,0 +1,33 @@
+import threading
+
+
+class ApiCallMetrics:
+
+    # A thread safe set of named counters describing the work done by a wrapper
+    # For example the number of api calls made or the number of complete records looked up
+    # Gauges (values which go up and down, such as the current concurrency limit) are set rather than incremented
+    # The counters can be read individually or as a snapshot
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set(self, name, value):
+        with self._lock:
+            self._counters[name] = value
+
+    def get(self, name):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
@@ -0,0 +1,70 @@
+import base64
+import gzip
+import json
+import threading
+import urllib.parse
+
+
+class ApiCassette:
+
+    # The api calls captured by a RecordingTransport, which a ReplayTransport answers api calls from
+    # Each interaction is a dict of:
+    #   method, endpoint (the path and query of the url, so a cassette can be replayed against any url),
+    #   request (the json arguments or None), status, headers (of the response), body and latency (in seconds)
+    # The body is kept as text, or base64 encoded (with body_encoding set to base64) if it is not utf-8
+    #
+    # A cassette is saved as one json document per line, gzipped if the file name ends in .gz
+
+    _kept_response_headers = ["Content-Type", "Retry-After"]
+
+    def __init__(self, interactions=None):
+        self.interactions = list(interactions) if interactions is not None else []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_endpoint(url):
+        split_url = urllib.parse.urlsplit(url)
+        return split_url.path + ("?" + split_url.query if split_url.query else "")
+
+    def add(self, http_method, url, arguments, status_code, headers, content, latency):
+        interaction = {
+            "method": http_method.upper(),
+            "endpoint": ApiCassette.get_endpoint(url),
+            "request": arguments,
+            "status": status_code,
+            "headers": dict((x, headers[x]) for x in ApiCassette._kept_response_headers if x in headers),
+            "latency": round(latency, 6)
+        }
+        try:
+            interaction["body"] = content.decode("utf-8")
+        except UnicodeDecodeError:
+            interaction["body"] = base64.b64encode(content).decode("ascii")
+            interaction["body_encoding"] = "base64"
+        with self._lock:
+            self.interactions.append(interaction)
+        return interaction
+
+    @staticmethod
+    def get_content(interaction):
+        if interaction.get("body_encoding") == "base64":
+            return base64.b64decode(interaction["body"])
+        return interaction["body"].encode("utf-8")
+
+    @staticmethod
+    def _open(path, mode):
+        if path.endswith(".gz"):
+            return gzip.open(path, mode + "t", encoding="utf-8")
+        return open(path, mode, encoding="utf-8")
+
+    def save(self, path):
+        with self._lock:
+            interactions = list(self.interactions)
+        with ApiCassette._open(path, "w") as f:
+            for interaction in interactions:
+                f.write(json.dumps(interaction, separators=(",", ":"), sort_keys=True))
+                f.write("\n")
+
+    @staticmethod
+    def load(path):
+        with ApiCassette._open(path, "r") as f:
+            return ApiCassette([json.loads(line) for line in f if line.strip()])
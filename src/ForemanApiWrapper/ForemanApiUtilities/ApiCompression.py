@@ -0,0 +1,61 @@
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+
+class ApiCompression:
+
+    # Describes how the bodies of api calls are compressed
+    # Provisioning templates and host listings are text which compresses well
+    #
+    #   accept_encoding - the encodings the server may use for responses, in order of preference
+    #                     by default gzip and deflate, and br if the brotli module is installed (requests and aiohttp decode it then)
+    #                     an empty list asks for uncompressed responses
+    #   compress_requests - whether to compress the bodies of PUT and POST calls
+    #                       Foreman (Rails behind Apache) does not decompress request bodies out of the box,
+    #                       so this should only be enabled if the server in front of it has been set up to do so
+    #   min_request_size - bodies smaller than this many bytes are sent uncompressed as compression would not pay off
+    #   request_encoding - the encoding used for request bodies (gzip, deflate or br)
+    #   level - the compression level
+
+    def __init__(self, accept_encoding=None, compress_requests=False, min_request_size=1024, request_encoding="gzip", level=6):
+        if accept_encoding is None:
+            accept_encoding = ApiCompression.get_available_encodings()
+        for encoding in list(accept_encoding) + [request_encoding]:
+            if encoding not in ApiCompression.get_available_encodings():
+                raise Exception("The encoding '{0}' is not supported.".format(encoding))
+        self.accept_encoding = list(accept_encoding)
+        self.compress_requests = compress_requests
+        self.min_request_size = min_request_size
+        self.request_encoding = request_encoding
+        self.level = level
+
+    @staticmethod
+    def get_available_encodings():
+        encodings = ["gzip", "deflate"]
+        if brotli is not None:
+            encodings.append("br")
+        return encodings
+
+    def get_accept_encoding_header(self):
+        if not self.accept_encoding:
+            return "identity"
+        return ", ".join(self.accept_encoding)
+
+    def compress_request_body(self, body):
+
+        # Returns the body to send and the value of its Content-Encoding header (None if it is not compressed)
+        if not self.compress_requests or body is None or len(body) < self.min_request_size:
+            return body, None
+        if self.request_encoding == "gzip":
+            return gzip.compress(body, compresslevel=self.level), "gzip"
+        if self.request_encoding == "deflate":
+            return zlib.compress(body, self.level), "deflate"
+        return brotli.compress(body, quality=min(self.level, 11)), "br"
@@ -0,0 +1,71 @@
+import json
+import logging
+import random
+import yaml
+
+
+class ApiDiagnostics:
+
+    # Renders the diagnostic output of the wrappers and the state enforcer
+    # Dumping records and request bodies is expensive for large records (eg. provisioning templates)
+    # so nothing is serialized unless a handler for the level is enabled on the logger
+    #
+    # The wire log is a one line summary of an api call (method, url, status, time taken and body sizes)
+    # A fraction of the api calls can be sampled into it so that production traffic can be observed
+    # without enabling debug logging
+    #   wire_log_sample_rate - the fraction of api calls written to the wire log (0 disables it, 1 logs every call)
+    #   wire_log_level - the level the wire log is written at
+
+    def __init__(self, logger=None, wire_log_sample_rate=0.0, wire_log_level=logging.INFO, wire_logger=None, random_function=random.random):
+        self.logger = logger if logger is not None else logging.getLogger()
+        self.wire_logger = wire_logger if wire_logger is not None else self.logger
+        self.wire_log_sample_rate = wire_log_sample_rate
+        self.wire_log_level = wire_log_level
+        self.random_function = random_function
+
+    def is_enabled(self, level=logging.DEBUG):
+        return self.logger.isEnabledFor(level)
+
+    def log_lines(self, title, render, level=logging.DEBUG):
+
+        # The render function is only called if the output would be written
+        if not self.logger.isEnabledFor(level):
+            return
+        self.logger.log(level, title)
+        for line in render().splitlines():
+            self.logger.log(level, line)
+
+    def log_json(self, title, obj, level=logging.DEBUG):
+        self.log_lines(title, lambda: json.dumps(obj, indent=4, sort_keys=True), level)
+
+    def log_yaml(self, title, obj, level=logging.DEBUG):
+        self.log_lines(title, lambda: yaml.dump(obj), level)
+
+    def log_api_call(self, http_method, request_url, arguments):
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        if arguments:
+            self.log_json("Json body:", arguments)
+        self.logger.debug("Making api call [%s] %s", http_method.upper(), request_url)
+
+    def sample_wire_log(self):
+
+        # Decide up front whether an api call is written to the wire log
+        if self.wire_log_sample_rate <= 0:
+            return False
+        if not self.wire_logger.isEnabledFor(self.wire_log_level):
+            return False
+        return self.wire_log_sample_rate >= 1 or self.random_function() < self.wire_log_sample_rate
+
+    def log_wire(self, http_method, request_url, status_code, elapsed, request_size, response_size, request_decoded_size=None, response_decoded_size=None):
+
+        # The sizes are those sent and received on the wire, the decoded sizes are added if the bodies were compressed
+        message = "[%s] %s status=%s time=%.1fms request_bytes=%s response_bytes=%s"
+        arguments = [http_method.upper(), request_url, status_code, elapsed * 1000, request_size, response_size]
+        if request_decoded_size is not None and request_decoded_size != request_size:
+            message += " request_decoded_bytes=%s"
+            arguments.append(request_decoded_size)
+        if response_decoded_size is not None and response_decoded_size != response_size:
+            message += " response_decoded_bytes=%s"
+            arguments.append(response_decoded_size)
+        self.wire_logger.log(self.wire_log_level, message, *arguments)
@@ -0,0 +1,150 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+
+
+class _Backend:
+
+    def __init__(self, url):
+        self.url = url
+        self.in_flight = 0
+        self.latency = None
+        self.consecutive_failures = 0
+        self.ejected_until = None
+
+
+class ApiEndpointBalancer:
+
+    # Distributes the api calls of a wrapper across several Foreman frontends (base urls) which share one database
+    #   strategy - how the frontend for an api call is chosen
+    #       round_robin - each frontend in turn
+    #       least_in_flight - the frontend with the fewest api calls in progress
+    #       latency_weighted - the frontend with the lowest average latency multiplied by the calls in progress
+    #   failure_threshold - the number of consecutive failed api calls (connection errors and transient status codes)
+    #                       after which a frontend is ejected
+    #   ejection_time - the time (in seconds) an ejected frontend is left out for, if every frontend is ejected
+    #                   the one which is due back first is used
+    #   latency_smoothing - the weight of the latest latency in the moving average of a frontend's latency
+    #
+    # A write and the reads which confirm it must see the same frontend, so an operation can be pinned:
+    # every api call made within it (including from threads started with Deadline.bind and from asyncio tasks)
+    # goes to the frontend chosen for its first call, unless that frontend is ejected
+    #
+    #   with ApiEndpointBalancer.pin():
+    #       api_wrapper.update_record(minimal_record)
+    #       api_wrapper.read_record(minimal_record)
+
+    strategies = ["round_robin", "least_in_flight", "latency_weighted"]
+
+    _pins = contextvars.ContextVar("foreman_api_wrapper_endpoint_pins", default=None)
+
+    def __init__(self, urls, strategy="round_robin", failure_threshold=3, ejection_time=30, latency_smoothing=0.3, clock=time.monotonic):
+        if not urls:
+            raise Exception("At least one url is required.")
+        if strategy not in ApiEndpointBalancer.strategies:
+            raise Exception("The balancing strategy '{0}' is not supported.".format(strategy))
+        self.backends = [_Backend(x) for x in urls]
+        self.strategy = strategy
+        self.failure_threshold = failure_threshold
+        self.ejection_time = ejection_time
+        self.latency_smoothing = latency_smoothing
+        self.clock = clock
+        self.ejections = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    @property
+    def urls(self):
+        return [x.url for x in self.backends]
+
+    def _is_healthy(self, backend, now):
+        return backend.ejected_until is None or backend.ejected_until <= now
+
+    def _choose(self, now):
+        backends = [x for x in self.backends if self._is_healthy(x, now)]
+        if not backends:
+            return min(self.backends, key=lambda x: x.ejected_until)
+
+        # The frontends are considered starting from the next one in turn, so ties are spread round robin
+        start = self._next % len(self.backends)
+        self._next += 1
+        ordered = self.backends[start:] + self.backends[:start]
+        backends = [x for x in ordered if x in backends]
+        if self.strategy == "least_in_flight":
+            return min(backends, key=lambda x: x.in_flight)
+        if self.strategy == "latency_weighted":
+            return min(backends, key=lambda x: (x.latency or 0.0) * (x.in_flight + 1))
+        return backends[0]
+
+    def acquire(self):
+
+        # Returns the base url for an api call, release must be called once the call has finished
+        with self._lock:
+            now = self.clock()
+            pins = ApiEndpointBalancer._pins.get()
+            backend = pins.get(id(self)) if pins is not None else None
+            if backend is None or not self._is_healthy(backend, now):
+                backend = self._choose(now)
+                if pins is not None:
+                    pins[id(self)] = backend
+            backend.in_flight += 1
+            return backend.url
+
+    def get_pinned_url(self):
+
+        # Returns the frontend the current operation is pinned to, None if it is not pinned (or has not made a call yet)
+        pins = ApiEndpointBalancer._pins.get()
+        with self._lock:
+            backend = pins.get(id(self)) if pins is not None else None
+            return backend.url if backend is not None else None
+
+    def release(self, url, latency, failed=False):
+        with self._lock:
+            backend = next(x for x in self.backends if x.url == url)
+            backend.in_flight -= 1
+            if failed:
+                backend.consecutive_failures += 1
+                if backend.consecutive_failures >= self.failure_threshold and self._is_healthy(backend, self.clock()):
+                    backend.ejected_until = self.clock() + self.ejection_time
+                    self.ejections += 1
+                return
+            backend.consecutive_failures = 0
+            backend.ejected_until = None
+            if backend.latency is None:
+                backend.latency = latency
+            else:
+                backend.latency += self.latency_smoothing * (latency - backend.latency)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def pin():
+
+        # Pins the api calls made within the block to one frontend per balancer, a pin within a pin keeps the outer one
+        if ApiEndpointBalancer._pins.get() is not None:
+            yield
+            return
+        token = ApiEndpointBalancer._pins.set({})
+        try:
+            yield
+        finally:
+            ApiEndpointBalancer._pins.reset(token)
+
+    @staticmethod
+    def pinned(function):
+
+        # Decorates a function (or coroutine function) so that it runs pinned
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def run_async(*args, **kwargs):
+                with ApiEndpointBalancer.pin():
+                    return await function(*args, **kwargs)
+            return run_async
+
+        @functools.wraps(function)
+        def run(*args, **kwargs):
+            with ApiEndpointBalancer.pin():
+                return function(*args, **kwargs)
+        return run
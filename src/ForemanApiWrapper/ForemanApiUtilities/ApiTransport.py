@@ -0,0 +1,58 @@
+import gzip
+import http.client
+import io
+import json
+import zlib
+import requests
+
+
+class ApiTransport:
+
+    # Sends the http requests of a ForemanApiWrapper
+    # The wrapper builds the url, headers and encoded body of every api call and hands them to its transport,
+    # so the wrapper can be pointed at something other than a live Foreman (eg. the InMemoryForemanTransport)
+    #
+    # request returns an object which behaves like a requests response:
+    #   status_code, reason, headers, content and raise_for_status()
+    #   for a streamed request also raw, iter_content(chunk_size) and close()
+    # A failure to reach the server is raised as an exception
+
+    def request(self, http_method, url, body=None, headers=None, timeout=None, stream=False):
+        raise NotImplementedError("The transport does not implement request.")
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def _decode_request_body(body, headers):
+
+        # The json arguments of an api call from the (possibly compressed) body the wrapper sent
+        if body is None:
+            return None
+        content_encoding = None
+        for key, value in (headers or {}).items():
+            if key.lower() == "content-encoding":
+                content_encoding = value
+        if content_encoding == "gzip":
+            body = gzip.decompress(body)
+        elif content_encoding == "deflate":
+            body = zlib.decompress(body)
+        return json.loads(body)
+
+    @staticmethod
+    def _create_response(url, status_code, content, headers=None, stream=False):
+
+        # Builds a requests response in the same way requests builds one from the socket
+        response = requests.Response()
+        response.status_code = status_code
+        response.reason = http.client.responses.get(status_code)
+        response.url = url
+        response.encoding = "utf-8"
+        response.headers["Content-Type"] = "application/json; charset=utf-8"
+        response.headers.update(headers or {})
+        response.headers["Content-Length"] = str(len(content))
+        if stream:
+            response.raw = io.BytesIO(content)
+        else:
+            response._content = content
+        return response
@@ -0,0 +1,51 @@
+import threading
+from ForemanApiWrapper.ForemanApiUtilities.CircuitBreaker import CircuitBreaker
+
+
+class ApiWriteTracker:
+
+    # Tracks the writes (POST, PUT, DELETE, etc.) made by a wrapper per collection of records, so that a read is not
+    # coalesced with a GET which may return the state from before a write
+    #
+    # The collection of an endpoint is its endpoint template without a trailing id
+    #   /api/domains/1 -> /api/domains
+    #   /api/operatingsystems/19/os_default_templates -> /api/operatingsystems/:id/os_default_templates
+    # Each write to a collection moves it to a new generation when it starts, the generation is part of the coalescing key
+    # so reads made after the write has started never join a GET which started before it
+    # While a write to a collection is in progress its reads are not coalesced at all
+
+    def __init__(self):
+        self._in_flight = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_collection(api_endpoint):
+        template = CircuitBreaker.get_endpoint_template(api_endpoint)
+        if template.endswith("/:id"):
+            return template[:-len("/:id")]
+        return template
+
+    def start(self, api_endpoint):
+        collection = ApiWriteTracker.get_collection(api_endpoint)
+        with self._lock:
+            self._in_flight[collection] = self._in_flight.get(collection, 0) + 1
+            self._generations[collection] = self._generations.get(collection, 0) + 1
+
+    def finish(self, api_endpoint):
+        collection = ApiWriteTracker.get_collection(api_endpoint)
+        with self._lock:
+            in_flight = self._in_flight.get(collection, 0) - 1
+            if in_flight > 0:
+                self._in_flight[collection] = in_flight
+            else:
+                self._in_flight.pop(collection, None)
+
+    def get_generation(self, api_endpoint):
+
+        # Returns the generation of the collection of the endpoint, None while a write to it is in progress
+        collection = ApiWriteTracker.get_collection(api_endpoint)
+        with self._lock:
+            if collection in self._in_flight:
+                return None
+            return self._generations.get(collection, 0)
@@ -0,0 +1,17 @@
+class AsyncApiCallResults:
+
+    # The aiohttp response object can only be read while the connection is held
+    # Once the body has been read we keep the parts of the response that the rest of the code relies on
+    # The attribute names mirror the requests response object so the ForemanApiCallException
+    # and the code inspecting it (eg. the 404 check in the ApiStateEnforcer) work the same way for both wrappers
+
+    def __init__(self, url, status_code, reason, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+
+    def raise_for_status(self):
+        if 400 <= self.status_code < 600:
+            raise Exception("{0} Error: {1} for url: {2}".format(self.status_code, self.reason, self.url))
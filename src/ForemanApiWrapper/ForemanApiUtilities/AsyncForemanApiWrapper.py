@@ -0,0 +1,710 @@
+import asyncio
+import base64
+import collections
+import logging
+import time
+from requests.auth import HTTPBasicAuth
+from ForemanApiWrapper.ForemanApiUtilities.ForemanApiCallException import ForemanApiCallException
+from ForemanApiWrapper.ForemanApiUtilities.ForemanApiWrapper import ForemanApiWrapper
+from ForemanApiWrapper.ForemanApiUtilities.AsyncApiCallResults import AsyncApiCallResults
+from ForemanApiWrapper.ForemanApiUtilities.ApiCallMetrics import ApiCallMetrics
+from ForemanApiWrapper.ForemanApiUtilities.ApiDiagnostics import ApiDiagnostics
+from ForemanApiWrapper.ForemanApiUtilities.RetryPolicy import RetryPolicy
+from ForemanApiWrapper.ForemanApiUtilities.SingleFlight import SingleFlight
+from ForemanApiWrapper.ForemanApiUtilities.ApiWriteTracker import ApiWriteTracker
+from ForemanApiWrapper.ForemanApiUtilities.StreamingResultsParser import StreamingResultsParser
+from ForemanApiWrapper.ForemanApiUtilities.ApiCompression import ApiCompression
+from ForemanApiWrapper.ForemanApiUtilities.ApiEndpointBalancer import ApiEndpointBalancer
+from ForemanApiWrapper.ForemanApiUtilities.CircuitOpenException import CircuitOpenException
+from ForemanApiWrapper.ForemanApiUtilities.Deadline import Deadline
+from ForemanApiWrapper.ForemanApiUtilities.DeadlineExceededException import DeadlineExceededException
+from ForemanApiWrapper.ForemanApiUtilities.RecordIdentityIndex import RecordIdentityIndex
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = logging.getLogger()
+
+
+class AsyncForemanApiWrapper:
+
+    # This class is the asyncio twin of the ForemanApiWrapper
+    # The CRUD functions are coroutines which allow many records to be read and written concurrently from one event loop
+    # The endpoint construction, record conversion, result matching and record comparison logic is shared
+    # with the ForemanApiWrapper, only the code which performs the api calls differs
+
+    def __init__(self, username, password, url, verify_ssl, pool_maxsize=100, pool_maxsize_per_host=10, max_concurrency=100, keep_alive=True, record_cache=None, index_records=True, diagnostics=None, retry_policy=None, rate_limiter=None, concurrency_limiter=None, coalesce_reads=True, json_codec=None, compression=None, connect_timeout=10, read_timeout=300, operation_timeout=None, authentication=None, endpoint_balancer=None, circuit_breaker=None):
+
+        if aiohttp is None:
+            raise Exception("The aiohttp module is required to use the AsyncForemanApiWrapper.")
+
+        self.username = username
+        self.password = password
+
+        # See ForemanApiWrapper, only authentication which sends a basic authentication header
+        # (the username and password, a TokenAuthentication or a SessionAuthentication) is supported
+        self.authentication = authentication if authentication is not None else HTTPBasicAuth(username, password)
+        if not isinstance(self.authentication, HTTPBasicAuth):
+            raise Exception("The AsyncForemanApiWrapper only supports basic, token and session authentication.")
+
+        # See ForemanApiWrapper, several frontends can be given as a list of urls
+        if isinstance(url, (list, tuple)):
+            if endpoint_balancer is None and len(url) > 1:
+                endpoint_balancer = ApiEndpointBalancer(url)
+            url = url[0]
+        self.url = url
+        self.endpoint_balancer = endpoint_balancer
+        self.verify_ssl = verify_ssl
+        self.pool_maxsize = pool_maxsize
+        self.pool_maxsize_per_host = pool_maxsize_per_host
+        self.max_concurrency = max_concurrency
+        self.keep_alive = keep_alive
+        self.record_cache = record_cache
+        self.record_index = RecordIdentityIndex() if index_records else None
+        self.metrics = ApiCallMetrics()
+        self.diagnostics = diagnostics if diagnostics is not None else ApiDiagnostics(logger)
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.rate_limiter = rate_limiter
+        self.concurrency_limiter = concurrency_limiter
+        self.circuit_breaker = circuit_breaker
+        self.single_flight = SingleFlight() if coalesce_reads else None
+        self.write_tracker = ApiWriteTracker()
+        self.json_codec = json_codec if json_codec is not None else ForemanApiWrapper._default_json_codec
+        self.compression = compression if compression is not None else ApiCompression()
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.operation_timeout = operation_timeout
+        self.session = None
+        self._semaphore = None
+
+    def _create_session(self):
+
+        # The aiohttp session must be created from within a running event loop
+        # so it is created on the first api call rather than in the constructor
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_maxsize,
+            limit_per_host=self.pool_maxsize_per_host,
+            force_close=not self.keep_alive)
+        headers = {
+            "Accept-Encoding": self.compression.get_accept_encoding_header()
+        }
+
+        # The session cookie is kept even if Foreman is addressed by its ip address
+        cookie_jar = aiohttp.CookieJar(unsafe=True)
+        return aiohttp.ClientSession(connector=connector, headers=headers, cookie_jar=cookie_jar)
+
+    def _acquire_base_url(self):
+
+        # See ForemanApiWrapper._acquire_base_url
+        if self.endpoint_balancer is None:
+            return self.url
+        return self.endpoint_balancer.acquire()
+
+    def _get_authorization_headers(self, use_session=True):
+
+        # With session authentication the Authorization header is left out once Foreman has set the session cookie
+        if use_session and getattr(self.authentication, "reuse_session", False):
+            if any(x.key == self.authentication.cookie_name for x in self.session.cookie_jar):
+                return {}
+        credentials = "{0}:{1}".format(self.authentication.username, self.authentication.password).encode("utf-8")
+        return {"Authorization": "Basic {0}".format(base64.b64encode(credentials).decode("ascii"))}
+
+    async def _send_request(self, http_method, request_url, request_arguments):
+
+        # If the session has expired Foreman responds with a 401, the call is then sent again with the username and password
+        while True:
+            arguments = dict(request_arguments)
+            authorization_headers = self._get_authorization_headers()
+            arguments["headers"] = dict(arguments.get("headers") or {}, **authorization_headers)
+            async with self.session.request(http_method.upper(), request_url, **arguments) as response:
+                content = await response.read()
+                results = AsyncApiCallResults(request_url, response.status, response.reason, response.headers, content)
+            if results.status_code != 401 or authorization_headers:
+                return results
+            self.authentication.count_reauthentication()
+            self.session.cookie_jar.clear(lambda x: x.key == self.authentication.cookie_name)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    @staticmethod
+    def _is_transient_error(e, results, retry_policy):
+        if results is None:
+            return isinstance(e, (aiohttp.ClientConnectionError, asyncio.TimeoutError))
+        return results.status_code in ForemanApiWrapper._get_transient_status_codes(retry_policy)
+
+    def _get_client_timeout(self, api_endpoint, http_method):
+
+        # See ForemanApiWrapper._get_request_timeout, the whole api call is also bounded by the deadline
+        connect_timeout, read_timeout = ForemanApiWrapper._get_request_timeout(self.connect_timeout, self.read_timeout, api_endpoint, http_method)
+        deadline = Deadline.current()
+        total = deadline.remaining() if deadline is not None else None
+        return aiohttp.ClientTimeout(total=total, sock_connect=connect_timeout, sock_read=read_timeout)
+
+    def _is_deadline_limited_timeout(self, e, timeout):
+
+        # See ForemanApiWrapper._is_deadline_limited_timeout
+        # aiohttp 3.10 and later tell a timeout of the connection apart from a timeout of a read from the socket
+        if timeout is None or not isinstance(e, asyncio.TimeoutError):
+            return False
+        if isinstance(e, getattr(aiohttp, "ConnectionTimeoutError", ())):
+            return timeout.sock_connect != self.connect_timeout
+        if isinstance(e, aiohttp.ServerTimeoutError):
+            return timeout.sock_read != self.read_timeout
+
+        # The total timeout is only set from the deadline
+        return timeout.total is not None
+
+    @staticmethod
+    async def _wait_before_deadline(wait, api_endpoint, http_method):
+
+        # See ForemanApiWrapper._wait_before_deadline
+        try:
+            return await wait(ForemanApiWrapper._get_wait_timeout(api_endpoint, http_method))
+        except (TimeoutError, asyncio.TimeoutError) as e:
+            raise DeadlineExceededException("The deadline of the operation was exceeded while waiting to make the api call.", api_endpoint, http_method) from e
+
+    async def make_api_call(self, api_endpoint, http_method, arguments=None, headers=None):
+
+        # See ForemanApiWrapper.make_api_call
+        if ForemanApiWrapper._is_write(http_method):
+            self.write_tracker.start(api_endpoint)
+            try:
+                return await self._make_api_call_with_retries(api_endpoint, http_method, arguments, headers)
+            finally:
+                self.write_tracker.finish(api_endpoint)
+
+        key = ForemanApiWrapper._get_coalescing_key(self.single_flight, self.write_tracker, self.endpoint_balancer, api_endpoint, http_method, arguments, headers)
+        if key is None:
+            return await self._make_api_call_with_retries(api_endpoint, http_method, arguments, headers)
+
+        results, shared = await AsyncForemanApiWrapper._wait_before_deadline(
+            lambda timeout: self.single_flight.do_async(key, lambda: self._make_api_call_with_retries(api_endpoint, http_method, arguments, headers), timeout),
+            api_endpoint,
+            http_method)
+        if shared:
+            self.metrics.increment("coalesced_calls")
+        return results
+
+    async def _make_api_call_with_retries(self, api_endpoint, http_method, arguments, headers):
+        return await self._retry_api_call(lambda: self._make_api_call_attempt(api_endpoint, http_method, arguments, headers), api_endpoint, http_method)
+
+    async def _retry_api_call(self, coroutine_function, api_endpoint, http_method):
+
+        # See ForemanApiWrapper._retry_api_call, the wait between attempts does not block the event loop
+        attempt = 0
+        while True:
+            try:
+                results = await coroutine_function()
+            except (DeadlineExceededException, CircuitOpenException):
+                raise
+            except ForemanApiCallException as ex:
+                ForemanApiWrapper._raise_if_deadline_exceeded(api_endpoint, http_method, ex)
+                delay = ForemanApiWrapper._get_retry_delay(self.retry_policy, ex, http_method, attempt)
+                if delay is None:
+                    raise
+                deadline = Deadline.current()
+                if deadline is not None and deadline.remaining() <= delay:
+                    raise DeadlineExceededException("The deadline of the operation would be exceeded before the api call could be retried.", api_endpoint, http_method) from ex
+                self.metrics.increment("retries")
+                logger.debug("Retrying api call [%s] %s in %.2f seconds.", http_method.upper(), api_endpoint, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+            else:
+                self.retry_policy.record_success()
+                return results
+
+    async def _make_api_call_attempt(self, api_endpoint, http_method, arguments, headers):
+
+        # The number of api calls in flight at any one time is bounded by a semaphore
+        # This allows hundreds of reconciliations to be scheduled without flooding the server
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        ForemanApiWrapper._raise_if_deadline_exceeded(api_endpoint, http_method)
+        ForemanApiWrapper._acquire_circuit(self.circuit_breaker, self.metrics, api_endpoint, http_method)
+        results = None
+        failed = None
+        timeout = None
+        try:
+            if self.session is None:
+                self.session = self._create_session()
+
+            if headers is None:
+                headers = ForemanApiWrapper._get_headers_for_http_method(http_method)
+
+            body, request_headers, request_decoded_size = ForemanApiWrapper._encode_api_call_arguments(arguments, headers, self.json_codec, self.compression)
+            request_arguments = {"ssl": None if self.verify_ssl else False}
+            if body is not None:
+                request_arguments["data"] = body
+                request_arguments["headers"] = request_headers
+
+            # The rate limiter is waited on before taking a slot from the semaphore
+            # so that waiting calls do not hold back calls which could be made
+            # The waits are bounded by the deadline, the call is not made if the deadline would pass first
+            if self.rate_limiter is not None:
+                if await AsyncForemanApiWrapper._wait_before_deadline(lambda timeout: self.rate_limiter.acquire_async(http_method, timeout), api_endpoint, http_method) > 0:
+                    self.metrics.increment("rate_limited_calls")
+
+            await AsyncForemanApiWrapper._wait_before_deadline(lambda timeout: asyncio.wait_for(self._semaphore.acquire(), timeout), api_endpoint, http_method)
+            try:
+
+                # The max_concurrency semaphore is a fixed upper bound, the adaptive limiter works within it
+                near_limit = None
+                if self.concurrency_limiter is not None:
+                    near_limit = await AsyncForemanApiWrapper._wait_before_deadline(self.concurrency_limiter.acquire_async, api_endpoint, http_method)
+
+                # The timeouts are worked out after the waits, from the time left before the deadline
+                try:
+                    timeout = self._get_client_timeout(api_endpoint, http_method)
+                    request_arguments["timeout"] = timeout
+                except DeadlineExceededException:
+                    if self.concurrency_limiter is not None:
+                        self.concurrency_limiter.cancel()
+                    raise
+
+                base_url = self._acquire_base_url()
+                request_url = base_url + api_endpoint
+                start = time.monotonic()
+                try:
+                    self.diagnostics.log_api_call(http_method, request_url, arguments)
+                    self.metrics.increment("api_calls")
+                    sampled = self.diagnostics.sample_wire_log()
+                    results = await self._send_request(http_method, request_url, request_arguments)
+                finally:
+                    if self.concurrency_limiter is not None:
+                        ForemanApiWrapper._release_concurrency_limiter(self.concurrency_limiter, self.metrics, self.retry_policy, start, results, near_limit)
+                    ForemanApiWrapper._release_endpoint_balancer(self.endpoint_balancer, base_url, self.retry_policy, start, results)
+            finally:
+                self._semaphore.release()
+
+            # aiohttp decompresses the body as it is read, so the wire size is taken from the Content-Length
+            request_wire_size = len(body) if body is not None else 0
+            response_decoded_size = len(results.content)
+            response_wire_size = ForemanApiWrapper._get_response_wire_size(results)
+            ForemanApiWrapper._count_api_call_bytes(self.metrics, request_wire_size, request_decoded_size, response_wire_size, response_decoded_size)
+
+            if sampled:
+                self.diagnostics.log_wire(
+                    http_method,
+                    request_url,
+                    results.status_code,
+                    time.monotonic() - start,
+                    request_wire_size,
+                    response_wire_size,
+                    request_decoded_size,
+                    response_decoded_size)
+
+            # Raise an exception if we did not get a 200 response
+            failed = False
+            results.raise_for_status()
+
+            return ForemanApiWrapper._decode_api_call_results(results.content, self.json_codec)
+        except DeadlineExceededException:
+            raise
+        except Exception as e:
+            if self._is_deadline_limited_timeout(e, timeout):
+                raise DeadlineExceededException("The deadline of the operation was exceeded during the api call.", api_endpoint, http_method) from e
+            transient = AsyncForemanApiWrapper._is_transient_error(e, results, self.retry_policy)
+            failed = transient
+            ex = ForemanApiWrapper._create_api_call_exception(api_endpoint, http_method, results, arguments, headers, transient)
+            raise ex from e
+        finally:
+            ForemanApiWrapper._release_circuit(self.circuit_breaker, self.metrics, api_endpoint, http_method, failed)
+
+    async def _open_streaming_api_call_attempt(self, api_endpoint):
+
+        # See ForemanApiWrapper._open_streaming_api_call_attempt
+        ForemanApiWrapper._raise_if_deadline_exceeded(api_endpoint, "GET")
+        ForemanApiWrapper._acquire_circuit(self.circuit_breaker, self.metrics, api_endpoint, "GET")
+        results = None
+        failed = None
+        timeout = None
+        try:
+            if self.session is None:
+                self.session = self._create_session()
+
+            if self.rate_limiter is not None:
+                if await AsyncForemanApiWrapper._wait_before_deadline(lambda timeout: self.rate_limiter.acquire_async("GET", timeout), api_endpoint, "GET") > 0:
+                    self.metrics.increment("rate_limited_calls")
+
+            timeout = self._get_client_timeout(api_endpoint, "GET")
+            # A streamed call is always sent with the Authorization header as it cannot be sent again once the body is being read
+            headers = self._get_authorization_headers(use_session=False)
+
+            base_url = self._acquire_base_url()
+            request_url = base_url + api_endpoint
+            start = time.monotonic()
+            try:
+                self.diagnostics.log_api_call("GET", request_url, None)
+                self.metrics.increment("api_calls")
+                response = await self.session.request("GET", request_url, ssl=None if self.verify_ssl else False, timeout=timeout, headers=headers)
+                results = AsyncApiCallResults(request_url, response.status, response.reason, response.headers, b"")
+            finally:
+                ForemanApiWrapper._release_endpoint_balancer(self.endpoint_balancer, base_url, self.retry_policy, start, results)
+            if response.status >= 400:
+                content = await response.read()
+                response.release()
+                results = AsyncApiCallResults(request_url, response.status, response.reason, response.headers, content)
+                results.raise_for_status()
+            failed = False
+            return response
+        except DeadlineExceededException:
+            raise
+        except Exception as e:
+            if self._is_deadline_limited_timeout(e, timeout):
+                raise DeadlineExceededException("The deadline of the operation was exceeded during the api call.", api_endpoint, "GET") from e
+            transient = AsyncForemanApiWrapper._is_transient_error(e, results, self.retry_policy)
+            failed = transient
+            ex = ForemanApiWrapper._create_api_call_exception(api_endpoint, "GET", results, None, None, transient)
+            raise ex from e
+        finally:
+            ForemanApiWrapper._release_circuit(self.circuit_breaker, self.metrics, api_endpoint, "GET", failed)
+
+    async def _stream_api_call(self, api_endpoint, envelope):
+
+        # See ForemanApiWrapper._stream_api_call
+        response = await self._retry_api_call(lambda: self._open_streaming_api_call_attempt(api_endpoint), api_endpoint, "GET")
+        try:
+            parser = StreamingResultsParser(self.json_codec)
+            response_decoded_size = 0
+            async for chunk in response.content.iter_chunked(ForemanApiWrapper._stream_chunk_size):
+                response_decoded_size += len(chunk)
+                for record_body in parser.feed(chunk):
+                    yield record_body
+            envelope.update(parser.close())
+            response_wire_size = response.content_length if response.content_length is not None else response_decoded_size
+            ForemanApiWrapper._count_api_call_bytes(self.metrics, 0, 0, response_wire_size, response_decoded_size)
+        finally:
+            response.release()
+
+    async def _match_record_in_results(self, minimal_record, record_type, results, query_key, query_value):
+
+        # See ForemanApiWrapper._match_record_in_results for the reasons this is required
+
+        logging.debug("Checking if any of the records in the result set contain the correct field and value.")
+        logging.debug("The key was '{0}' while the value was '{1}'.".format(query_key, query_value))
+
+        matched_records, records_requiring_lookup = ForemanApiWrapper._partition_results_for_query(
+            minimal_record, record_type, results, query_key, query_value)
+
+        # The remaining records are looked up concurrently
+        if records_requiring_lookup:
+            looked_up_records = await asyncio.gather(*[
+                self._lookup_record_using_partial(result_record) for x, result_record in records_requiring_lookup])
+
+            matched_records += ForemanApiWrapper._match_looked_up_records(record_type, records_requiring_lookup, looked_up_records, query_key, query_value)
+
+        return ForemanApiWrapper._select_matched_record(matched_records, query_key)
+
+    async def _get_record_from_results(self, minimal_record, record_type, results, query_key, query_value):
+
+        # See ForemanApiWrapper._get_record_from_results
+        record = ForemanApiWrapper._get_record_from_results_without_matching(self.record_index, minimal_record, record_type, results, query_key)
+        if record is not None:
+            return record
+        matched_record = await self._match_record_in_results(minimal_record, record_type, results, query_key, query_value)
+        if matched_record is None:
+            return None, False
+        return matched_record
+
+    async def _read_record_using_combined_search(self, minimal_record, record_type, identification_properties, scope):
+
+        # See ForemanApiWrapper._read_record_using_combined_search
+        endpoint = ForemanApiWrapper._create_combined_search_endpoint(minimal_record, record_type, identification_properties)
+        try:
+            results = await self.make_api_call(endpoint, "GET")
+        except ForemanApiCallException as ex:
+            ForemanApiWrapper._raise_unless_ignorable(ex, "The combined search failed:")
+            return False, None
+        searched, has_results = ForemanApiWrapper._prepare_combined_search_results(self.record_index, record_type, results, scope)
+        if not has_results:
+            return searched, None
+
+        for identification_property in identification_properties:
+            matched_record = await self._match_record_in_results(minimal_record, record_type, results, identification_property, minimal_record[record_type][identification_property])
+            if matched_record is None:
+                continue
+            return True, await self._complete_record(*matched_record)
+        return True, None
+
+    async def _read_record_by_id(self, minimal_record, record_type):
+
+        # See ForemanApiWrapper._read_record_by_id
+        endpoint = ForemanApiWrapper._create_api_endpoint_string_for_record(minimal_record, "id", minimal_record[record_type]["id"])
+        try:
+            results = await self.make_api_call(endpoint, "GET")
+        except ForemanApiCallException as ex:
+            ForemanApiWrapper._raise_unless_ignorable(ex)
+            return None
+        return {record_type: results}
+
+    async def _lookup_record_using_partial(self, partial_record):
+        logging.debug("Doing an additional read to lookup complete record using id field from record.")
+        self.metrics.increment("complete_record_lookups")
+        record = await self.read_record(partial_record, identification_properties=['id'])
+        logging.debug("Lookup successful.")
+        return record
+
+    async def _complete_record(self, record, record_is_complete):
+
+        # See ForemanApiWrapper._complete_record
+        if record_is_complete:
+            return record
+        return await self._lookup_record_using_partial(record)
+
+    async def _read_record_using_index(self, minimal_record, record_type, identification_properties, scope):
+
+        # See ForemanApiWrapper._read_record_using_index
+        for identification_property, identification_property_value, record_id in ForemanApiWrapper._get_indexed_ids(
+                self.record_index, minimal_record, identification_properties, scope):
+            logging.debug("Reading record using the id '{0}' indexed for property '{1}'.".format(record_id, identification_property))
+            endpoint = ForemanApiWrapper._create_api_endpoint_string_for_record(minimal_record, "id", record_id)
+            try:
+                results = await self.make_api_call(endpoint, "GET")
+            except ForemanApiCallException as ex:
+                ForemanApiWrapper._raise_unless_ignorable(ex)
+                results = None
+
+            if ForemanApiWrapper._is_indexed_record_stale(self.record_index, record_type, results, identification_property, identification_property_value, scope):
+                continue
+
+            return {record_type: results}
+        return None
+
+    @Deadline.operation
+    async def read_record(self, minimal_record, identification_properties=[]):
+
+        # See ForemanApiWrapper.read_record for a description of the lookup logic
+
+        try:
+            record_type, identification_properties, scope = ForemanApiWrapper._get_read_identification_properties(minimal_record, identification_properties)
+            cached_record = ForemanApiWrapper._get_cached_record(self.record_cache, minimal_record, identification_properties, scope)
+            if cached_record is not None:
+                return cached_record
+
+            if ForemanApiWrapper._can_read_record_by_id(minimal_record, record_type, identification_properties):
+                record = await self._read_record_by_id(minimal_record, record_type)
+                if record is not None:
+                    ForemanApiWrapper._remember_read_record(self.record_cache, self.record_index, record, scope)
+                    return record
+                identification_properties = identification_properties[1:]
+
+            indexed_record = await self._read_record_using_index(minimal_record, record_type, identification_properties, scope)
+            if indexed_record is not None:
+                ForemanApiWrapper._remember_read_record(self.record_cache, self.record_index, indexed_record, scope)
+                return indexed_record
+
+            if len(identification_properties) > 1:
+                searched, record = await self._read_record_using_combined_search(minimal_record, record_type, identification_properties, scope)
+                if searched:
+                    if record is None:
+                        logging.debug("None of the properties matched any existing records.")
+                        return None
+                    ForemanApiWrapper._remember_read_record(self.record_cache, self.record_index, record, scope)
+                    return record
+
+            for identification_property, identification_property_value, endpoint in ForemanApiWrapper._get_property_lookups(minimal_record, record_type, identification_properties):
+                logging.debug("Looking up record using property '{0}'.".format(identification_property))
+                try:
+                    results = await self.make_api_call(endpoint, "GET")
+                except ForemanApiCallException as ex:
+                    ForemanApiWrapper._raise_unless_ignorable(ex)
+                    continue
+
+                record, record_is_complete = await self._get_record_from_results(minimal_record, record_type, results, identification_property, identification_property_value)
+
+                # If we got none, we did not identify the record with the specified property. We will keep looking
+                if record is None:
+                    continue
+
+                record = await self._complete_record(record, record_is_complete)
+
+                ForemanApiWrapper._remember_read_record(self.record_cache, self.record_index, record, scope)
+
+                return record
+
+            logging.debug("None of the properties matched any existing records.")
+        except Exception as e:
+            raise Exception("An error occurred while reading the record.") from e
+
+    async def _fetch_page(self, record_type, search, page, per_page, dependencies):
+        endpoint = ForemanApiWrapper._create_list_endpoint(record_type, search, page, per_page, dependencies)
+        results = await self.make_api_call(endpoint, "GET")
+        page_records, subtotal, page_size = ForemanApiWrapper._get_page_from_results(results, per_page)
+        ForemanApiWrapper._index_records(self.record_index, record_type, page_records, ForemanApiWrapper._get_list_scope(record_type, dependencies))
+        return page_records, subtotal, page_size
+
+    async def _fetch_pages_concurrently(self, record_type, search, per_page, dependencies, pages, page_concurrency, ordered):
+
+        # See ForemanApiWrapper._fetch_pages_concurrently, the pages are fetched by asyncio tasks
+
+        pages = iter(pages)
+        in_flight = collections.deque()
+
+        def request_next_page():
+            page = next(pages, None)
+            if page is not None:
+                in_flight.append(asyncio.ensure_future(self._fetch_page(record_type, search, page, per_page, dependencies)))
+
+        try:
+            for x in range(0, page_concurrency):
+                request_next_page()
+
+            while in_flight:
+                if ordered:
+                    task = in_flight.popleft()
+                else:
+                    done, not_done = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    task = done.pop()
+                    in_flight.remove(task)
+
+                page_records, subtotal, page_size = await task
+                request_next_page()
+                yield page_records
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+    async def _stream_pages(self, record_type, search, per_page, dependencies):
+
+        # See ForemanApiWrapper._stream_pages
+        scope = ForemanApiWrapper._get_list_scope(record_type, dependencies)
+        page = 1
+        while True:
+            endpoint = ForemanApiWrapper._create_list_endpoint(record_type, search, page, per_page, dependencies)
+            envelope = {}
+            page_record_count = 0
+            async for page_record in self._stream_api_call(endpoint, envelope):
+                page_record_count += 1
+                ForemanApiWrapper._index_records(self.record_index, record_type, [page_record], scope)
+                yield page_record
+
+            page_records, subtotal, page_size = ForemanApiWrapper._get_page_from_results(envelope, per_page)
+            if ForemanApiWrapper._is_last_page(page, page_size, subtotal, page_record_count):
+                break
+            page += 1
+
+    async def list_records(self, record_type, search=None, per_page=100, dependencies=None, page_concurrency=1, ordered=True, stream=False):
+
+        # See ForemanApiWrapper.list_records, the records are yielded from an asynchronous generator
+
+        try:
+            if stream:
+                async for page_record in self._stream_pages(record_type, search, per_page, dependencies):
+                    yield {record_type: page_record}
+                return
+
+            page = 1
+            while True:
+                page_records, subtotal, page_size = await self._fetch_page(record_type, search, page, per_page, dependencies)
+
+                for page_record in page_records:
+                    yield {record_type: page_record}
+
+                if ForemanApiWrapper._is_last_page(page, page_size, subtotal, len(page_records)):
+                    break
+
+                if page_concurrency > 1 and subtotal is not None:
+                    remaining_pages = range(page + 1, ForemanApiWrapper._get_last_page(subtotal, page_size) + 1)
+                    async for page_records in self._fetch_pages_concurrently(record_type, search, per_page, dependencies, remaining_pages, page_concurrency, ordered):
+                        for page_record in page_records:
+                            yield {record_type: page_record}
+                    break
+
+                page += 1
+        except Exception as e:
+            raise Exception("An error occurred while listing the records.") from e
+
+    @Deadline.operation
+    async def read_records(self, records, complete_records=True, max_search_length=4000):
+
+        # See ForemanApiWrapper.read_records, the complete records are looked up concurrently by asyncio tasks
+
+        try:
+            read_records = [None] * len(records)
+            records_to_lookup = []
+
+            for record_type, query_key, uncached_records, searches, per_page, dependencies in ForemanApiWrapper._plan_batch_read(
+                    self.record_cache, records, max_search_length, read_records, records_to_lookup):
+                result_bodies = []
+                for search in searches:
+                    async for result_record in self.list_records(record_type, search=search, per_page=per_page, dependencies=dependencies):
+                        result_bodies.append(result_record[record_type])
+                ForemanApiWrapper._apply_batch_results(record_type, query_key, uncached_records, result_bodies, complete_records, read_records, records_to_lookup)
+
+            if records_to_lookup:
+                looked_up_records = await asyncio.gather(*[self._lookup_record_using_partial(record) for x, record in records_to_lookup])
+                for (x, record), looked_up_record in zip(records_to_lookup, looked_up_records):
+                    read_records[x] = looked_up_record
+
+            return read_records
+        except Exception as e:
+            raise Exception("An error occurred while reading the records.") from e
+
+    @Deadline.operation
+    @ApiEndpointBalancer.pinned
+    async def create_record(self, minimal_record):
+
+        try:
+            scope = ForemanApiWrapper._get_record_scope(minimal_record)
+            set_url, http_method, api_call_arguments, headers, record_type = ForemanApiWrapper._prepare_create_record_call(minimal_record)
+            created_record_body = await self.make_api_call(set_url, http_method, api_call_arguments, headers)
+            created_record = {record_type: created_record_body}
+
+            ForemanApiWrapper._remember_modified_record(self.record_cache, self.record_index, minimal_record, created_record, http_method, scope)
+
+            return created_record
+
+        except Exception as e:
+            raise Exception("An error occurred while creating the record.") from e
+
+    @Deadline.operation
+    @ApiEndpointBalancer.pinned
+    async def update_record(self, minimal_record):
+
+        try:
+            scope = ForemanApiWrapper._get_record_scope(minimal_record)
+            set_url, http_method, api_call_arguments, headers, record_type = ForemanApiWrapper._prepare_update_record_call(minimal_record)
+            updated_record_body = await self.make_api_call(set_url, http_method, api_call_arguments, headers)
+            updated_record = {record_type: updated_record_body}
+
+            # Verify that the updated record has the same id as the minimal record
+            ForemanApiWrapper._confirm_modified_record(minimal_record, updated_record, set_url, http_method)
+
+            ForemanApiWrapper._remember_modified_record(self.record_cache, self.record_index, minimal_record, updated_record, http_method, scope)
+
+            return updated_record
+
+        except Exception as e:
+            raise Exception("An error occurred while updating the record.") from e
+
+    @Deadline.operation
+    @ApiEndpointBalancer.pinned
+    async def delete_record(self, minimal_record):
+
+        try:
+            scope = ForemanApiWrapper._get_record_scope(minimal_record)
+            encoded_delete_endpoint, http_method, api_call_arguments, minimal_record_type = ForemanApiWrapper._prepare_delete_record_call(minimal_record)
+            deleted_record_body = await self.make_api_call(encoded_delete_endpoint, http_method, api_call_arguments, None)
+            deleted_record = {minimal_record_type: deleted_record_body}
+
+            # Verify that the deleted record has the same value for the identification field
+            ForemanApiWrapper._confirm_modified_record(minimal_record, deleted_record, encoded_delete_endpoint, http_method)
+
+            ForemanApiWrapper._remember_modified_record(self.record_cache, self.record_index, minimal_record, deleted_record, http_method, scope)
+
+            return deleted_record
+
+        except Exception as e:
+            raise Exception("An error occurred while deleting the record.") from e
@@ -0,0 +1,109 @@
+import threading
+import time
+
+
+class _Circuit:
+
+    def __init__(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probes = 0
+
+
+class CircuitBreaker:
+
+    # Stops api calls from being sent to an endpoint which keeps failing, so that they fail immediately
+    # rather than each waiting for its own timeout (eg. a plugin endpoint such as os_default_templates timing out)
+    #
+    # There is a circuit for each http method and endpoint template, the endpoint with the ids and names replaced
+    #   /api/operatingsystems/19/os_default_templates -> /api/operatingsystems/:id/os_default_templates
+    # A circuit is in one of three states:
+    #   closed - api calls are sent, it opens after failure_threshold consecutive failed api calls
+    #   open - api calls are rejected, after reset_timeout seconds it becomes half open
+    #   half_open - at most half_open_calls api calls (probes) are sent at a time,
+    #               a successful probe closes the circuit and a failed probe opens it again
+    #
+    # An api call fails if it got no response (eg. a timeout) or a transient status code (see RetryPolicy)
+    # Other error responses (eg. a 404 for a missing record) show the endpoint is working
+    # The breaker can be shared by several wrappers (and threads and event loops)
+
+    states = ["closed", "open", "half_open"]
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, half_open_calls=1, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.clock = clock
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_endpoint_template(api_endpoint):
+
+        # The segments after /api alternate between collections and the ids (or names) of records in them
+        path = api_endpoint.split("?", 1)[0]
+        segments = path.strip("/").split("/")
+        if not segments or segments[0] != "api":
+            return path
+        segments = segments[0:1] + [x if i % 2 == 0 else ":id" for i, x in enumerate(segments[1:])]
+        return "/" + "/".join(segments)
+
+    @staticmethod
+    def get_circuit_key(api_endpoint, http_method):
+        return http_method.upper(), CircuitBreaker.get_endpoint_template(api_endpoint)
+
+    def get_state(self, api_endpoint, http_method):
+        with self._lock:
+            circuit = self._circuits.get(CircuitBreaker.get_circuit_key(api_endpoint, http_method))
+            return circuit.state if circuit is not None else "closed"
+
+    def get_open_circuits(self):
+
+        # Returns the keys (http method, endpoint template) of the circuits which are not closed
+        with self._lock:
+            return sorted(key for key, circuit in self._circuits.items() if circuit.state != "closed")
+
+    def acquire(self, api_endpoint, http_method):
+
+        # Returns whether the api call may be sent and the state the circuit changed to (None if it did not change)
+        # release must be called once an api call which was allowed has finished
+        with self._lock:
+            key = CircuitBreaker.get_circuit_key(api_endpoint, http_method)
+            circuit = self._circuits.setdefault(key, _Circuit())
+            transition = None
+            if circuit.state == "open":
+                if self.clock() - circuit.opened_at < self.reset_timeout:
+                    return False, None
+                circuit.state = "half_open"
+                circuit.probes = 0
+                transition = "half_open"
+            if circuit.state == "half_open":
+                if circuit.probes >= self.half_open_calls:
+                    return False, transition
+                circuit.probes += 1
+            return True, transition
+
+    def release(self, api_endpoint, http_method, failed):
+
+        # Reports the outcome of an api call, returns the state the circuit changed to (None if it did not change)
+        # An outcome of None (eg. the call was abandoned as its deadline was reached) says nothing about the endpoint
+        with self._lock:
+            circuit = self._circuits[CircuitBreaker.get_circuit_key(api_endpoint, http_method)]
+            if circuit.state == "half_open":
+                circuit.probes = max(0, circuit.probes - 1)
+            if failed is None:
+                return None
+            if not failed:
+                circuit.consecutive_failures = 0
+                if circuit.state == "closed":
+                    return None
+                circuit.state = "closed"
+                return "closed"
+
+            circuit.consecutive_failures += 1
+            if circuit.state == "half_open" or (circuit.state == "closed" and circuit.consecutive_failures >= self.failure_threshold):
+                circuit.state = "open"
+                circuit.opened_at = self.clock()
+                return "open"
+            return None
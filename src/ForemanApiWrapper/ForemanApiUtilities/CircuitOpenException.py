@@ -0,0 +1,10 @@
+from ForemanApiWrapper.ForemanApiUtilities.ForemanApiCallException import ForemanApiCallException
+
+
+class CircuitOpenException(ForemanApiCallException):
+
+    def __init__(self, message, endpoint, method):
+
+        # The api call was not sent, so nothing can be concluded about the record and the exception is transient
+        # It is not retried, the circuit stays open for longer than the retry policy waits
+        super().__init__(message, endpoint, method, None, transient=True)
@@ -0,0 +1,85 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import time
+
+
+class Deadline:
+
+    # A point in time by which an operation (eg. a read_record with its fallback properties and follow up lookups,
+    # or the read-compare-write cycle of an ensure_state) must be finished
+    # The current deadline is kept in a context variable so that every api call made by the operation can see it,
+    # the wrappers shorten the timeouts of their api calls to the time remaining and stop once it has passed
+    #
+    # A deadline is started with a context manager, a deadline started within another keeps the earlier of the two:
+    #
+    #   with Deadline.start(30):
+    #       api_wrapper.read_record(minimal_record)
+    #
+    # Asyncio tasks inherit the deadline of the code which created them, threads do not,
+    # so functions handed to a thread pool are wrapped with Deadline.bind
+    # (which carries the rest of the context over too, eg. the pin of an ApiEndpointBalancer)
+
+    _current = contextvars.ContextVar("foreman_api_wrapper_deadline", default=None)
+
+    def __init__(self, timeout, clock=time.monotonic):
+        self.clock = clock
+        self.expires_at = clock() + timeout
+
+    def remaining(self):
+        return max(0.0, self.expires_at - self.clock())
+
+    def expired(self):
+        return self.clock() >= self.expires_at
+
+    @staticmethod
+    def current():
+        return Deadline._current.get()
+
+    @staticmethod
+    @contextlib.contextmanager
+    def start(timeout):
+
+        # A timeout of None does not start a deadline (an enclosing deadline still applies)
+        current = Deadline.current()
+        if timeout is None:
+            yield current
+            return
+
+        deadline = Deadline(timeout)
+        if current is not None and current.expires_at <= deadline.expires_at:
+            deadline = current
+        token = Deadline._current.set(deadline)
+        try:
+            yield deadline
+        finally:
+            Deadline._current.reset(token)
+
+    @staticmethod
+    def bind(function):
+
+        # Returns a function which runs with the deadline (and the rest of the context) which is current now
+        # Each call runs in its own copy of the context as a context cannot be entered by two threads at once
+        context = contextvars.copy_context()
+
+        def run(*args, **kwargs):
+            return context.copy().run(function, *args, **kwargs)
+        return run
+
+    @staticmethod
+    def operation(function):
+
+        # Decorates a method so that it runs under a deadline of the operation_timeout of its object
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def run_async(self, *args, **kwargs):
+                with Deadline.start(getattr(self, "operation_timeout", None)):
+                    return await function(self, *args, **kwargs)
+            return run_async
+
+        @functools.wraps(function)
+        def run(self, *args, **kwargs):
+            with Deadline.start(getattr(self, "operation_timeout", None)):
+                return function(self, *args, **kwargs)
+        return run
@@ -0,0 +1,10 @@
+from ForemanApiWrapper.ForemanApiUtilities.ForemanApiCallException import ForemanApiCallException
+
+
+class DeadlineExceededException(ForemanApiCallException):
+
+    def __init__(self, message, endpoint, method):
+
+        # The deadline says nothing about the record, so the exception is transient
+        # This stops read_record from treating it as a missing record
+        super().__init__(message, endpoint, method, None, transient=True)
@@ -1,6 +1,6 @@
 class ForemanApiCallException(Exception):
 
-    def __init__(self, message, endpoint, method, results, arguments=None, headers=None):
+    def __init__(self, message, endpoint, method, results, arguments=None, headers=None, transient=False):
 
         # Call the base class constructor with the parameters it needs
         super(ForemanApiCallException, self).__init__(message)
@@ -11,3 +11,7 @@ class ForemanApiCallException(Exception):
         self.results = results
         self.arguments=arguments
         self.headers=headers
+
+        # Whether the api call failed because the server was (temporarily) unavailable
+        # rather than because of the request, in which case nothing can be concluded about the record
+        self.transient=transient
@@ -1,10 +1,29 @@
 import requests
-import json
 import logging
 import sys
 import os
+import math
+import time
+import collections
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from requests.auth import HTTPBasicAuth
 from ForemanApiWrapper.ForemanApiUtilities.ForemanApiCallException import ForemanApiCallException
+from ForemanApiWrapper.ForemanApiUtilities.ApiCallMetrics import ApiCallMetrics
+from ForemanApiWrapper.ForemanApiUtilities.ApiDiagnostics import ApiDiagnostics
+from ForemanApiWrapper.ForemanApiUtilities.RetryPolicy import RetryPolicy
+from ForemanApiWrapper.ForemanApiUtilities.SingleFlight import SingleFlight
+from ForemanApiWrapper.ForemanApiUtilities.ApiWriteTracker import ApiWriteTracker
+from ForemanApiWrapper.ForemanApiUtilities.JsonCodec import JsonCodec
+from ForemanApiWrapper.ForemanApiUtilities.ApiCompression import ApiCompression
+from ForemanApiWrapper.ForemanApiUtilities.RequestsTransport import RequestsTransport
+from ForemanApiWrapper.ForemanApiUtilities.RecordingTransport import RecordingTransport
+from ForemanApiWrapper.ForemanApiUtilities.ApiEndpointBalancer import ApiEndpointBalancer
+from ForemanApiWrapper.ForemanApiUtilities.CircuitBreaker import CircuitBreaker
+from ForemanApiWrapper.ForemanApiUtilities.CircuitOpenException import CircuitOpenException
+from ForemanApiWrapper.ForemanApiUtilities.Deadline import Deadline
+from ForemanApiWrapper.ForemanApiUtilities.DeadlineExceededException import DeadlineExceededException
+from ForemanApiWrapper.ForemanApiUtilities.StreamingResultsParser import StreamingResultsParser
+from ForemanApiWrapper.ForemanApiUtilities.RecordIdentityIndex import RecordIdentityIndex
 from ForemanApiWrapper.RecordUtilities import ForemanApiRecord
 from ForemanApiWrapper.ForemanApiUtilities.ModifiedRecordMismatchException import ModifiedRecordMismatchException
 from ForemanApiWrapper.ForemanApiUtilities.Mappings.ApiRecordIdentificationProperties import ApiRecordIdentificationProperties
@@ -26,13 +45,57 @@ class ForemanApiWrapper:
 
     _api_call_error_message = "An error occurred while making an API call. The message could not be extracted. Check json results for more details."
     _modified_record_mismatch_message = "The API modified a different record than the one supplied."
+    _default_json_codec = JsonCodec()
+    _stream_chunk_size = 64 * 1024
+    _circuit_transition_metrics = {"open": "circuits_opened", "half_open": "circuits_half_opened", "closed": "circuits_closed"}
 
-    def __init__(self, username, password, url, verify_ssl):
+    def __init__(self, username, password, url, verify_ssl, pool_connections=10, pool_maxsize=10, pool_block=False, keep_alive=True, lookup_concurrency=4, record_cache=None, index_records=True, diagnostics=None, retry_policy=None, rate_limiter=None, concurrency_limiter=None, coalesce_reads=True, json_codec=None, compression=None, connect_timeout=10, read_timeout=300, operation_timeout=None, transport=None, authentication=None, endpoint_balancer=None, circuit_breaker=None):
         self.username = username
         self.password = password
-        self.auth = HTTPBasicAuth(username, password)
+
+        # By default every api call is authenticated with the username and password
+        # A TokenAuthentication or SessionAuthentication (or any requests auth object) can be used instead
+        self.auth = authentication if authentication is not None else HTTPBasicAuth(username, password)
+
+        # Several Foreman frontends can be given as a list of urls, the api calls are then spread across them
+        # by the endpoint balancer (round robin unless an ApiEndpointBalancer is supplied)
+        if isinstance(url, (list, tuple)):
+            if endpoint_balancer is None and len(url) > 1:
+                endpoint_balancer = ApiEndpointBalancer(url)
+            url = url[0]
         self.url = url
+        self.endpoint_balancer = endpoint_balancer
         self.verify_ssl = verify_ssl
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.keep_alive = keep_alive
+        self.lookup_concurrency = lookup_concurrency
+        self.record_cache = record_cache
+        self.record_index = RecordIdentityIndex() if index_records else None
+        self.metrics = ApiCallMetrics()
+        self.diagnostics = diagnostics if diagnostics is not None else ApiDiagnostics(logger)
+
+        # Each wrapper gets its own retry policy (and so its own retry budget) unless one is supplied
+        # Retries can be disabled with RetryPolicy(max_attempts=1)
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.rate_limiter = rate_limiter
+        self.concurrency_limiter = concurrency_limiter
+
+        # A CircuitBreaker (which may be shared with other wrappers) fails api calls to an endpoint which keeps failing
+        # immediately, rather than letting each of them wait for its own timeout
+        self.circuit_breaker = circuit_breaker
+        self.single_flight = SingleFlight() if coalesce_reads else None
+        self.write_tracker = ApiWriteTracker()
+        self.json_codec = json_codec if json_codec is not None else ForemanApiWrapper._default_json_codec
+        self.compression = compression if compression is not None else ApiCompression()
+
+        # Every api call is given a connect and read timeout (in seconds) so that a hung Foreman worker cannot block forever
+        # The operation timeout is the time allowed for a whole read_record, read_records, create_record, etc.
+        # including the retries, fallback properties and follow up lookups it makes (None for no limit)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.operation_timeout = operation_timeout
 
         if not verify_ssl:
 
@@ -41,6 +104,59 @@ class ForemanApiWrapper:
             from requests.packages.urllib3.exceptions import InsecureRequestWarning
             warnings.simplefilter('ignore', InsecureRequestWarning)
 
+        # The api calls are sent by the transport, by default a RequestsTransport with a pooled requests session
+        # The pool_* and keep_alive arguments configure the default transport
+        if transport is None:
+            transport = RequestsTransport(
+                self.auth,
+                verify_ssl,
+                pool_connections,
+                pool_maxsize,
+                pool_block,
+                keep_alive,
+                self.compression.get_accept_encoding_header())
+        self.transport = transport
+
+    @property
+    def session(self):
+
+        # The requests session of the default transport, or None if the transport does not have one
+        return getattr(self.transport, "session", None)
+
+    @session.setter
+    def session(self, session):
+        self.transport.session = session
+
+    def start_recording(self, cassette=None):
+
+        # Capture every api call made from now on into a cassette, which can be saved and replayed with a ReplayTransport
+        # The cassette is returned
+        if isinstance(self.transport, RecordingTransport):
+            return self.transport.cassette
+        self.transport = RecordingTransport(self.transport, cassette)
+        return self.transport.cassette
+
+    def stop_recording(self):
+
+        # Stop capturing api calls, the cassette is returned (None if the wrapper was not recording)
+        if not isinstance(self.transport, RecordingTransport):
+            return None
+        cassette = self.transport.cassette
+        self.transport = self.transport.transport
+        return cassette
+
+    def close(self):
+
+        # Close the connections held by the transport
+        # The wrapper can still be used afterwards, the transport reconnects on the next api call
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     @staticmethod
     def _get_headers_for_http_method(http_method):
 
@@ -58,73 +174,462 @@ class ForemanApiWrapper:
 
         return headers
 
-    def make_api_call(self, api_endpoint, http_method, arguments=None, headers=None):
+    @staticmethod
+    def _encode_api_call_arguments(arguments, headers, json_codec, compression=None):
+
+        # The body is encoded by the codec rather than by requests so that the same (faster) encoder is used both ways
+        # Large bodies are compressed if the compression settings ask for it
+        # Returns the body to send, the headers to send with it and the size of the body before compression
+        if not arguments:
+            return None, headers, 0
+        body = json_codec.dumps(arguments)
+        decoded_size = len(body)
+        headers = dict(headers)
+        if not any(x.lower() == "content-type" for x in headers.keys()):
+            headers["Content-type"] = "application/json"
+        if compression is not None:
+            body, content_encoding = compression.compress_request_body(body)
+            if content_encoding is not None:
+                headers["Content-Encoding"] = content_encoding
+        return body, headers, decoded_size
 
-        results = None
+    @staticmethod
+    def _get_response_wire_size(results):
+
+        # The number of bytes of the response body received before it was decompressed
+        # requests (urllib3) counts the bytes it read from the socket, otherwise the Content-Length is used
+        raw = getattr(results, "raw", None)
+        if raw is not None and hasattr(raw, "tell"):
+            try:
+                return raw.tell()
+            except Exception:
+                pass
+        content_length = results.headers.get("Content-Length")
+        if content_length is not None and content_length.isdigit():
+            return int(content_length)
+        return len(results.content)
+
+    @staticmethod
+    def _count_api_call_bytes(metrics, request_wire_size, request_decoded_size, response_wire_size, response_decoded_size):
+        metrics.increment("request_wire_bytes", request_wire_size)
+        metrics.increment("request_decoded_bytes", request_decoded_size)
+        metrics.increment("response_wire_bytes", response_wire_size)
+        metrics.increment("response_decoded_bytes", response_decoded_size)
+
+    @staticmethod
+    def _decode_api_call_results(content, json_codec=None):
+
+        # Convert the response to an object
+        # The json is parsed directly from the bytes of the response
+        if json_codec is None:
+            json_codec = ForemanApiWrapper._default_json_codec
+        return json_codec.loads(content)
+
+    @staticmethod
+    def _create_api_call_exception(api_endpoint, http_method, results, arguments, headers, transient=False):
+
+        # An exception can be raised in several ways
+        # In some cases, a non 200 response may return a result object
+        # The result may contain json representation of an error
+
+        msg = None
         try:
-            method_name = str.lower(http_method)
-            function_pointer = getattr(requests, method_name)
-            request_url = self.url + api_endpoint
+            result_obj = ForemanApiWrapper._decode_api_call_results(results.content)
+            error = result_obj['error']
+            if "full_messages" in error.keys():
+                msg = error["full_messages"][0]
+            if "message" in error.keys():
+                msg = error["message"]
+        except:
+            pass
+
+        if not msg:
+            msg = ForemanApiWrapper._api_call_error_message
+
+        return ForemanApiCallException(
+                msg,
+                api_endpoint,
+                http_method,
+                results,
+                arguments,
+                headers,
+                transient)
 
-            if headers is None:
-                headers = ForemanApiWrapper._get_headers_for_http_method(http_method)
+    @staticmethod
+    def _get_transient_status_codes(retry_policy):
+        if retry_policy is None:
+            return RetryPolicy.default_retry_status_codes
+        return retry_policy.retry_status_codes
 
-            if arguments:
-                logger.debug("Json body:")
-                pretty_json = json.dumps(arguments, sort_keys=True, indent=4)
-                for line in pretty_json.split("\n"):
-                    logger.debug(line)
+    @staticmethod
+    def _is_transient_error(e, results, retry_policy):
 
-            logger.debug("Making api call [{0}] {1}".format(http_method.upper(), request_url))
+        # A connection error means no response was received,
+        # while a transient status code means the server could not handle the request at the time
+        if results is None:
+            return isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+        return results.status_code in ForemanApiWrapper._get_transient_status_codes(retry_policy)
 
-            results = None
-            if arguments:
-                results = function_pointer(request_url, auth=self.auth, verify=self.verify_ssl, json=arguments, headers=headers)
+    @staticmethod
+    def _is_transient_api_call_exception(ex):
+        return getattr(ex, "transient", False)
+
+    @staticmethod
+    def _raise_unless_ignorable(ex, message="API call failed:"):
+
+        # A failed read (eg. a 404) means the record was not found that way and the next way is tried
+        # A transient failure does not tell us whether the record exists
+        # Carrying on would report the record as missing and lead to a duplicate being created
+        if ForemanApiWrapper._is_transient_api_call_exception(ex):
+            raise ex
+        logging.debug(message)
+        logging.debug(ex.args[0])
+
+    @staticmethod
+    def _get_retry_delay(retry_policy, ex, http_method, attempt):
+
+        # Determine how long to wait before retrying a failed api call, or None if it should not be retried
+        if retry_policy is None:
+            return None
+
+        status_code = None
+        retry_after = None
+        if ex.results is not None and hasattr(ex.results, "status_code"):
+            status_code = ex.results.status_code
+            retry_after = ex.results.headers.get("Retry-After")
+        elif not ForemanApiWrapper._is_transient_api_call_exception(ex):
+            return None
+
+        return retry_policy.get_retry_delay(http_method, attempt, status_code, retry_after)
+
+    @staticmethod
+    def _release_concurrency_limiter(concurrency_limiter, metrics, retry_policy, start, results, near_limit):
+
+        # Report the latency and outcome of the api call to the limiter so that it can adjust the limit
+        # No results means the api call failed before a response was received
+        overloaded = results is None or results.status_code in ForemanApiWrapper._get_transient_status_codes(retry_policy)
+        limit = concurrency_limiter.release(time.monotonic() - start, overloaded, near_limit)
+        metrics.set("concurrency_limit", limit)
+
+    @staticmethod
+    def _release_endpoint_balancer(endpoint_balancer, base_url, retry_policy, start, results):
+
+        # Report the outcome of the api call so that a failing frontend is ejected
+        if endpoint_balancer is None:
+            return
+        failed = results is None or results.status_code in ForemanApiWrapper._get_transient_status_codes(retry_policy)
+        endpoint_balancer.release(base_url, time.monotonic() - start, failed)
+
+    @staticmethod
+    def _count_circuit_transition(circuit_breaker, metrics, api_endpoint, http_method, transition):
+        if transition is None:
+            return
+        metrics.increment(ForemanApiWrapper._circuit_transition_metrics[transition])
+        metrics.set("open_circuits", len(circuit_breaker.get_open_circuits()))
+        logger.warning("The circuit for [%s] %s is now %s.", http_method.upper(), CircuitBreaker.get_endpoint_template(api_endpoint), transition.replace("_", " "))
+
+    @staticmethod
+    def _acquire_circuit(circuit_breaker, metrics, api_endpoint, http_method):
+
+        # Fail fast if the circuit of the endpoint is open
+        if circuit_breaker is None:
+            return
+        allowed, transition = circuit_breaker.acquire(api_endpoint, http_method)
+        ForemanApiWrapper._count_circuit_transition(circuit_breaker, metrics, api_endpoint, http_method, transition)
+        if not allowed:
+            metrics.increment("circuit_rejected_calls")
+            raise CircuitOpenException("The circuit for the endpoint is open, the api call was not made.", api_endpoint, http_method)
+
+    @staticmethod
+    def _release_circuit(circuit_breaker, metrics, api_endpoint, http_method, failed):
+
+        # The api call failed if it failed transiently, None if it was abandoned before it had an outcome
+        if circuit_breaker is None:
+            return
+        transition = circuit_breaker.release(api_endpoint, http_method, failed)
+        ForemanApiWrapper._count_circuit_transition(circuit_breaker, metrics, api_endpoint, http_method, transition)
+
+    def _acquire_base_url(self):
+
+        # The base url of the frontend the api call is sent to
+        if self.endpoint_balancer is None:
+            return self.url
+        return self.endpoint_balancer.acquire()
+
+    @staticmethod
+    def _get_coalescing_key(single_flight, write_tracker, endpoint_balancer, api_endpoint, http_method, arguments, headers):
+
+        # Only plain GETs are coalesced, anything else may change the state of the server
+        if single_flight is None or http_method.upper() != "GET" or arguments or headers:
+            return None
+
+        # A read never joins a GET which started before a write to the same collection (see ApiWriteTracker)
+        generation = write_tracker.get_generation(api_endpoint)
+        if generation is None:
+            return None
+
+        # A read made within a pinned operation only joins a GET sent to the frontend the operation is pinned to
+        pinned_url = endpoint_balancer.get_pinned_url() if endpoint_balancer is not None else None
+        return api_endpoint, generation, pinned_url
+
+    @staticmethod
+    def _is_write(http_method):
+        return http_method.upper() not in ["GET", "HEAD", "OPTIONS"]
+
+    @staticmethod
+    def _raise_if_deadline_exceeded(api_endpoint, http_method, cause=None):
+        deadline = Deadline.current()
+        if deadline is not None and deadline.expired():
+            raise DeadlineExceededException("The deadline of the operation was exceeded.", api_endpoint, http_method) from cause
+
+    @staticmethod
+    def _get_wait_timeout(api_endpoint, http_method):
+
+        # The longest a wait before an api call (eg. for the rate limiter) may take, None if there is no deadline
+        ForemanApiWrapper._raise_if_deadline_exceeded(api_endpoint, http_method)
+        deadline = Deadline.current()
+        return deadline.remaining() if deadline is not None else None
+
+    @staticmethod
+    def _wait_before_deadline(wait, api_endpoint, http_method):
+
+        # Runs a wait which takes a timeout (eg. for a slot from the concurrency limiter)
+        # for at most the time left before the deadline
+        try:
+            return wait(ForemanApiWrapper._get_wait_timeout(api_endpoint, http_method))
+        except TimeoutError as e:
+            raise DeadlineExceededException("The deadline of the operation was exceeded while waiting to make the api call.", api_endpoint, http_method) from e
+
+    @staticmethod
+    def _get_request_timeout(connect_timeout, read_timeout, api_endpoint, http_method):
+
+        # The timeouts of an api call are shortened to the time remaining before the deadline (if there is one)
+        ForemanApiWrapper._raise_if_deadline_exceeded(api_endpoint, http_method)
+        deadline = Deadline.current()
+        if deadline is None:
+            return connect_timeout, read_timeout
+        remaining = deadline.remaining()
+        connect_timeout = remaining if connect_timeout is None else min(connect_timeout, remaining)
+        read_timeout = remaining if read_timeout is None else min(read_timeout, remaining)
+        return connect_timeout, read_timeout
+
+    @staticmethod
+    def _is_deadline_limited_timeout(e, connect_timeout, read_timeout, timeout):
+
+        # Whether an api call timed out because its timeout was shortened to fit the deadline (see _get_request_timeout)
+        # rather than because the server took longer than the connect or read timeout
+        # Such a timeout says nothing about the endpoint, so it must not count towards opening its circuit
+        if timeout is None:
+            return False
+        request_connect_timeout, request_read_timeout = timeout
+        if isinstance(e, requests.exceptions.ConnectTimeout):
+            return request_connect_timeout != connect_timeout
+        if isinstance(e, requests.exceptions.Timeout):
+            return request_read_timeout != read_timeout
+        return False
+
+    def make_api_call(self, api_endpoint, http_method, arguments=None, headers=None):
+
+        # When many records are reconciled in parallel they tend to read the same records at the same moment
+        # (eg. every host reads its domain, subnet and operating system)
+        # Identical GETs in progress at the same time are coalesced so that only one of them is sent
+        if ForemanApiWrapper._is_write(http_method):
+            self.write_tracker.start(api_endpoint)
+            try:
+                return self._make_api_call_with_retries(api_endpoint, http_method, arguments, headers)
+            finally:
+                self.write_tracker.finish(api_endpoint)
+
+        key = ForemanApiWrapper._get_coalescing_key(self.single_flight, self.write_tracker, self.endpoint_balancer, api_endpoint, http_method, arguments, headers)
+        if key is None:
+            return self._make_api_call_with_retries(api_endpoint, http_method, arguments, headers)
+
+        results, shared = ForemanApiWrapper._wait_before_deadline(
+            lambda timeout: self.single_flight.do(key, lambda: self._make_api_call_with_retries(api_endpoint, http_method, arguments, headers), timeout),
+            api_endpoint,
+            http_method)
+        if shared:
+            self.metrics.increment("coalesced_calls")
+        return results
+
+    def _make_api_call_with_retries(self, api_endpoint, http_method, arguments, headers):
+        return self._retry_api_call(lambda: self._make_api_call_attempt(api_endpoint, http_method, arguments, headers), api_endpoint, http_method)
+
+    def _retry_api_call(self, function, api_endpoint, http_method):
+
+        # Api calls which fail transiently (eg. with a 503 while Foreman restarts) are retried according to the retry policy
+        attempt = 0
+        while True:
+            try:
+                results = function()
+            except (DeadlineExceededException, CircuitOpenException):
+                raise
+            except ForemanApiCallException as ex:
+                # A call which timed out because the deadline was reached is reported as such
+                ForemanApiWrapper._raise_if_deadline_exceeded(api_endpoint, http_method, ex)
+                delay = ForemanApiWrapper._get_retry_delay(self.retry_policy, ex, http_method, attempt)
+                if delay is None:
+                    raise
+                deadline = Deadline.current()
+                if deadline is not None and deadline.remaining() <= delay:
+                    raise DeadlineExceededException("The deadline of the operation would be exceeded before the api call could be retried.", api_endpoint, http_method) from ex
+                self.metrics.increment("retries")
+                logger.debug("Retrying api call [%s] %s in %.2f seconds.", http_method.upper(), api_endpoint, delay)
+                self.retry_policy.sleep(delay)
+                attempt += 1
             else:
-                results = function_pointer(request_url, auth=self.auth, verify=self.verify_ssl)
+                # Successful api calls earn back the retry budget
+                self.retry_policy.record_success()
+                return results
 
-            # Raise an exception if we did not get a 200 response
-            results.raise_for_status()
+    def _make_api_call_attempt(self, api_endpoint, http_method, arguments, headers):
+
+        ForemanApiWrapper._raise_if_deadline_exceeded(api_endpoint, http_method)
+        ForemanApiWrapper._acquire_circuit(self.circuit_breaker, self.metrics, api_endpoint, http_method)
+        results = None
+        failed = None
+        timeout = None
+        try:
+            if headers is None:
+                headers = ForemanApiWrapper._get_headers_for_http_method(http_method)
 
-            # Convert the response to an object
-            json_string = results.content.decode("utf-8")
-            obj = json.loads(json_string)
+            body, request_headers, request_decoded_size = ForemanApiWrapper._encode_api_call_arguments(arguments, headers, self.json_codec, self.compression)
 
-            return obj
-        except Exception as e:
+            # Wait for the rate limiter (which may be shared with other wrappers) before making the call
+            # The waits are bounded by the deadline, the call is not made if the deadline would pass first
+            if self.rate_limiter is not None:
+                if ForemanApiWrapper._wait_before_deadline(lambda timeout: self.rate_limiter.acquire(http_method, timeout), api_endpoint, http_method) > 0:
+                    self.metrics.increment("rate_limited_calls")
 
-            # An exception can be raised in several ways
-            # In some cases, a non 200 response may return a result object
-            # The result may contain json representation of an error
+            # The number of api calls in flight is bounded by the adaptive concurrency limiter (if there is one)
+            near_limit = None
+            if self.concurrency_limiter is not None:
+                near_limit = ForemanApiWrapper._wait_before_deadline(self.concurrency_limiter.acquire, api_endpoint, http_method)
 
-            msg = None
+            # The timeouts are worked out after the waits, from the time left before the deadline
             try:
-                json_string = results.content.decode("utf-8")
-                result_obj = json.loads(json_string)
-                error = result_obj['error']
-                if "full_messages" in error.keys():
-                    msg = error["full_messages"][0]
-                if "message" in error.keys():
-                    msg = error["message"]
-            except:
-                pass
+                timeout = ForemanApiWrapper._get_request_timeout(self.connect_timeout, self.read_timeout, api_endpoint, http_method)
+            except DeadlineExceededException:
+                if self.concurrency_limiter is not None:
+                    self.concurrency_limiter.cancel()
+                raise
 
-            if not msg:
-                msg = ForemanApiWrapper._api_call_error_message
+            base_url = self._acquire_base_url()
+            request_url = base_url + api_endpoint
+            start = time.monotonic()
 
-            ex = ForemanApiCallException(
-                    msg,
-                    api_endpoint,
+            results = None
+            try:
+                self.diagnostics.log_api_call(http_method, request_url, arguments)
+                self.metrics.increment("api_calls")
+                sampled = self.diagnostics.sample_wire_log()
+                results = self.transport.request(http_method, request_url, body, request_headers, timeout)
+            finally:
+                if self.concurrency_limiter is not None:
+                    ForemanApiWrapper._release_concurrency_limiter(self.concurrency_limiter, self.metrics, self.retry_policy, start, results, near_limit)
+                ForemanApiWrapper._release_endpoint_balancer(self.endpoint_balancer, base_url, self.retry_policy, start, results)
+
+            request_wire_size = len(body) if body is not None else 0
+            response_decoded_size = len(results.content)
+            response_wire_size = ForemanApiWrapper._get_response_wire_size(results)
+            ForemanApiWrapper._count_api_call_bytes(self.metrics, request_wire_size, request_decoded_size, response_wire_size, response_decoded_size)
+
+            if sampled:
+                self.diagnostics.log_wire(
                     http_method,
-                    results,
-                    arguments,
-                    headers)
+                    request_url,
+                    results.status_code,
+                    time.monotonic() - start,
+                    request_wire_size,
+                    response_wire_size,
+                    request_decoded_size,
+                    response_decoded_size)
+
+            # Raise an exception if we did not get a 200 response
+            failed = False
+            results.raise_for_status()
+
+            return ForemanApiWrapper._decode_api_call_results(results.content, self.json_codec)
+        except DeadlineExceededException:
+            raise
+        except Exception as e:
+            if ForemanApiWrapper._is_deadline_limited_timeout(e, self.connect_timeout, self.read_timeout, timeout):
+                raise DeadlineExceededException("The deadline of the operation was exceeded during the api call.", api_endpoint, http_method) from e
+
+            transient = ForemanApiWrapper._is_transient_error(e, results, self.retry_policy)
+            failed = transient
+            ex = ForemanApiWrapper._create_api_call_exception(api_endpoint, http_method, results, arguments, headers, transient)
 
             if PY3:
                 raise ex from e
             else:
                 from future.utils import raise_from
                 raise_from(ex, e)
+        finally:
+            ForemanApiWrapper._release_circuit(self.circuit_breaker, self.metrics, api_endpoint, http_method, failed)
+
+    def _open_streaming_api_call_attempt(self, api_endpoint):
+
+        # Make a GET without reading the body, the body is read by the caller as it arrives
+        # Streamed calls are not coalesced and do not take a slot from the concurrency limiter
+        # because the connection stays open for as long as the caller takes to consume the records
+        ForemanApiWrapper._raise_if_deadline_exceeded(api_endpoint, "GET")
+        ForemanApiWrapper._acquire_circuit(self.circuit_breaker, self.metrics, api_endpoint, "GET")
+        results = None
+        failed = None
+        timeout = None
+        try:
+            if self.rate_limiter is not None:
+                if ForemanApiWrapper._wait_before_deadline(lambda timeout: self.rate_limiter.acquire("GET", timeout), api_endpoint, "GET") > 0:
+                    self.metrics.increment("rate_limited_calls")
+            timeout = ForemanApiWrapper._get_request_timeout(self.connect_timeout, self.read_timeout, api_endpoint, "GET")
+
+            # The frontend is released once the response has started, the body is read from the same connection
+            base_url = self._acquire_base_url()
+            request_url = base_url + api_endpoint
+            start = time.monotonic()
+            try:
+                self.diagnostics.log_api_call("GET", request_url, None)
+                self.metrics.increment("api_calls")
+                results = self.transport.request("GET", request_url, timeout=timeout, stream=True)
+            finally:
+                ForemanApiWrapper._release_endpoint_balancer(self.endpoint_balancer, base_url, self.retry_policy, start, results)
+
+            # Raise an exception if we did not get a 200 response
+            failed = False
+            results.raise_for_status()
+            return results
+        except DeadlineExceededException:
+            raise
+        except Exception as e:
+            if ForemanApiWrapper._is_deadline_limited_timeout(e, self.connect_timeout, self.read_timeout, timeout):
+                raise DeadlineExceededException("The deadline of the operation was exceeded during the api call.", api_endpoint, "GET") from e
+            transient = ForemanApiWrapper._is_transient_error(e, results, self.retry_policy)
+            failed = transient
+            ex = ForemanApiWrapper._create_api_call_exception(api_endpoint, "GET", results, None, None, transient)
+            if results is not None:
+                results.close()
+            raise ex from e
+        finally:
+            ForemanApiWrapper._release_circuit(self.circuit_breaker, self.metrics, api_endpoint, "GET", failed)
+
+    def _stream_api_call(self, api_endpoint, envelope):
+
+        # A generator which yields the bodies in the results array of an index call as they are parsed
+        # Once the generator is exhausted the envelope dict is filled with the other keys of the response
+        results = self._retry_api_call(lambda: self._open_streaming_api_call_attempt(api_endpoint), api_endpoint, "GET")
+        try:
+            parser = StreamingResultsParser(self.json_codec)
+            response_decoded_size = 0
+            for chunk in results.iter_content(chunk_size=ForemanApiWrapper._stream_chunk_size):
+                response_decoded_size += len(chunk)
+                for record_body in parser.feed(chunk):
+                    yield record_body
+            envelope.update(parser.close())
+            response_wire_size = results.raw.tell() if hasattr(results.raw, "tell") else response_decoded_size
+            ForemanApiWrapper._count_api_call_bytes(self.metrics, 0, 0, response_wire_size, response_decoded_size)
+        finally:
+            results.close()
 
     @staticmethod
     def _determine_record_suffix(record):
@@ -184,16 +689,15 @@ class ForemanApiWrapper:
                 # We have the ApiRecordIdentificationPropertyMappings as a way to specify a preferred search field
                 # We will try to use this mapping first
                 possible_keys = []
+                # The mapping is copied rather than modified as its lists are shared by every record of the type
                 if record_type in ApiRecordIdentificationProperties.keys():
-                    possible_keys = ApiRecordIdentificationProperties[record_type]
-                    if "id" in possible_keys:
-                        possible_keys.remove("id")
+                    possible_keys = [x for x in ApiRecordIdentificationProperties[record_type] if x != "id"]
 
                 # Choose a key from the list of possible keys and use that for the query
                 query_key = None
                 for possible_key in possible_keys:
                     if possible_key in record_body.keys():
-                        query_key = possible_keys[0]
+                        query_key = possible_key
                         break
 
                 # If the preferred keys are not found, use another field that is on the record
@@ -297,60 +801,47 @@ class ForemanApiWrapper:
         except Exception as e:
             raise Exception("An error occurred while determine the api endpoint for the specified record.")
 
-    def _match_record_in_results(self, minimal_record, record_type, results, query_key, query_value):
-
-        # There is a bug in the foreman api:
-        # Sometimes the API will lie and give us records which do not match the query string
-        # For exmpale, If I GET the following url
-        #   https://15.4.7.1/api/operatingsystems/29/os_default_templates?search=provisioning_template_id%3D161
-        # I will get back records who's provisioning_tepmlate_id do not equal 161
-        # We will have to implement our own query logic to weed out the bad results
-        # Basically we will check if the query key matches the value
-        # We will either return a record or None
-
-        matched_records = []
-
-        logging.debug("Checking if any of the records in the result set contain the correct field and value.")
-        logging.debug("The key was '{0}' while the value was '{1}'.".format(query_key, query_value))
-        l = len(results["results"])
-        for x in range(0, l):
-
-            # The results are not a complete record, we will need to lookup the correct record
-            result_record_body = results["results"][x]
-            result_record = {record_type: result_record_body}
-
-            # We may have dependencies on the record which will help us to a lookup
-            if "dependencies" in minimal_record.keys():
-                dependencies = minimal_record["dependencies"]
-                result_record["dependencies"] = dependencies
+    @staticmethod
+    def _create_result_record(minimal_record, record_type, result_record_body):
 
-            # Do the lookup and get the complete record
-            looked_up_record = self._lookup_record_using_partial(result_record)
-            looked_up_record_body = ForemanApiRecord.get_record_body_from_record(looked_up_record)
+        # The results are not a complete record, we will need to lookup the correct record
+        result_record = {record_type: result_record_body}
 
-            # If the query key does not match we can throw it away
-            if query_key not in looked_up_record_body.keys():
-                logging.debug("Record {0} does not contain the field '{1}'.".format(x, query_key))
-                continue
+        # We may have dependencies on the record which will help us to a lookup
+        if "dependencies" in minimal_record.keys():
+            dependencies = minimal_record["dependencies"]
+            result_record["dependencies"] = dependencies
 
-            # check if the values match
-            result_property_value = looked_up_record_body[query_key]
-            match, reason = RecordComparison._compare_objects(record_type, query_value, result_property_value)
-            if match:
-                logging.debug("Record {0} does contain the field '{1}' and the matching value '{2}'.".format(x, query_key, query_value))
-                matched_records.append(result_record)
-                continue
+        return result_record
 
-            # As mentioned in the function to create the query string,
-            # sometimes the API will convert values to lower case for the GET
-            # It hasn't happened enough to require I tweak the mapping file yet
-            elif query_key in ["mac"]:
-                if query_value.lower() == result_property_value.lower():
-                    logging.debug("Record {0} does contain the field {1} and the matching lower value '{2}'.".format(x, query_key, query_value))
-                    matched_records.append(result_record)
-                    continue
+    @staticmethod
+    def _record_body_matches_query(record_type, record_body, query_key, query_value, x):
+
+        # If the query key does not match we can throw it away
+        if query_key not in record_body.keys():
+            logging.debug("Record %s does not contain the field '%s'.", x, query_key)
+            return False
+
+        # check if the values match
+        result_property_value = record_body[query_key]
+        match, reason = RecordComparison._compare_objects(record_type, query_value, result_property_value)
+        if match:
+            logging.debug("Record %s does contain the field '%s' and the matching value '%s'.", x, query_key, query_value)
+            return True
+
+        # As mentioned in the function to create the query string,
+        # sometimes the API will convert values to lower case for the GET
+        # It hasn't happened enough to require I tweak the mapping file yet
+        elif query_key in ["mac"]:
+            if query_value.lower() == result_property_value.lower():
+                logging.debug("Record %s does contain the field %s and the matching lower value '%s'.", x, query_key, query_value)
+                return True
+
+        logging.debug("Record %s did not match.", x)
+        return False
 
-            logging .debug("Record {0} did not match.".format(x))
+    @staticmethod
+    def _select_matched_record(matched_records, query_key):
 
         # if we found no records we should stop here
         if len(matched_records) == 0:
@@ -365,49 +856,323 @@ class ForemanApiWrapper:
 
         return matched_records[0]
 
-    def _get_record_from_results(self, minimal_record, record_type, results, query_key, query_value):
+    @staticmethod
+    def _partition_results_for_query(minimal_record, record_type, results, query_key, query_value):
+
+        # The records in a result set are not complete, but they usually contain the field used in the query
+        # We check the fields that are present first, and only records which lack the field
+        # will need a complete lookup before they can be checked
+        matched_records = []
+        records_requiring_lookup = []
+        l = len(results["results"])
+        for x in range(0, l):
+            result_record_body = results["results"][x]
+            result_record = ForemanApiWrapper._create_result_record(minimal_record, record_type, result_record_body)
+
+            if query_key not in result_record_body.keys():
+                logging.debug("Record %s does not contain the field '%s', a complete lookup is required.", x, query_key)
+                records_requiring_lookup.append((x, result_record))
+                continue
+
+            if ForemanApiWrapper._record_body_matches_query(record_type, result_record_body, query_key, query_value, x):
+                matched_records.append((result_record, False))
+
+        return matched_records, records_requiring_lookup
+
+    def _match_record_in_results(self, minimal_record, record_type, results, query_key, query_value):
+
+        # There is a bug in the foreman api:
+        # Sometimes the API will lie and give us records which do not match the query string
+        # For exmpale, If I GET the following url
+        #   https://15.4.7.1/api/operatingsystems/29/os_default_templates?search=provisioning_template_id%3D161
+        # I will get back records who's provisioning_tepmlate_id do not equal 161
+        # We will have to implement our own query logic to weed out the bad results
+        # Basically we will check if the query key matches the value
+        # We will either return a tuple of the record and whether or not it is complete, or None
+
+        logging.debug("Checking if any of the records in the result set contain the correct field and value.")
+        logging.debug("The key was '{0}' while the value was '{1}'.".format(query_key, query_value))
+
+        matched_records, records_requiring_lookup = ForemanApiWrapper._partition_results_for_query(
+            minimal_record, record_type, results, query_key, query_value)
+
+        # The remaining records are looked up concurrently
+        if records_requiring_lookup:
+            result_records = [result_record for x, result_record in records_requiring_lookup]
+            with ThreadPoolExecutor(max_workers=self.lookup_concurrency) as executor:
+                looked_up_records = list(executor.map(Deadline.bind(self._lookup_record_using_partial), result_records))
+
+            matched_records += ForemanApiWrapper._match_looked_up_records(record_type, records_requiring_lookup, looked_up_records, query_key, query_value)
+
+        return ForemanApiWrapper._select_matched_record(matched_records, query_key)
+
+    @staticmethod
+    def _match_looked_up_records(record_type, records_requiring_lookup, looked_up_records, query_key, query_value):
+
+        # Returns the complete records which match the query, as tuples of the record and True (the record is complete)
+        matched_records = []
+        for (x, result_record), looked_up_record in zip(records_requiring_lookup, looked_up_records):
+            looked_up_record_body = ForemanApiRecord.get_record_body_from_record(looked_up_record)
+            if ForemanApiWrapper._record_body_matches_query(record_type, looked_up_record_body, query_key, query_value, x):
+                matched_records.append((looked_up_record, True))
+        return matched_records
+
+    @staticmethod
+    def _get_record_from_results_without_matching(record_index, minimal_record, record_type, results, query_key):
 
         # The api my return a single record, or a result set
         # If a result set is returned, the key "results" will appear in the object
         # If  single object is returned the key will not appear
         # If multiple results are returned, we will try to find the right one
         # This is a workaround from the api having bugs
+        # A tuple of the record and whether or not the record is complete is returned
+        # The record is None if it was not found
+        # None is returned if the results must be matched (see _match_record_in_results) to find the record
 
-        # Create a var for the record returned
-        record_body = None
-
-        # If a single record is returned, store the result
+        # If a single record is returned, use the result
+        # The api only returns complete records when they are looked up by id
         if "results" not in results.keys():
-            record_body = results
+            return {record_type: results}, query_key == "id"
 
         # If a result set was returned, we need to look for the the right record
         # Even if a single record is returned, it might not be the right one
-        else:
-            if len(results["results"]) == 0:
-                logger.debug("Empty result set returned by the api.")
-                return None
-            else:
-                logger.debug("A result set with '{0}' results was returned..".format(len(results["results"])))
-                logger.debug("Using extra query logic to determine if the record was found.")
-                record = self._match_record_in_results(minimal_record, record_type, results, query_key, query_value)
-                if record is None:
-                    return None
-                else:
-                    return record
+        if len(results["results"]) == 0:
+            logger.debug("Empty result set returned by the api.")
+            return None, False
 
-        if record_body is None:
-            return None
+        logger.debug("A result set with '{0}' results was returned..".format(len(results["results"])))
+        ForemanApiWrapper._index_records(record_index, record_type, results["results"], ForemanApiWrapper._get_record_scope(minimal_record))
+        logger.debug("Using extra query logic to determine if the record was found.")
+        return None
 
-        record = {record_type: record_body}
-        return record
+    def _get_record_from_results(self, minimal_record, record_type, results, query_key, query_value):
+
+        # See _get_record_from_results_without_matching
+        record = ForemanApiWrapper._get_record_from_results_without_matching(self.record_index, minimal_record, record_type, results, query_key)
+        if record is not None:
+            return record
+        matched_record = self._match_record_in_results(minimal_record, record_type, results, query_key, query_value)
+        if matched_record is None:
+            return None, False
+        return matched_record
+
+    @staticmethod
+    def _create_combined_search_endpoint(minimal_record, record_type, identification_properties):
+
+        # eg. /api/operatingsystems?search=description%3D%22CentOS%207%22%20or%20name%3D%22CentOS%22
+        record_body = minimal_record[record_type]
+        conditions = []
+        for identification_property in identification_properties:
+            query_value = ForemanApiWrapper._format_search_value(identification_property, record_body[identification_property])
+            conditions.append("{0}={1}".format(identification_property, query_value))
+        search = " or ".join(conditions)
+        record_suffix = ForemanApiWrapper._determine_record_suffix(minimal_record)
+        if PY3:
+            return "/api{0}?search={1}".format(record_suffix, urllib.parse.quote(search))
+        return "/api{0}?search={1}".format(record_suffix, urllib.quote(search))
+
+    @staticmethod
+    def _prepare_combined_search_results(record_index, record_type, results, scope):
+
+        # Returns whether the search was answered with a result set and whether it has any records to match
+        if "results" not in results.keys():
+            return False, False
+        if len(results["results"]) == 0:
+            logger.debug("Empty result set returned by the api.")
+            return True, False
+        ForemanApiWrapper._index_records(record_index, record_type, results["results"], scope)
+        return True, True
+
+    def _read_record_using_combined_search(self, minimal_record, record_type, identification_properties, scope):
+
+        # Returns whether the search could be made and the record it found (None if no record matched)
+        # If Foreman rejects the search (eg. a property cannot be searched on) the properties are searched one at a time
+        endpoint = ForemanApiWrapper._create_combined_search_endpoint(minimal_record, record_type, identification_properties)
+        try:
+            results = self.make_api_call(endpoint, "GET")
+        except ForemanApiCallException as ex:
+            ForemanApiWrapper._raise_unless_ignorable(ex, "The combined search failed:")
+            return False, None
+        searched, has_results = ForemanApiWrapper._prepare_combined_search_results(self.record_index, record_type, results, scope)
+        if not has_results:
+            return searched, None
+
+        # The records are matched with the same rules as a search on a single property, in the order of the properties
+        for identification_property in identification_properties:
+            matched_record = self._match_record_in_results(minimal_record, record_type, results, identification_property, minimal_record[record_type][identification_property])
+            if matched_record is None:
+                continue
+            return True, self._complete_record(*matched_record)
+        return True, None
+
+    @staticmethod
+    def _can_read_record_by_id(minimal_record, record_type, identification_properties):
+        if not identification_properties or identification_properties[0] != "id":
+            return False
+        return minimal_record[record_type].get("id") is not None
+
+    def _read_record_by_id(self, minimal_record, record_type):
+
+        # Returns the complete record, or None if there is no record with the id
+        endpoint = ForemanApiWrapper._create_api_endpoint_string_for_record(minimal_record, "id", minimal_record[record_type]["id"])
+        try:
+            results = self.make_api_call(endpoint, "GET")
+        except ForemanApiCallException as ex:
+            ForemanApiWrapper._raise_unless_ignorable(ex)
+            return None
+        return {record_type: results}
 
     def _lookup_record_using_partial(self, partial_record):
         logging.debug("Doing an additional read to lookup complete record using id field from record.")
+        self.metrics.increment("complete_record_lookups")
         complete_record = self.read_record(partial_record, identification_properties=['id'])
         record = complete_record
         logging.debug("Lookup successful.")
         return record
 
+    def _complete_record(self, record, record_is_complete):
+
+        # I have seen that the api will not return full json if a record is not looked up by it's ID
+        # At this point we have found a single record and that record should have an ID
+        # We will do one last lookup here if we do not already have the complete record
+        if record_is_complete:
+            return record
+        return self._lookup_record_using_partial(record)
+
+    @staticmethod
+    def _get_record_scope(record):
+
+        # Records nested under other records (eg. os_default_templates) are only unique within their parent
+        # The scope of a record is the url suffix of its parents, or None for a top level record
+        if not ForemanApiRecord.get_record_dependencies(record):
+            return None
+        return ForemanApiWrapper._determine_record_suffix(record)
+
+    @staticmethod
+    def _get_cached_record(record_cache, minimal_record, identification_properties, scope):
+
+        # If a record cache is in use, try each of the identification properties against the cache
+        if record_cache is None:
+            return None
+
+        record_type = ForemanApiRecord.get_record_type_from_record(minimal_record)
+        record_body = ForemanApiRecord.get_record_body_from_record(minimal_record)
+        for identification_property in identification_properties:
+            record = record_cache.get_by_property(record_type, identification_property, record_body[identification_property], scope)
+            if record is not None:
+                logging.debug("Record found in the cache using property '{0}'.".format(identification_property))
+                return record
+        return None
+
+    @staticmethod
+    def _get_indexed_ids(record_index, minimal_record, identification_properties, scope):
+
+        # If the record index has seen a record with the same identification property value
+        # we can read it by id rather than searching for it
+        # A list of tuples of the property, value and id is returned
+        if record_index is None or "id" in identification_properties:
+            return []
+
+        record_type = ForemanApiRecord.get_record_type_from_record(minimal_record)
+        record_body = ForemanApiRecord.get_record_body_from_record(minimal_record)
+        indexed_ids = []
+        for identification_property in identification_properties:
+            identification_property_value = record_body[identification_property]
+            record_id = record_index.get_id(record_type, identification_property, identification_property_value, scope)
+            if record_id is not None:
+                indexed_ids.append((identification_property, identification_property_value, record_id))
+        return indexed_ids
+
+    @staticmethod
+    def _index_records(record_index, record_type, record_bodies, scope):
+        if record_index is None:
+            return
+        for record_body in record_bodies:
+            record_index.add({record_type: record_body}, scope)
+
+    @staticmethod
+    def _remember_read_record(record_cache, record_index, record, scope):
+
+        # A complete record which has been read is stored in the cache and the index
+        if record_cache is not None:
+            record_cache.put(record, scope)
+        if record_index is not None:
+            record_index.add(record, scope)
+
+    @staticmethod
+    def _remember_modified_record(record_cache, record_index, minimal_record, modified_record, http_method, scope):
+
+        # The api responds to a create or update with the complete record, which we use to refresh the cache and index
+        # A deleted record is removed from the cache and index
+        if http_method.lower() in ["post", "put"]:
+            ForemanApiWrapper._remember_read_record(record_cache, record_index, modified_record, scope)
+        elif http_method.lower() == "delete":
+            record_type = ForemanApiRecord.get_record_type_from_record(modified_record)
+            for record in [minimal_record, modified_record]:
+                record_body = ForemanApiRecord.get_record_body_from_record(record)
+                if "id" in record_body.keys():
+                    if record_cache is not None:
+                        record_cache.invalidate(record_type, record_body["id"])
+                    if record_index is not None:
+                        record_index.remove_id(record_type, record_body["id"])
+
+    def _read_record_using_index(self, minimal_record, record_type, identification_properties, scope):
+
+        # Read records that the index has seen before directly by their id
+        # The record may have been changed or deleted since it was seen,
+        # so the identification property is checked and stale entries are removed from the index
+        for identification_property, identification_property_value, record_id in ForemanApiWrapper._get_indexed_ids(
+                self.record_index, minimal_record, identification_properties, scope):
+            logging.debug("Reading record using the id '{0}' indexed for property '{1}'.".format(record_id, identification_property))
+            endpoint = ForemanApiWrapper._create_api_endpoint_string_for_record(minimal_record, "id", record_id)
+            try:
+                results = self.make_api_call(endpoint, "GET")
+            except ForemanApiCallException as ex:
+                ForemanApiWrapper._raise_unless_ignorable(ex)
+                results = None
+
+            if ForemanApiWrapper._is_indexed_record_stale(self.record_index, record_type, results, identification_property, identification_property_value, scope):
+                continue
+
+            return {record_type: results}
+        return None
+
+    @staticmethod
+    def _is_indexed_record_stale(record_index, record_type, results, identification_property, identification_property_value, scope):
+
+        # The record read using an indexed id no longer exists or no longer has the property value, its entry is removed
+        if results is not None and ForemanApiWrapper._record_body_matches_query(record_type, results, identification_property, identification_property_value, 0):
+            return False
+        logging.debug("The indexed id was stale.")
+        record_index.remove(record_type, identification_property, identification_property_value, scope)
+        return True
+
+    @staticmethod
+    def _get_read_identification_properties(minimal_record, identification_properties):
+
+        # Returns the record type, the identification properties the record is looked up by and the scope of the record
+        record_type = ForemanApiRecord.get_record_type_from_record(minimal_record)
+        if not identification_properties:
+            logging.debug("Getting Identification properties for record")
+            identification_properties = ForemanApiRecord.get_record_identifcation_properties(minimal_record)
+        else:
+            logging.debug("Identification properties supplied as: {0}".format(identification_properties))
+        return record_type, identification_properties, ForemanApiWrapper._get_record_scope(minimal_record)
+
+    @staticmethod
+    def _get_property_lookups(minimal_record, record_type, identification_properties):
+
+        # Returns the property, value and search endpoint for each property the record is looked up by in turn
+        logging.debug("Will attempt to find record using the following fields as query parameters:")
+        logging.debug(identification_properties)
+        property_lookups = []
+        for identification_property in identification_properties:
+            identification_property_value = minimal_record[record_type][identification_property]
+            endpoint = ForemanApiWrapper._create_api_endpoint_string_for_record(minimal_record, identification_property, identification_property_value)
+            property_lookups.append((identification_property, identification_property_value, endpoint))
+        return property_lookups
+
+    @Deadline.operation
     def read_record(self, minimal_record, identification_properties=[]):
 
         # This function will attempt to read a record from the Foreman API
@@ -419,38 +1184,53 @@ class ForemanApiWrapper:
         # Ultimately, an error will be returned if a unique record cannot be identified
 
         try:
-            record_type = ForemanApiRecord.get_record_type_from_record(minimal_record)
-            http_method = "GET"
-            if not identification_properties:
-                logging.debug("Getting Identification properties for record")
-                identification_properties = ForemanApiRecord.get_record_identifcation_properties(minimal_record)
-            else:
-                logging.debug("Identification properties supplied as: {0}".format(identification_properties))
-            logging.debug("Will attempt to find record using the following fields as query parameters:")
-            logging.debug(identification_properties)
-            for identification_property in identification_properties:
+            record_type, identification_properties, scope = ForemanApiWrapper._get_read_identification_properties(minimal_record, identification_properties)
+            cached_record = ForemanApiWrapper._get_cached_record(self.record_cache, minimal_record, identification_properties, scope)
+            if cached_record is not None:
+                return cached_record
+
+            # A record which carries its id is read with a single GET of /api/<records>/<id>
+            # If there is no record with the id the other properties are tried
+            if ForemanApiWrapper._can_read_record_by_id(minimal_record, record_type, identification_properties):
+                record = self._read_record_by_id(minimal_record, record_type)
+                if record is not None:
+                    ForemanApiWrapper._remember_read_record(self.record_cache, self.record_index, record, scope)
+                    return record
+                identification_properties = identification_properties[1:]
+
+            indexed_record = self._read_record_using_index(minimal_record, record_type, identification_properties, scope)
+            if indexed_record is not None:
+                ForemanApiWrapper._remember_read_record(self.record_cache, self.record_index, indexed_record, scope)
+                return indexed_record
+
+            # Searching for each property in turn costs a failed search per property when the record does not exist
+            # so the properties are combined into one search and the results are matched locally, property by property
+            if len(identification_properties) > 1:
+                searched, record = self._read_record_using_combined_search(minimal_record, record_type, identification_properties, scope)
+                if searched:
+                    if record is None:
+                        logging.debug("None of the properties matched any existing records.")
+                        return None
+                    ForemanApiWrapper._remember_read_record(self.record_cache, self.record_index, record, scope)
+                    return record
+
+            for identification_property, identification_property_value, endpoint in ForemanApiWrapper._get_property_lookups(minimal_record, record_type, identification_properties):
                 logging.debug("Looking up record using property '{0}'.".format(identification_property))
-                identification_property_value = minimal_record[record_type][identification_property]
-                endpoint = ForemanApiWrapper._create_api_endpoint_string_for_record(minimal_record, identification_property, identification_property_value)
                 try:
-                    results = self.make_api_call(endpoint, http_method)
+                    results = self.make_api_call(endpoint, "GET")
                 except ForemanApiCallException as ex:
-                    logging.debug("API call failed:")
-                    logging.debug(ex.args[0])
+                    ForemanApiWrapper._raise_unless_ignorable(ex)
                     continue
 
-                record = self._get_record_from_results(minimal_record, record_type, results, identification_property,  identification_property_value)
+                record, record_is_complete = self._get_record_from_results(minimal_record, record_type, results, identification_property,  identification_property_value)
 
                 # If we got none, we did not identify the record with the specified property. We will keep looking
                 if record is None:
                     continue
 
-                # I have seen that the api will not return full json if a record is not looked up by it's ID
-                # At this point we have found a single record and that record should have an ID
-                # We will do one last lookup here if the property used to identify the record was not an ID
-                if identification_property != 'id':
-                    partial_record = record
-                    record = self._lookup_record_using_partial(partial_record)
+                record = self._complete_record(record, record_is_complete)
+
+                ForemanApiWrapper._remember_read_record(self.record_cache, self.record_index, record, scope)
 
                 return record
 
@@ -458,6 +1238,359 @@ class ForemanApiWrapper:
         except Exception as e:
             raise Exception("An error occurred while reading the record.") from e
 
+    @staticmethod
+    def _create_list_endpoint(record_type, search, page, per_page, dependencies=None):
+
+        # The index endpoint for a record type is determined in the same way as for a single record
+        # Nested endpoints such as operatingsystems/:id/os_default_templates are built from the dependencies
+        # An example url is as follows:
+        #   https://15.4.7.1/api/operatingsystems/19/os_default_templates?page=2&per_page=100&search=...
+        record = {record_type: {}}
+        if dependencies:
+            record["dependencies"] = dependencies
+        record_suffix = ForemanApiWrapper._determine_record_suffix(record)
+
+        query_parameters = [("page", page), ("per_page", per_page)]
+        if search:
+            query_parameters.append(("search", search))
+
+        if PY3:
+            query_string = urllib.parse.urlencode(query_parameters, quote_via=urllib.parse.quote)
+        else:
+            query_string = urllib.urlencode(query_parameters)
+
+        return "/api{0}?{1}".format(record_suffix, query_string)
+
+    @staticmethod
+    def _get_page_from_results(results, per_page):
+
+        # Index calls return an envelope describing the page as well as the records
+        #   {"total": 120, "subtotal": 45, "page": 1, "per_page": 20, "search": "...", "results": [...]}
+        # The subtotal is the number of records matching the search, the total ignores the search
+        # The server may cap the page size, so we use the per_page it reports if it is available
+        page_records = results.get("results", [])
+        subtotal = results.get("subtotal", results.get("total"))
+        if results.get("per_page"):
+            per_page = int(results["per_page"])
+        return page_records, subtotal, per_page
+
+    @staticmethod
+    def _is_last_page(page, per_page, subtotal, page_record_count):
+
+        if page_record_count == 0:
+            return True
+        if subtotal is not None:
+            return page * per_page >= int(subtotal)
+        return page_record_count < per_page
+
+    @staticmethod
+    def _get_last_page(subtotal, per_page):
+        return int(math.ceil(float(subtotal) / per_page))
+
+    @staticmethod
+    def _get_list_scope(record_type, dependencies):
+        record = {record_type: {}}
+        if dependencies:
+            record["dependencies"] = dependencies
+        return ForemanApiWrapper._get_record_scope(record)
+
+    def _fetch_page(self, record_type, search, page, per_page, dependencies):
+        endpoint = ForemanApiWrapper._create_list_endpoint(record_type, search, page, per_page, dependencies)
+        results = self.make_api_call(endpoint, "GET")
+        page_records, subtotal, page_size = ForemanApiWrapper._get_page_from_results(results, per_page)
+        ForemanApiWrapper._index_records(self.record_index, record_type, page_records, ForemanApiWrapper._get_list_scope(record_type, dependencies))
+        return page_records, subtotal, page_size
+
+    def _fetch_pages_concurrently(self, record_type, search, per_page, dependencies, pages, page_concurrency, ordered):
+
+        # Once the first page has told us how many records there are, the remaining pages are independent
+        # This generator fetches them with a pool of worker threads and yields the records of each page
+        # At most page_concurrency pages are requested at once, a new page is only requested
+        # when a page has been handed to the caller, so memory is bounded by the number of pages in flight
+        # The pages are yielded in page order, or in the order they complete if ordered is False
+
+        pages = iter(pages)
+        in_flight = collections.deque()
+
+        with ThreadPoolExecutor(max_workers=page_concurrency) as executor:
+
+            def request_next_page():
+                page = next(pages, None)
+                if page is not None:
+                    in_flight.append(executor.submit(Deadline.bind(self._fetch_page), record_type, search, page, per_page, dependencies))
+
+            for x in range(0, page_concurrency):
+                request_next_page()
+
+            while in_flight:
+                if ordered:
+                    future = in_flight.popleft()
+                else:
+                    done, not_done = wait(in_flight, return_when=FIRST_COMPLETED)
+                    future = done.pop()
+                    in_flight.remove(future)
+
+                page_records, subtotal, page_size = future.result()
+                request_next_page()
+                yield page_records
+
+    def _stream_pages(self, record_type, search, per_page, dependencies):
+
+        # The pages are requested one after the other and the records of each page are yielded as they are parsed
+        scope = ForemanApiWrapper._get_list_scope(record_type, dependencies)
+        page = 1
+        while True:
+            endpoint = ForemanApiWrapper._create_list_endpoint(record_type, search, page, per_page, dependencies)
+            envelope = {}
+            page_record_count = 0
+            for page_record in self._stream_api_call(endpoint, envelope):
+                page_record_count += 1
+                ForemanApiWrapper._index_records(self.record_index, record_type, [page_record], scope)
+                yield page_record
+
+            page_records, subtotal, page_size = ForemanApiWrapper._get_page_from_results(envelope, per_page)
+            if ForemanApiWrapper._is_last_page(page, page_size, subtotal, page_record_count):
+                break
+            page += 1
+
+    def list_records(self, record_type, search=None, per_page=100, dependencies=None, page_concurrency=1, ordered=True, stream=False):
+
+        # This function is a generator which will enumerate the records of a given type
+        # The records are requested from the api one page at a time and yielded one by one
+        # so the whole collection is never held in memory
+        # A scoped search string can be supplied to filter the records (eg. 'name ~ foobar')
+        # The records yielded are those returned by the index endpoint, which may not be complete
+        # If page_concurrency is greater than one, the pages after the first are fetched concurrently
+        # and ordered determines whether they are yielded in page order or as they complete
+        # If stream is True each page is parsed as it arrives rather than being read into memory first,
+        # so memory is proportional to a single record even for large pages (page_concurrency is then ignored)
+
+        try:
+            if stream:
+                for page_record in self._stream_pages(record_type, search, per_page, dependencies):
+                    yield {record_type: page_record}
+                return
+
+            page = 1
+            while True:
+                page_records, subtotal, page_size = self._fetch_page(record_type, search, page, per_page, dependencies)
+
+                for page_record in page_records:
+                    yield {record_type: page_record}
+
+                if ForemanApiWrapper._is_last_page(page, page_size, subtotal, len(page_records)):
+                    break
+
+                if page_concurrency > 1 and subtotal is not None:
+                    remaining_pages = range(page + 1, ForemanApiWrapper._get_last_page(subtotal, page_size) + 1)
+                    for page_records in self._fetch_pages_concurrently(record_type, search, per_page, dependencies, remaining_pages, page_concurrency, ordered):
+                        for page_record in page_records:
+                            yield {record_type: page_record}
+                    break
+
+                page += 1
+        except Exception as e:
+            raise Exception("An error occurred while listing the records.") from e
+
+    @staticmethod
+    def _get_batch_identification_property(record):
+
+        # Choose the property used to find a record in a batch
+        # The preferred identification properties are used in the same order as read_record would use them
+        record_type = ForemanApiRecord.get_record_type_from_record(record)
+        record_body = ForemanApiRecord.get_record_body_from_record(record)
+        possible_properties = ["id", "name"]
+        if record_type in ApiRecordIdentificationProperties.keys():
+            possible_properties = ApiRecordIdentificationProperties[record_type]
+        for possible_property in possible_properties:
+            if possible_property in record_body.keys():
+                return possible_property
+        raise Exception("Unable to determine identification properties for the record.")
+
+    @staticmethod
+    def _group_records_for_batch_read(records):
+
+        # Records are grouped by their type, their parent records and the property used to identify them
+        # Each group can then be found with IN-list searches against a single endpoint
+        groups = collections.OrderedDict()
+        for x in range(0, len(records)):
+            record = records[x]
+            record_type = ForemanApiRecord.get_record_type_from_record(record)
+            scope = ForemanApiWrapper._get_record_scope(record)
+            query_key = ForemanApiWrapper._get_batch_identification_property(record)
+            groups.setdefault((record_type, scope, query_key), []).append((x, record))
+        return groups
+
+    @staticmethod
+    def _format_search_value(query_key, query_value):
+
+        # Values in a scoped search are quoted, the mac address is searched in lower case
+        if query_key in ["mac"]:
+            query_value = query_value.lower()
+        if isinstance(query_value, (int, float)) and not isinstance(query_value, bool):
+            return str(query_value)
+        return "\"{0}\"".format(str(query_value).replace("\"", "\\\""))
+
+    @staticmethod
+    def _create_in_list_searches(query_key, query_values, max_search_length):
+
+        # Foreman's scoped search supports set queries of the form
+        #   name ^ ("a.foobar.com","b.foobar.com","c.foobar.com")
+        # The values are split across several searches so that the url encoded search stays under max_search_length
+        # A list of the search strings is returned
+        def encoded_length(text):
+            if PY3:
+                return len(urllib.parse.quote(text))
+            return len(urllib.quote(text))
+
+        prefix = "{0} ^ (".format(query_key)
+        searches = []
+        chunk = []
+        chunk_length = encoded_length(prefix) + encoded_length(")")
+        for query_value in query_values:
+            formatted_value = ForemanApiWrapper._format_search_value(query_key, query_value)
+            value_length = encoded_length(formatted_value) + encoded_length(",")
+            if chunk and chunk_length + value_length > max_search_length:
+                searches.append(prefix + ",".join(chunk) + ")")
+                chunk = []
+                chunk_length = encoded_length(prefix) + encoded_length(")")
+            chunk.append(formatted_value)
+            chunk_length += value_length
+        if chunk:
+            searches.append(prefix + ",".join(chunk) + ")")
+        return searches
+
+    @staticmethod
+    def _get_identification_value_keys(record_type, query_key, query_value):
+
+        # The keys under which a value can be matched
+        # The host name returned by the api has the domain appended while the name supplied may not (see RecordComparison._compare_primitives)
+        value_key = ForemanApiRecord.normalize_identification_value(query_key, query_value)
+        value_keys = [value_key]
+        if record_type == "host" and query_key == "name" and "." in value_key:
+            value_keys.append(value_key.split(".")[0])
+        return value_keys
+
+    @staticmethod
+    def _match_batch_results(record_type, query_key, requested_records, result_bodies):
+
+        # Match the records returned by the IN-list searches back to the requested records
+        # The values are compared as they are (the mac address in lower case) or with the host name adjustment of _compare_primitives
+        # A dict of the requested record position to the matched record body (or None) is returned
+        bodies_by_value = {}
+        for result_body in result_bodies:
+            if query_key not in result_body.keys():
+                continue
+            for value_key in ForemanApiWrapper._get_identification_value_keys(record_type, query_key, result_body[query_key]):
+                bodies_by_value.setdefault(value_key, [])
+                if result_body not in bodies_by_value[value_key]:
+                    bodies_by_value[value_key].append(result_body)
+
+        matched_bodies = {}
+        for x, requested_record in requested_records:
+            query_value = ForemanApiRecord.get_record_body_from_record(requested_record)[query_key]
+            value_key = ForemanApiRecord.normalize_identification_value(query_key, query_value)
+            matched = []
+            for result_body in bodies_by_value.get(value_key, []):
+                match = ForemanApiRecord.normalize_identification_value(query_key, result_body[query_key]) == value_key
+                if not match:
+                    match, reason = RecordComparison._compare_primitives(record_type, query_value, result_body[query_key], query_key)
+                if match:
+                    matched.append(result_body)
+            matched_bodies[x] = ForemanApiWrapper._select_matched_record(matched, query_key)
+        return matched_bodies
+
+    @staticmethod
+    def _get_uncached_records(record_cache, requested_records, query_key, scope, read_records):
+
+        # Records which are already cached do not need to be searched for
+        # The cached records are placed in read_records and the remaining records are returned
+        uncached_records = []
+        for x, requested_record in requested_records:
+            cached_record = ForemanApiWrapper._get_cached_record(record_cache, requested_record, [query_key], scope)
+            if cached_record is not None:
+                read_records[x] = cached_record
+            else:
+                uncached_records.append((x, requested_record))
+        return uncached_records
+
+    @staticmethod
+    def _get_unique_query_values(record_type, query_key, requested_records):
+        query_values = collections.OrderedDict()
+        for x, requested_record in requested_records:
+            query_value = requested_record[record_type][query_key]
+            query_values.setdefault(ForemanApiRecord.normalize_identification_value(query_key, query_value), query_value)
+        return list(query_values.values())
+
+    @staticmethod
+    def _plan_batch_read(record_cache, records, max_search_length, read_records, records_to_lookup):
+
+        # Returns the searches to make for a batch read, as tuples of
+        #   record type, identification property, uncached records, searches, page size, dependencies
+        # The cached records are placed in read_records and the records identified by id are added to records_to_lookup
+        batch_searches = []
+        for (record_type, scope, query_key), requested_records in ForemanApiWrapper._group_records_for_batch_read(records).items():
+
+            uncached_records = ForemanApiWrapper._get_uncached_records(record_cache, requested_records, query_key, scope, read_records)
+            if not uncached_records:
+                continue
+
+            # Records identified by id are looked up directly
+            if query_key == "id":
+                records_to_lookup += uncached_records
+                continue
+
+            dependencies = ForemanApiRecord.get_record_dependencies(uncached_records[0][1])
+            query_values = ForemanApiWrapper._get_unique_query_values(record_type, query_key, uncached_records)
+            searches = ForemanApiWrapper._create_in_list_searches(query_key, query_values, max_search_length)
+            batch_searches.append((record_type, query_key, uncached_records, searches, max(100, len(query_values)), dependencies))
+        return batch_searches
+
+    @staticmethod
+    def _apply_batch_results(record_type, query_key, uncached_records, result_bodies, complete_records, read_records, records_to_lookup):
+
+        # The records found by the searches are placed in read_records, and added to records_to_lookup if complete records are required
+        matched_bodies = ForemanApiWrapper._match_batch_results(record_type, query_key, uncached_records, result_bodies)
+        for x, requested_record in uncached_records:
+            if matched_bodies[x] is None:
+                continue
+            read_records[x] = {record_type: matched_bodies[x]}
+            if complete_records:
+                records_to_lookup.append((x, ForemanApiWrapper._create_result_record(requested_record, record_type, matched_bodies[x])))
+
+    @Deadline.operation
+    def read_records(self, records, complete_records=True, max_search_length=4000):
+
+        # This function reads many records with as few api calls as possible
+        # The records are grouped by type and identification property, and each group is found
+        # with scoped search IN-list queries rather than one search per record
+        # The results are matched back to the requested records locally
+        # A list with the record (or None if it does not exist) for each requested record is returned in the same order
+        # The records returned by a search are not complete, if complete_records is True the
+        # complete records are looked up by id (concurrently, and through the cache if one is in use)
+
+        try:
+            read_records = [None] * len(records)
+            records_to_lookup = []
+
+            for record_type, query_key, uncached_records, searches, per_page, dependencies in ForemanApiWrapper._plan_batch_read(
+                    self.record_cache, records, max_search_length, read_records, records_to_lookup):
+                result_bodies = []
+                for search in searches:
+                    for result_record in self.list_records(record_type, search=search, per_page=per_page, dependencies=dependencies):
+                        result_bodies.append(result_record[record_type])
+                ForemanApiWrapper._apply_batch_results(record_type, query_key, uncached_records, result_bodies, complete_records, read_records, records_to_lookup)
+
+            if records_to_lookup:
+                with ThreadPoolExecutor(max_workers=self.lookup_concurrency) as executor:
+                    looked_up_records = list(executor.map(Deadline.bind(self._lookup_record_using_partial), [record for x, record in records_to_lookup]))
+                for (x, record), looked_up_record in zip(records_to_lookup, looked_up_records):
+                    read_records[x] = looked_up_record
+
+            return read_records
+        except Exception as e:
+            raise Exception("An error occurred while reading the records.") from e
+
     @staticmethod
     def _convert_record_for_api_method(http_method, record):
 
@@ -509,72 +1642,130 @@ class ForemanApiWrapper:
             record.pop("dependencies")
         return record
 
-    def create_record(self, minimal_record):
+    @staticmethod
+    def _prepare_create_record_call(minimal_record):
 
-        try:
-            set_url = self._determine_api_endpoint_for_record(minimal_record, include_query=False)
-            http_method = "POST"
+        set_url = ForemanApiWrapper._determine_api_endpoint_for_record(minimal_record, include_query=False)
+        http_method = "POST"
+
+        headers = ForemanApiWrapper._get_headers_for_http_method(http_method)
 
-            headers = ForemanApiWrapper._get_headers_for_http_method(http_method)
+        # We may need to convert the record based on the API endpoint being used
+        # The API is inconsistent in the way it represents data
+        record_for_post = ForemanApiWrapper._convert_record_for_api_method(http_method, minimal_record)
 
-            # We may need to convert the record based on the API endpoint being used
-            # The API is inconsistent in the way it represents data
-            record_for_post = ForemanApiWrapper._convert_record_for_api_method(http_method, minimal_record)
+        # The api call will expect the arguments in a certain form
+        api_call_arguments = ForemanApiWrapper._get_api_call_arguments(record_for_post)
+        record_type = ForemanApiRecord.get_record_type_from_record(minimal_record)
+
+        return set_url, http_method, api_call_arguments, headers, record_type
+
+    @Deadline.operation
+    @ApiEndpointBalancer.pinned
+    def create_record(self, minimal_record):
 
-            # The api call will expect the arguments in a certain form
-            api_call_arguments = ForemanApiWrapper._get_api_call_arguments(record_for_post)
-            record_type = ForemanApiRecord.get_record_type_from_record(minimal_record)
+        try:
+            scope = ForemanApiWrapper._get_record_scope(minimal_record)
+            set_url, http_method, api_call_arguments, headers, record_type = ForemanApiWrapper._prepare_create_record_call(minimal_record)
             created_record_body = self.make_api_call(set_url, http_method, api_call_arguments, headers)
             created_record = {record_type : created_record_body}
 
+            ForemanApiWrapper._remember_modified_record(self.record_cache, self.record_index, minimal_record, created_record, http_method, scope)
+
             return created_record
 
         except Exception as e:
             raise Exception("An error occurred while creating the record.") from e
 
+    @staticmethod
+    def _prepare_update_record_call(minimal_record):
+
+        set_url = ForemanApiWrapper._determine_api_endpoint_for_record(minimal_record)
+        http_method = "PUT"
+
+        # Foreman's API specifies that put and post api calls must set the Content-type header
+        # If we dont, we will get an exception as follows:
+        #       Exception.args[0]:
+        #           '415 Client Error: Unsupported Media Type for url: https://15.4.7.1/api/environments'
+        #
+        #       response._content:
+        #           b'{\n  "error": {"message":"\'Content-Type: \' is unsupported in API v2 for POST and PUT requests. Please use \'Content-Type: application/json\'."}\n}\n'
+
+        headers = ForemanApiWrapper._get_headers_for_http_method(http_method)
+
+        # We may need to convert the record based on the API endpoint being used
+        # The API is inconsistent in the way it represents data
+        record_for_put = ForemanApiWrapper._convert_record_for_api_method(http_method, minimal_record)
+
+        # The api call will expect the arguments in a certain form
+        api_call_arguments = ForemanApiWrapper._get_api_call_arguments(record_for_put)
+        record_type = ForemanApiRecord.get_record_type_from_record(minimal_record)
+
+        return set_url, http_method, api_call_arguments, headers, record_type
+
+    @staticmethod
+    def _confirm_modified_record(minimal_record, modified_record, endpoint, http_method):
+
+        # Verify that the modified record has the same identity as the minimal record
+        # Raise an exception if it does not
+        try:
+            ForemanApiRecord.confirm_modified_record_identity(minimal_record, modified_record)
+        except Exception as e:
+            raise ModifiedRecordMismatchException(
+                ForemanApiWrapper._modified_record_mismatch_message,
+                endpoint,
+                http_method,
+                minimal_record,
+                modified_record)
+
+    @Deadline.operation
+    @ApiEndpointBalancer.pinned
     def update_record(self, minimal_record):
 
         try:
-            set_url = self._determine_api_endpoint_for_record(minimal_record)
-            http_method = "PUT"
-
-            # Foreman's API specifies that put and post api calls must set the Content-type header
-            # If we dont, we will get an exception as follows:
-            #       Exception.args[0]:
-            #           '415 Client Error: Unsupported Media Type for url: https://15.4.7.1/api/environments'
-            #
-            #       response._content:
-            #           b'{\n  "error": {"message":"\'Content-Type: \' is unsupported in API v2 for POST and PUT requests. Please use \'Content-Type: application/json\'."}\n}\n'
-
-            headers = ForemanApiWrapper._get_headers_for_http_method(http_method)
-
-            # We may need to convert the record based on the API endpoint being used
-            # The API is inconsistent in the way it represents data
-            record_for_put = ForemanApiWrapper._convert_record_for_api_method(http_method, minimal_record)
-
-            # The api call will expect the arguments in a certain form
-            api_call_arguments = ForemanApiWrapper._get_api_call_arguments(record_for_put)
-            record_type = ForemanApiRecord.get_record_type_from_record(minimal_record)
+            scope = ForemanApiWrapper._get_record_scope(minimal_record)
+            set_url, http_method, api_call_arguments, headers, record_type = ForemanApiWrapper._prepare_update_record_call(minimal_record)
             updated_record_body = self.make_api_call(set_url, http_method, api_call_arguments, headers)
             updated_record = {record_type : updated_record_body}
 
             # Verify that the updated record has the same id as the minimal record
-            # Raise an exception if it does not
-            try:
-                ForemanApiRecord.confirm_modified_record_identity(minimal_record, updated_record)
-            except Exception as e:
-                raise ModifiedRecordMismatchException(
-                    self._modified_record_mismatch_message,
-                    set_url,
-                    http_method,
-                    minimal_record,
-                    updated_record)
+            ForemanApiWrapper._confirm_modified_record(minimal_record, updated_record, set_url, http_method)
+
+            ForemanApiWrapper._remember_modified_record(self.record_cache, self.record_index, minimal_record, updated_record, http_method, scope)
 
             return updated_record
 
         except Exception as e:
             raise Exception("An error occurred while updating the record.") from e
 
+    @staticmethod
+    def _prepare_delete_record_call(minimal_record):
+
+        # If the record is going to be deleted, we need to establish the identifying property
+        identification_field_name = ForemanApiRecord.get_record_identifcation_properties(minimal_record)[0]
+        minimal_record_type = ForemanApiRecord.get_record_type_from_record(minimal_record)
+        identification_field_value = minimal_record[minimal_record_type][identification_field_name]
+
+        # Determine the url we will be submitting to
+        http_method = "DELETE"
+        base_delete_url = ForemanApiWrapper._determine_api_endpoint_for_record(minimal_record, include_query=False)
+        delete_endpoint = "{0}/{1}".format(base_delete_url, identification_field_value)
+        if PY3:
+            encoded_delete_endpoint = urllib.parse.quote(delete_endpoint)
+        else:
+            encoded_delete_endpoint = urllib.quote(delete_endpoint)
+
+        # We may need to convert the record based on the API endpoint being used
+        # The API is inconsistent in the way it represents data
+        record_for_delete = ForemanApiWrapper._convert_record_for_api_method(http_method, minimal_record)
+
+        # The api call will expect the arguments in a certain form
+        api_call_arguments = ForemanApiWrapper._get_api_call_arguments(record_for_delete)
+
+        return encoded_delete_endpoint, http_method, api_call_arguments, minimal_record_type
+
+    @Deadline.operation
+    @ApiEndpointBalancer.pinned
     def delete_record(self, minimal_record):
 
         # It looks like a delete is simply setting some value to nothing
@@ -584,42 +1775,17 @@ class ForemanApiWrapper:
         # that the deleted record matches the url supplied
 
         try:
-            # If the record is going to be deleted, we need to establish the identifying property
-            identification_field_name = ForemanApiRecord.get_record_identifcation_properties(minimal_record)[0]
-            minimal_record_type = ForemanApiRecord.get_record_type_from_record(minimal_record)
-            identification_field_value = minimal_record[minimal_record_type][identification_field_name]
-
-            # Determine the url we will be submitting to
-            http_method = "DELETE"
-            base_delete_url = self._determine_api_endpoint_for_record(minimal_record, include_query=False)
-            delete_endpoint = "{0}/{1}".format(base_delete_url, identification_field_value)
-            if PY3:
-                encoded_delete_endpoint = urllib.parse.quote(delete_endpoint)
-            else:
-                encoded_delete_endpoint = urllib.quote(delete_endpoint)
-
-            # We may need to convert the record based on the API endpoint being used
-            # The API is inconsistent in the way it represents data
-            record_for_delete = ForemanApiWrapper._convert_record_for_api_method(http_method, minimal_record)
-
-            # The api call will expect the arguments in a certain form
-            api_call_arguments = ForemanApiWrapper._get_api_call_arguments(record_for_delete)
+            scope = ForemanApiWrapper._get_record_scope(minimal_record)
+            encoded_delete_endpoint, http_method, api_call_arguments, minimal_record_type = ForemanApiWrapper._prepare_delete_record_call(minimal_record)
             deleted_record_body = self.make_api_call(encoded_delete_endpoint, http_method, api_call_arguments, None)
             deleted_record = {
                 minimal_record_type: deleted_record_body
             }
 
             # Verify that the updated record has the same value for the identification field
-            # Raise an exception if it does not
-            try:
-                ForemanApiRecord.confirm_modified_record_identity(minimal_record, deleted_record)
-            except Exception as e:
-                raise ModifiedRecordMismatchException(
-                    self._modified_record_mismatch_message,
-                    encoded_delete_endpoint,
-                    http_method,
-                    minimal_record,
-                    deleted_record)
+            ForemanApiWrapper._confirm_modified_record(minimal_record, deleted_record, encoded_delete_endpoint, http_method)
+
+            ForemanApiWrapper._remember_modified_record(self.record_cache, self.record_index, minimal_record, deleted_record, http_method, scope)
 
             return deleted_record
 
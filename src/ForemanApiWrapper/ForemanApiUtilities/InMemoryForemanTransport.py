@@ -0,0 +1,318 @@
+import copy
+import json
+import re
+import threading
+import time
+import urllib.parse
+from ForemanApiWrapper.ForemanApiUtilities.ApiTransport import ApiTransport
+from ForemanApiWrapper.ForemanApiUtilities.ForemanApiWrapper import ForemanApiWrapper
+from ForemanApiWrapper.ForemanApiUtilities.Mappings.ApiRecordToUrlSuffixMapping import ApiRecordToUrlSuffixMapping
+from ForemanApiWrapper.RecordUtilities import ForemanApiRecord
+
+
+_search_tokens = re.compile(r'\s*(?:(?P<string>"(?:[^"\\]|\\.)*")|(?P<operator>!=|<=|>=|!~|!\^|=|~|\^|<|>)|(?P<punctuation>[(),])|(?P<word>[^\s()=!~^<>,"]+))')
+
+
+class _ScopedSearch:
+
+    # Parses the subset of Foreman's scoped search syntax used by this library into a function which matches record bodies
+    #   name = "foobar.com"              name != foobar.com               name ~ foobar
+    #   name ^ ("a.foobar.com","b")      id > 10                          foobar (a free text search on the name)
+    # Conditions are combined with and / or / not and grouped with parentheses (and binds tighter than or)
+
+    def __init__(self, search):
+        self.tokens = _ScopedSearch._tokenize(search)
+        self.position = 0
+        self.matches = self._parse_or() if self.tokens else (lambda record_body: True)
+        if self.position != len(self.tokens):
+            raise Exception("The search '{0}' could not be parsed.".format(search))
+
+    @staticmethod
+    def _tokenize(search):
+        tokens = []
+        position = 0
+        search = search.strip()
+        while position < len(search):
+            match = _search_tokens.match(search, position)
+            if match is None or match.end() == position:
+                raise Exception("The search '{0}' could not be parsed.".format(search))
+            position = match.end()
+            if match.group("string") is not None:
+                tokens.append(("value", re.sub(r'\\(.)', r'\1', match.group("string")[1:-1])))
+            elif match.group("operator") is not None:
+                tokens.append(("operator", match.group("operator")))
+            elif match.group("punctuation") is not None:
+                tokens.append((match.group("punctuation"), match.group("punctuation")))
+            else:
+                word = match.group("word")
+                if word.lower() in ["and", "&&"]:
+                    tokens.append(("and", word))
+                elif word.lower() in ["or", "||"]:
+                    tokens.append(("or", word))
+                elif word.lower() == "not":
+                    tokens.append(("not", word))
+                else:
+                    tokens.append(("value", word))
+        return tokens
+
+    def _peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def _next(self, kind=None):
+        token = self._peek()
+        if token[0] is None or (kind is not None and token[0] != kind):
+            raise Exception("Unexpected end of the search." if token[0] is None else "Unexpected '{0}' in the search.".format(token[1]))
+        self.position += 1
+        return token
+
+    def _parse_or(self):
+        conditions = [self._parse_and()]
+        while self._peek()[0] == "or":
+            self._next()
+            conditions.append(self._parse_and())
+        return lambda record_body: any(condition(record_body) for condition in conditions)
+
+    def _parse_and(self):
+
+        # Conditions which follow each other without an operator are and-ed, as in scoped search
+        conditions = [self._parse_not()]
+        while self._peek()[0] in ["and", "not", "(", "value"]:
+            if self._peek()[0] == "and":
+                self._next()
+            conditions.append(self._parse_not())
+        return lambda record_body: all(condition(record_body) for condition in conditions)
+
+    def _parse_not(self):
+        if self._peek()[0] == "not":
+            self._next()
+            condition = self._parse_not()
+            return lambda record_body: not condition(record_body)
+        if self._peek()[0] == "(":
+            self._next()
+            condition = self._parse_or()
+            self._next(")")
+            return condition
+        return self._parse_condition()
+
+    def _parse_condition(self):
+        field = self._next("value")[1]
+        if self._peek()[0] != "operator":
+            return lambda record_body: field.lower() in _ScopedSearch._text(record_body.get("name")).lower()
+        operator = self._next()[1]
+        if operator in ["^", "!^"]:
+            self._next("(")
+            values = [self._next("value")[1]]
+            while self._peek()[0] == ",":
+                self._next()
+                values.append(self._next("value")[1])
+            self._next(")")
+        else:
+            values = [self._next("value")[1]]
+        return lambda record_body: _ScopedSearch._compare(record_body, field, operator, values)
+
+    @staticmethod
+    def _text(value):
+        if isinstance(value, bool):
+            return "true" if value else "false"
+        if value is None:
+            return ""
+        return str(value)
+
+    @staticmethod
+    def _compare(record_body, field, operator, values):
+        if field not in record_body.keys():
+            return False
+        actual_values = record_body[field] if isinstance(record_body[field], list) else [record_body[field]]
+        return any(_ScopedSearch._compare_value(_ScopedSearch._text(actual), operator, values) for actual in actual_values)
+
+    @staticmethod
+    def _compare_value(actual, operator, values):
+        value = values[0]
+        if operator == "=":
+            return actual == value
+        if operator == "!=":
+            return actual != value
+        if operator == "~":
+            return value.lower() in actual.lower()
+        if operator == "!~":
+            return value.lower() not in actual.lower()
+        if operator == "^":
+            return actual in values
+        if operator == "!^":
+            return actual not in values
+        try:
+            actual, value = float(actual), float(value)
+        except ValueError:
+            pass
+        if operator == "<":
+            return actual < value
+        if operator == ">":
+            return actual > value
+        if operator == "<=":
+            return actual <= value
+        return actual >= value
+
+
+class InMemoryForemanTransport(ApiTransport):
+
+    # A transport which answers the api calls itself, from records held in memory, rather than sending them to Foreman
+    # It allows the wrappers and the ApiStateEnforcer to be exercised, benchmarked and load tested without a Foreman server
+    # The number of api calls made is deterministic, so the effect of a change on the calls made can be measured
+    #
+    # The endpoints used by this library are understood:
+    #   GET /api/<records>?search=...&page=...&per_page=...      an index page, filtered with a scoped search
+    #   GET /api/<records>/<id or name>                          a single record
+    #   POST /api/<records>, PUT and DELETE /api/<records>/<id or name>
+    # and the same endpoints nested under a parent record, eg. /api/operatingsystems/19/os_default_templates
+    #
+    #   latency - the time (in seconds) taken to answer each api call, to model a server for throughput measurements
+    #   sleep - the function used to wait for the latency
+
+    def __init__(self, latency=0.0, sleep=time.sleep):
+        self.latency = latency
+        self.sleep = sleep
+        self.calls = []
+        self._collections = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_record_type_for_collection(collection_name):
+        for record_type, url_suffix in ApiRecordToUrlSuffixMapping.items():
+            if url_suffix == collection_name:
+                return record_type
+        return collection_name[:-1] if collection_name.endswith("s") else collection_name
+
+    @staticmethod
+    def _split_path(path):
+
+        # Returns the path of the collection and the id or name of the record (None for the collection itself)
+        # eg. /api/operatingsystems/19/os_default_templates/3 -> (/api/operatingsystems/19/os_default_templates, 3)
+        segments = [urllib.parse.unquote(x) for x in path.strip("/").split("/")]
+        if len(segments) < 2 or segments[0] != "api":
+            return None, None
+        segments = segments[1:]
+        if len(segments) % 2 == 1:
+            return "/api/" + "/".join(segments), None
+        return "/api/" + "/".join(segments[:-1]), segments[-1]
+
+    def add_record(self, record):
+
+        # Adds a record (in the form used by the wrappers, with its dependencies if it is nested) and returns its body
+        record_type = ForemanApiRecord.get_record_type_from_record(record)
+        record_body = ForemanApiRecord.get_record_body_from_record(record)
+        dependencies = ForemanApiRecord.get_record_dependencies(record)
+        stand_in = {record_type: {}}
+        if dependencies:
+            stand_in["dependencies"] = dependencies
+        collection_path = "/api" + ForemanApiWrapper._determine_record_suffix(stand_in)
+        with self._lock:
+            return copy.deepcopy(self._insert(collection_path, copy.deepcopy(record_body)))
+
+    def get_records(self, collection_path):
+
+        # Returns the bodies of the records in a collection, eg. get_records("/api/domains")
+        with self._lock:
+            return copy.deepcopy(list(self._collections.get(collection_path, {}).values()))
+
+    def get_call_count(self, http_method=None):
+        if http_method is None:
+            return len(self.calls)
+        return len([x for x in self.calls if x[0] == http_method.upper()])
+
+    def reset_calls(self):
+        self.calls = []
+
+    def _insert(self, collection_path, record_body):
+        if "id" not in record_body.keys():
+            record_body["id"] = self._next_id
+        self._next_id = max(self._next_id, record_body["id"]) + 1
+
+        # A nested record refers to its parent, eg. an os_default_template has an operatingsystem_id
+        segments = collection_path.split("/")
+        if len(segments) >= 5:
+            parent_type = InMemoryForemanTransport._get_record_type_for_collection(segments[-3])
+            record_body.setdefault("{0}_id".format(parent_type), int(segments[-2]) if segments[-2].isdigit() else segments[-2])
+
+        self._collections.setdefault(collection_path, {})[record_body["id"]] = record_body
+        return record_body
+
+    def _find(self, collection_path, identifier):
+        records = self._collections.get(collection_path, {})
+        if identifier.isdigit() and int(identifier) in records.keys():
+            return records[int(identifier)]
+        for record_body in records.values():
+            if record_body.get("name") == identifier:
+                return record_body
+        return None
+
+    @staticmethod
+    def _not_found(message):
+        return 404, {"error": {"message": message}}
+
+    def _index(self, collection_path, query):
+        search = query.get("search", [""])[0]
+        page = int(query.get("page", ["1"])[0])
+        per_page = int(query.get("per_page", ["20"])[0])
+        records = self._collections.get(collection_path, {})
+        try:
+            matches = _ScopedSearch(search).matches
+        except Exception as e:
+            return 422, {"error": {"message": str(e)}}
+        results = [x for x in sorted(records.values(), key=lambda x: x["id"]) if matches(x)]
+        return 200, {
+            "total": len(records),
+            "subtotal": len(results),
+            "page": page,
+            "per_page": per_page,
+            "search": search or None,
+            "results": results[(page - 1) * per_page:page * per_page]}
+
+    def _handle(self, http_method, path, query, arguments):
+        collection_path, identifier = InMemoryForemanTransport._split_path(path)
+        if collection_path is None:
+            return InMemoryForemanTransport._not_found("Route not found.")
+        record_type = InMemoryForemanTransport._get_record_type_for_collection(collection_path.split("/")[-1])
+
+        if identifier is None:
+            if http_method == "GET":
+                return self._index(collection_path, query)
+            if http_method == "POST":
+                record_body = copy.deepcopy((arguments or {}).get(record_type, {}))
+                name = record_body.get("name")
+                if name is not None and self._find(collection_path, name) is not None:
+                    return 422, {"error": {"id": None, "errors": {"name": ["has already been taken"]}, "full_messages": ["Name has already been taken"]}}
+                return 201, self._insert(collection_path, record_body)
+            return InMemoryForemanTransport._not_found("Route not found.")
+
+        record_body = self._find(collection_path, identifier)
+        if record_body is None:
+            return InMemoryForemanTransport._not_found("Resource {0} not found by id '{1}'".format(record_type, identifier))
+        if http_method == "GET":
+            return 200, record_body
+        if http_method == "PUT":
+            record_id = record_body["id"]
+            record_body.update(copy.deepcopy((arguments or {}).get(record_type, {})))
+            record_body["id"] = record_id
+            return 200, record_body
+        if http_method == "DELETE":
+            del self._collections[collection_path][record_body["id"]]
+            return 200, record_body
+        return InMemoryForemanTransport._not_found("Route not found.")
+
+    def request(self, http_method, url, body=None, headers=None, timeout=None, stream=False):
+        http_method = http_method.upper()
+        split_url = urllib.parse.urlsplit(url)
+        self.calls.append((http_method, split_url.path + ("?" + split_url.query if split_url.query else "")))
+
+        if self.latency > 0:
+            self.sleep(self.latency)
+
+        arguments = ApiTransport._decode_request_body(body, headers)
+        with self._lock:
+            status_code, response_body = self._handle(http_method, split_url.path, urllib.parse.parse_qs(split_url.query), arguments)
+            content = json.dumps(response_body).encode("utf-8")
+
+        return ApiTransport._create_response(url, status_code, content, stream=stream)
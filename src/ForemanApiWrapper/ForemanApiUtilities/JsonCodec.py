@@ -0,0 +1,35 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JsonCodec:
+
+    # Encodes request bodies and decodes response bodies
+    # The bodies are handled as bytes so that a response is parsed straight from the bytes received
+    # rather than being decoded to a str first (an extra copy of what can be hundreds of KB for hosts and templates)
+    #
+    # The orjson backend is used when it is installed and the json module from the standard library otherwise
+    #   backend - "orjson", "json" or None to pick the fastest available backend
+
+    def __init__(self, backend=None):
+        if backend is None:
+            backend = "orjson" if orjson is not None else "json"
+        if backend not in ["orjson", "json"]:
+            raise Exception("The json backend '{0}' is not supported.".format(backend))
+        if backend == "orjson" and orjson is None:
+            raise Exception("The orjson module is required to use the orjson backend.")
+        self.backend = backend
+
+    def loads(self, content):
+        if self.backend == "orjson":
+            return orjson.loads(content)
+        return json.loads(content)
+
+    def dumps(self, obj):
+        if self.backend == "orjson":
+            return orjson.dumps(obj)
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
@@ -0,0 +1,79 @@
+import asyncio
+import threading
+import time
+
+
+class RateLimiter:
+
+    # A token bucket limiting the rate at which api calls are made
+    # Tokens are added at a steady rate up to the size of the bucket and each api call takes one token
+    # When the bucket is empty, callers wait until the next token is added
+    # This keeps the request rate at the rate the server can sustain while still allowing short bursts
+    #
+    # Reads and writes put a very different load on Foreman (a POST of a host touches many tables)
+    # so the rate can be set per http method, methods without a rate of their own use the default bucket
+    #   rate - the number of api calls per second (None for no limit)
+    #   burst - the size of the bucket, the number of api calls which can be made at once after an idle period
+    #   method_rates - a dict of http method to rate or (rate, burst) tuple
+    #
+    # A single limiter can be shared by several wrappers, threads and event loops
+    #
+    # acquire can be given a timeout (eg. the time left before a deadline), if the wait for a token would be longer
+    # no token is taken and a TimeoutError is raised straight away
+
+    def __init__(self, rate=None, burst=None, method_rates=None, clock=time.monotonic, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._buckets[None] = self._create_bucket(rate, burst)
+        for method, method_rate in (method_rates or {}).items():
+            if isinstance(method_rate, tuple):
+                self._buckets[method.lower()] = self._create_bucket(*method_rate)
+            else:
+                self._buckets[method.lower()] = self._create_bucket(method_rate, None)
+
+    def _create_bucket(self, rate, burst):
+        if rate is None:
+            return None
+        if burst is None:
+            burst = max(1.0, rate)
+        # A bucket is a list of [rate, burst, tokens, last refill time]
+        return [float(rate), float(burst), float(burst), self.clock()]
+
+    def _get_bucket(self, http_method):
+        if http_method is not None and http_method.lower() in self._buckets:
+            return self._buckets[http_method.lower()]
+        return self._buckets[None]
+
+    def _reserve(self, http_method, timeout=None):
+
+        # Take a token from the bucket and return the number of seconds to wait before it can be used
+        # The token is taken even if the bucket is empty (the bucket goes into debt)
+        # so that waiting callers are served in the order they arrived
+        bucket = self._get_bucket(http_method)
+        if bucket is None:
+            return 0
+        with self._lock:
+            rate, burst, tokens, last = bucket
+            now = self.clock()
+            tokens = min(burst, tokens + (now - last) * rate)
+            bucket[3] = now
+            delay = max(0, (1 - tokens) / rate)
+            if timeout is not None and delay > timeout:
+                bucket[2] = tokens
+                raise TimeoutError("The wait for the rate limiter would be longer than {0:.2f} seconds.".format(timeout))
+            bucket[2] = tokens - 1
+            return delay
+
+    def acquire(self, http_method=None, timeout=None):
+        delay = self._reserve(http_method, timeout)
+        if delay > 0:
+            self.sleep(delay)
+        return delay
+
+    async def acquire_async(self, http_method=None, timeout=None):
+        delay = self._reserve(http_method, timeout)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
@@ -0,0 +1,113 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from ForemanApiWrapper.ForemanApiUtilities.ApiCallMetrics import ApiCallMetrics
+from ForemanApiWrapper.RecordUtilities import ForemanApiRecord
+
+
+class RecordCache:
+
+    # An in process cache of complete records read from the api
+    # Records are keyed by their record type and id, and can also be found using the value
+    # of one of their identification properties (eg. the name of a domain or the mac of a host)
+    # Entries expire once they are older than the ttl (in seconds)
+    # Once the cache holds max_size records, the least recently used record is evicted
+    # The hits, misses, evictions, expirations and invalidations are counted in the metrics field
+    # Records which are nested under other records (eg. os_default_templates) are only unique within their parent
+    # so the identification property values are scoped (see ForemanApiWrapper._get_record_scope)
+    # Copies of the records are stored and returned so callers cannot modify the cached records
+
+    def __init__(self, max_size=1000, ttl=300, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.metrics = ApiCallMetrics()
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._aliases = {}
+
+    @staticmethod
+    def _create_alias_key(record_type, property_name, property_value, scope):
+        return record_type, scope, property_name, ForemanApiRecord.normalize_identification_value(property_name, property_value)
+
+    def _remove_entry(self, key):
+        expires_at, record, alias_keys = self._entries.pop(key)
+        for alias_key in alias_keys:
+            if self._aliases.get(alias_key) == key:
+                self._aliases.pop(alias_key)
+
+    def _get_entry(self, key):
+        if key not in self._entries.keys():
+            self.metrics.increment("misses")
+            return None
+
+        expires_at, record, alias_keys = self._entries[key]
+        if expires_at <= self._clock():
+            self._remove_entry(key)
+            self.metrics.increment("expirations")
+            self.metrics.increment("misses")
+            return None
+
+        self._entries.move_to_end(key)
+        self.metrics.increment("hits")
+        return copy.deepcopy(record)
+
+    def get(self, record_type, record_id):
+        with self._lock:
+            return self._get_entry((record_type, str(record_id)))
+
+    def get_by_property(self, record_type, property_name, property_value, scope=None):
+        if property_name == "id":
+            return self.get(record_type, property_value)
+
+        with self._lock:
+            alias_key = RecordCache._create_alias_key(record_type, property_name, property_value, scope)
+            if alias_key not in self._aliases.keys():
+                self.metrics.increment("misses")
+                return None
+            return self._get_entry(self._aliases[alias_key])
+
+    def put(self, record, scope=None):
+
+        # Only records with an id can be cached
+        record = ForemanApiRecord.remove_dependencies_from_record(record)
+        record_type = ForemanApiRecord.get_record_type_from_record(record)
+        record_body = ForemanApiRecord.get_record_body_from_record(record)
+        if "id" not in record_body.keys():
+            return
+
+        key = (record_type, str(record_body["id"]))
+        with self._lock:
+            if key in self._entries.keys():
+                self._remove_entry(key)
+
+            alias_keys = []
+            for alias_property in ForemanApiRecord.get_alternate_identification_properties(record_type):
+                if alias_property in record_body.keys():
+                    alias_key = RecordCache._create_alias_key(record_type, alias_property, record_body[alias_property], scope)
+                    self._aliases[alias_key] = key
+                    alias_keys.append(alias_key)
+
+            self._entries[key] = (self._clock() + self.ttl, copy.deepcopy(record), alias_keys)
+
+            while len(self._entries) > self.max_size:
+                oldest_key = next(iter(self._entries))
+                self._remove_entry(oldest_key)
+                self.metrics.increment("evictions")
+
+    def invalidate(self, record_type, record_id):
+        key = (record_type, str(record_id))
+        with self._lock:
+            if key in self._entries.keys():
+                self._remove_entry(key)
+                self.metrics.increment("invalidations")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._aliases.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,104 @@
+import threading
+from collections import OrderedDict
+from ForemanApiWrapper.ForemanApiUtilities.ApiCallMetrics import ApiCallMetrics
+from ForemanApiWrapper.RecordUtilities import ForemanApiRecord
+
+
+class RecordIdentityIndex:
+
+    # An index from the identification property values of the records seen in api responses to their ids
+    # For example ("host", None, "mac", "aa:bb:cc:dd:ee:ff") -> 12
+    # It allows a record which has been seen before to be read by id rather than searched for by name or mac
+    # Records which are nested under other records (eg. os_default_templates) are only unique within their parent
+    # so the keys are scoped (see ForemanApiWrapper._get_record_scope)
+    # Once the index holds max_size keys, the least recently used key is dropped
+    # The hits, misses and removals are counted in the metrics field
+    # The keys of each record are also kept by record type and id, so that a deleted record's keys are removed
+    # without looking through the whole index
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.metrics = ApiCallMetrics()
+        self._lock = threading.Lock()
+        self._ids = OrderedDict()
+        self._keys = {}
+
+    @staticmethod
+    def _create_key(record_type, property_name, property_value, scope):
+        return record_type, scope, property_name, ForemanApiRecord.normalize_identification_value(property_name, property_value)
+
+    @staticmethod
+    def _create_id_key(record_type, record_id):
+        return record_type, str(record_id)
+
+    def _set(self, key, record_id):
+
+        # The lock must be held
+        self._discard(key, self._ids.get(key))
+        self._ids[key] = record_id
+        self._ids.move_to_end(key)
+        self._keys.setdefault(RecordIdentityIndex._create_id_key(key[0], record_id), set()).add(key)
+
+    def _discard(self, key, record_id):
+
+        # The lock must be held, removes the key from the keys of the record it pointed to
+        if record_id is None:
+            return
+        id_key = RecordIdentityIndex._create_id_key(key[0], record_id)
+        keys = self._keys.get(id_key)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                self._keys.pop(id_key)
+
+    def _pop(self, key):
+
+        # The lock must be held
+        self._discard(key, self._ids.pop(key))
+
+    def add(self, record, scope=None):
+        record_type = ForemanApiRecord.get_record_type_from_record(record)
+        record_body = ForemanApiRecord.get_record_body_from_record(record)
+        if "id" not in record_body.keys():
+            return
+
+        with self._lock:
+            for property_name in ForemanApiRecord.get_alternate_identification_properties(record_type):
+                if property_name in record_body.keys() and record_body[property_name] is not None:
+                    key = RecordIdentityIndex._create_key(record_type, property_name, record_body[property_name], scope)
+                    self._set(key, record_body["id"])
+
+            while len(self._ids) > self.max_size:
+                self._pop(next(iter(self._ids)))
+
+    def get_id(self, record_type, property_name, property_value, scope=None):
+        key = RecordIdentityIndex._create_key(record_type, property_name, property_value, scope)
+        with self._lock:
+            if key not in self._ids.keys():
+                self.metrics.increment("misses")
+                return None
+            self._ids.move_to_end(key)
+            self.metrics.increment("hits")
+            return self._ids[key]
+
+    def remove(self, record_type, property_name, property_value, scope=None):
+        key = RecordIdentityIndex._create_key(record_type, property_name, property_value, scope)
+        with self._lock:
+            if key in self._ids.keys():
+                self._pop(key)
+                self.metrics.increment("removals")
+
+    def remove_id(self, record_type, record_id):
+        with self._lock:
+            for key in list(self._keys.get(RecordIdentityIndex._create_id_key(record_type, record_id), [])):
+                self._pop(key)
+                self.metrics.increment("removals")
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+            self._keys.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._ids)
@@ -0,0 +1,33 @@
+import time
+from ForemanApiWrapper.ForemanApiUtilities.ApiTransport import ApiTransport
+from ForemanApiWrapper.ForemanApiUtilities.ApiCassette import ApiCassette
+
+
+class RecordingTransport(ApiTransport):
+
+    # Sends the api calls with another transport and captures each request and response into a cassette
+    # The body of a streamed response is read in full so that it can be recorded
+    # Api calls which fail without a response (eg. a connection error) are not recorded
+
+    def __init__(self, transport, cassette=None):
+        self.transport = transport
+        self.cassette = cassette if cassette is not None else ApiCassette()
+
+    @property
+    def session(self):
+        return getattr(self.transport, "session", None)
+
+    @session.setter
+    def session(self, session):
+        self.transport.session = session
+
+    def request(self, http_method, url, body=None, headers=None, timeout=None, stream=False):
+        start = time.monotonic()
+        response = self.transport.request(http_method, url, body, headers, timeout, stream)
+        content = response.content
+        latency = time.monotonic() - start
+        self.cassette.add(http_method, url, ApiTransport._decode_request_body(body, headers), response.status_code, response.headers, content, latency)
+        return response
+
+    def close(self):
+        self.transport.close()
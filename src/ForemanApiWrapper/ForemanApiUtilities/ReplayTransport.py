@@ -0,0 +1,68 @@
+import collections
+import json
+import threading
+import time
+from ForemanApiWrapper.ForemanApiUtilities.ApiTransport import ApiTransport
+from ForemanApiWrapper.ForemanApiUtilities.ApiCassette import ApiCassette
+
+
+class ReplayTransport(ApiTransport):
+
+    # Answers api calls from the interactions of a cassette rather than sending them to Foreman
+    # An api call is matched on its method, endpoint and json arguments
+    # Calls which were recorded several times are answered with the recorded responses in order,
+    # and once those have all been used the last one is repeated
+    # A call which was never recorded is answered with a 404 and kept in unmatched (or raises if strict is set)
+    #   emulate_latency - wait for the recorded latency of each response (multiplied by latency_scale)
+    #   sleep - the function used to wait
+
+    def __init__(self, cassette, emulate_latency=False, latency_scale=1.0, strict=False, sleep=time.sleep):
+        self.cassette = cassette
+        self.emulate_latency = emulate_latency
+        self.latency_scale = latency_scale
+        self.strict = strict
+        self.sleep = sleep
+        self.calls = []
+        self.unmatched = []
+        self._lock = threading.Lock()
+        self._responses = collections.OrderedDict()
+        for interaction in cassette.interactions:
+            key = ReplayTransport._get_key(interaction["method"], interaction["endpoint"], interaction["request"])
+            self._responses.setdefault(key, collections.deque()).append(interaction)
+
+    @staticmethod
+    def _get_key(http_method, endpoint, arguments):
+
+        # The arguments are compared as json so that the encoder which produced them does not matter
+        return http_method.upper(), endpoint, json.dumps(arguments, sort_keys=True)
+
+    def _next_interaction(self, key):
+        with self._lock:
+            responses = self._responses.get(key)
+            if not responses:
+                return None
+            if len(responses) > 1:
+                return responses.popleft()
+            return responses[0]
+
+    def get_call_count(self, http_method=None):
+        if http_method is None:
+            return len(self.calls)
+        return len([x for x in self.calls if x[0] == http_method.upper()])
+
+    def request(self, http_method, url, body=None, headers=None, timeout=None, stream=False):
+        endpoint = ApiCassette.get_endpoint(url)
+        arguments = ApiTransport._decode_request_body(body, headers)
+        self.calls.append((http_method.upper(), endpoint))
+
+        interaction = self._next_interaction(ReplayTransport._get_key(http_method, endpoint, arguments))
+        if interaction is None:
+            if self.strict:
+                raise Exception("The cassette does not contain a response for [{0}] {1}.".format(http_method.upper(), endpoint))
+            self.unmatched.append((http_method.upper(), endpoint, arguments))
+            content = json.dumps({"error": {"message": "The cassette does not contain a response for the api call."}}).encode("utf-8")
+            return ApiTransport._create_response(url, 404, content, stream=stream)
+
+        if self.emulate_latency and interaction["latency"] > 0:
+            self.sleep(interaction["latency"] * self.latency_scale)
+        return ApiTransport._create_response(url, interaction["status"], ApiCassette.get_content(interaction), interaction["headers"], stream)
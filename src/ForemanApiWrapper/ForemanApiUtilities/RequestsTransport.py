@@ -0,0 +1,65 @@
+import requests
+from requests.adapters import HTTPAdapter
+from ForemanApiWrapper.ForemanApiUtilities.ApiTransport import ApiTransport
+
+
+class RequestsTransport(ApiTransport):
+
+    # The default transport, which sends the api calls with the requests module
+    #
+    # Calling the module level requests functions (requests.get, requests.post, etc.)
+    # opens a new TCP connection and performs a new TLS handshake for every api call
+    # A single ensure_state can make several calls, so most of the time would be spent on handshakes
+    # Instead we keep a session with a connection pool which is shared by all of the CRUD functions
+    # Connections are kept alive and reused, so the TLS session negotiated on the first call is reused
+    #   pool_connections - the number of hosts (connection pools) to cache
+    #   pool_maxsize - the maximum number of connections kept open per host
+    #   pool_block - whether to block when no free connection is available rather than opening a throwaway one
+    #   keep_alive - without keep alive the connection is closed by the server after each response
+
+    def __init__(self, auth, verify_ssl, pool_connections=10, pool_maxsize=10, pool_block=False, keep_alive=True, accept_encoding=None):
+        self.auth = auth
+        self.verify_ssl = verify_ssl
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.keep_alive = keep_alive
+        self.accept_encoding = accept_encoding
+        self.session = self._create_session()
+
+    def _create_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.auth = self.auth
+        if self.accept_encoding is not None:
+            session.headers["Accept-Encoding"] = self.accept_encoding
+        if not self.keep_alive:
+            session.headers["Connection"] = "close"
+        return session
+
+    def request(self, http_method, url, body=None, headers=None, timeout=None, stream=False):
+
+        # The session is created again if the transport was closed
+        if self.session is None:
+            self.session = self._create_session()
+
+        function_pointer = getattr(self.session, str.lower(http_method))
+        request_arguments = {"verify": self.verify_ssl, "timeout": timeout}
+        if body is not None:
+            request_arguments["data"] = body
+            request_arguments["headers"] = headers
+        if stream:
+            request_arguments["stream"] = True
+        return function_pointer(url, **request_arguments)
+
+    def close(self):
+
+        # Close the pooled connections held by the session
+        if self.session is not None:
+            self.session.close()
+            self.session = None
@@ -0,0 +1,129 @@
+import email.utils
+import random
+import threading
+import time
+
+
+class RetryPolicy:
+
+    # Decides whether a failed api call should be made again and how long to wait beforehand
+    # Foreman runs behind Passenger, which answers with 502/503 while it restarts,
+    # and an api call made during the restart should not be treated as a missing record
+    #
+    #   max_attempts - the maximum number of times a single api call is made (including the first)
+    #   backoff_factor - the base of the exponential backoff, the n-th retry waits up to backoff_factor * 2 ** n seconds
+    #   max_backoff - the maximum number of seconds to wait between attempts
+    #   jitter - whether to wait a random fraction of the backoff ("full jitter") so that clients do not retry in lockstep
+    #   retry_status_codes - the http status codes which are retried
+    #   retry_methods - the http methods which are retried, only idempotent methods are retried by default
+    #                   DELETE is not retried by default, a retry of a delete which was applied gets a 404 rather than the
+    #                   deleted record, add it to the methods if that is acceptable
+    #   respect_retry_after - whether to wait for the time given in a Retry-After header (capped at max_backoff)
+    #   retry_budget - the number of retries which can be made in a burst (None for no limit)
+    #                  each retry spends one from the budget and each successful api call earns retry_budget_ratio back
+    #                  (up to retry_budget), so while most api calls fail, failed api calls are raised immediately
+    #                  rather than hammering the server
+    #   retry_budget_ratio - the retries earned per successful api call, 0.1 allows a retry for every 10 successful api calls
+
+    default_retry_status_codes = (429, 502, 503, 504)
+    default_retry_methods = ("get", "put", "head", "options")
+
+    def __init__(self, max_attempts=4, backoff_factor=0.5, max_backoff=30, jitter=True,
+                 retry_status_codes=default_retry_status_codes, retry_methods=default_retry_methods,
+                 respect_retry_after=True, retry_budget=100, retry_budget_ratio=0.1, sleep=time.sleep, random_function=random.random):
+        self.max_attempts = max_attempts
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_status_codes = set(retry_status_codes)
+        self.retry_methods = set(x.lower() for x in retry_methods)
+        self.respect_retry_after = respect_retry_after
+        self.retry_budget = retry_budget
+        self.retry_budget_ratio = retry_budget_ratio
+        self.sleep = sleep
+        self.random_function = random_function
+        self._lock = threading.Lock()
+        self._retries = 0
+        self._budget = retry_budget
+
+    def is_retryable_status(self, status_code):
+        return status_code in self.retry_status_codes
+
+    def is_retryable_method(self, http_method):
+        return http_method.lower() in self.retry_methods
+
+    @property
+    def retries(self):
+        with self._lock:
+            return self._retries
+
+    @property
+    def remaining_budget(self):
+        with self._lock:
+            return self._budget
+
+    def reset_budget(self):
+        with self._lock:
+            self._retries = 0
+            self._budget = self.retry_budget
+
+    def record_success(self):
+
+        # Called for each successful api call, earning back part of a retry
+        with self._lock:
+            if self.retry_budget is not None:
+                self._budget = min(self.retry_budget, self._budget + self.retry_budget_ratio)
+
+    def _consume_budget(self):
+        with self._lock:
+            if self.retry_budget is not None:
+                if self._budget < 1:
+                    return False
+                self._budget -= 1
+            self._retries += 1
+            return True
+
+    @staticmethod
+    def parse_retry_after(value, now=None):
+
+        # The Retry-After header is either a number of seconds or an http date
+        if value is None:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at is None:
+            return None
+        if now is None:
+            now = time.time()
+        return max(0.0, retry_at.timestamp() - now)
+
+    def get_delay(self, attempt, retry_after=None):
+
+        # The attempt is the number of the retry about to be made, starting from 0
+        backoff = min(self.max_backoff, self.backoff_factor * (2 ** attempt))
+        if self.jitter:
+            backoff = self.random_function() * backoff
+
+        if self.respect_retry_after and retry_after is not None:
+            return min(self.max_backoff, max(backoff, retry_after))
+        return backoff
+
+    def get_retry_delay(self, http_method, attempt, status_code=None, retry_after=None):
+
+        # Returns the number of seconds to wait before the api call is made again
+        # or None if the api call should not be retried
+        # A status code of None denotes a connection error (no response was received)
+        if attempt + 1 >= self.max_attempts:
+            return None
+        if not self.is_retryable_method(http_method):
+            return None
+        if status_code is not None and not self.is_retryable_status(status_code):
+            return None
+        if not self._consume_budget():
+            return None
+        return self.get_delay(attempt, RetryPolicy.parse_retry_after(retry_after))
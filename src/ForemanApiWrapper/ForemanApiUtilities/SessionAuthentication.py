@@ -0,0 +1,51 @@
+import threading
+from requests.auth import HTTPBasicAuth, _basic_auth_str
+
+
+class SessionAuthentication(HTTPBasicAuth):
+
+    # Authenticates the first api call with the username and password and reuses the session cookie Foreman sets
+    # (_session_id) for the following calls, so the password is not checked again on every call
+    # The cookie is kept by the requests session (or the aiohttp cookie jar)
+    # If the session has expired Foreman responds with a 401, the call is then sent again with the username and password
+    # which starts a new session
+    #   reauthentications - the number of calls which had to be sent again
+
+    reuse_session = True
+
+    def __init__(self, username, password, cookie_name="_session_id"):
+        super().__init__(username, password)
+        self.cookie_name = cookie_name
+        self.reauthentications = 0
+        self._lock = threading.Lock()
+
+    def has_session_cookie(self, cookie_header):
+        return any(x.strip().startswith(self.cookie_name + "=") for x in (cookie_header or "").split(";"))
+
+    def count_reauthentication(self):
+        with self._lock:
+            self.reauthentications += 1
+
+    def __call__(self, r):
+
+        # The cookies of the session have already been added to the request
+        if not self.has_session_cookie(r.headers.get("Cookie")):
+            return super().__call__(r)
+        r.register_hook("response", self.handle_401)
+        return r
+
+    def handle_401(self, r, **kwargs):
+        if r.status_code != 401 or "Authorization" in r.request.headers:
+            return r
+        self.count_reauthentication()
+
+        # Release the connection and send the request again without the expired session cookie
+        r.content
+        r.close()
+        prep = r.request.copy()
+        prep.headers.pop("Cookie", None)
+        prep.headers["Authorization"] = _basic_auth_str(self.username, self.password)
+        _r = r.connection.send(prep, **kwargs)
+        _r.history.append(r)
+        _r.request = prep
+        return _r
@@ -0,0 +1,113 @@
+import asyncio
+import copy
+import threading
+
+
+class _Call:
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.exception = None
+        self.followers = 0
+
+
+# The result given to the followers of a call whose leader was cancelled
+_abandoned = object()
+
+
+class SingleFlight:
+
+    # Coalesces identical calls which are in progress at the same time
+    # The first caller for a key (the leader) makes the call, callers arriving while it is in progress
+    # wait for it to finish and receive the same result (or exception) instead of making the call again
+    #
+    # The results are decoded json which the callers may modify,
+    # so when a result is shared every caller (the leader included) receives its own copy
+    #
+    # do is used from threads and do_async from an event loop, they keep separate sets of calls
+    # The wait of a follower can be given a timeout (eg. the time left before a deadline),
+    # a TimeoutError is raised once it passes (the leader carries on)
+
+    def __init__(self, copy_function=copy.deepcopy):
+        self.copy_function = copy_function
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+
+    def do(self, key, function, timeout=None):
+
+        # Returns a tuple of the result and whether it was shared with other callers
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                call.followers += 1
+
+        if not leader:
+            if not call.event.wait(timeout):
+                raise TimeoutError("The coalesced call did not finish within {0:.2f} seconds.".format(timeout))
+            if call.exception is not None:
+                raise call.exception
+            return self.copy_function(call.result), True
+
+        try:
+            call.result = function()
+        except BaseException as e:
+            call.exception = e
+            raise
+        finally:
+            # Once the call is removed no more followers can join it
+            with self._lock:
+                del self._calls[key]
+                followers = call.followers
+            call.event.set()
+
+        if followers:
+            return self.copy_function(call.result), True
+        return call.result, False
+
+    async def do_async(self, key, coroutine_function, timeout=None):
+
+        # See do, the followers await a future rather than waiting on an event
+        # The future is shielded so that a cancelled follower does not cancel the leader
+        # A cancelled leader (eg. its task was cancelled by its own deadline) abandons the call rather than cancelling
+        # its followers, the first of them makes the call again as the new leader and the others follow it
+        loop = asyncio.get_running_loop()
+        expires_at = loop.time() + timeout if timeout is not None else None
+        while True:
+            call = self._async_calls.get(key)
+            if call is None:
+                break
+            call[1] += 1
+            remaining = max(0, expires_at - loop.time()) if expires_at is not None else None
+            try:
+                result = await asyncio.wait_for(asyncio.shield(call[0]), remaining)
+            except asyncio.TimeoutError as e:
+                raise TimeoutError("The coalesced call did not finish within {0:.2f} seconds.".format(timeout)) from e
+            if result is not _abandoned:
+                return self.copy_function(result), True
+
+        future = loop.create_future()
+        call = [future, 0]
+        self._async_calls[key] = call
+        try:
+            result = await coroutine_function()
+        except asyncio.CancelledError:
+            future.set_result(_abandoned)
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case there were no followers
+            future.exception()
+            raise
+        finally:
+            del self._async_calls[key]
+
+        future.set_result(result)
+        if call[1]:
+            return self.copy_function(result), True
+        return result, False
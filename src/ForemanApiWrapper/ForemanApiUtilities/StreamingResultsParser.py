@@ -0,0 +1,129 @@
+import re
+
+
+_structural_characters = re.compile(rb'["\[\]{}]')
+_string_characters = re.compile(rb'["\\]')
+
+
+class StreamingResultsParser:
+
+    # Parses the results array of an index response incrementally as the bytes arrive
+    #   {"total": 120, "subtotal": 45, "page": 1, "per_page": 20, "search": "...", "results": [{...}, {...}, ...]}
+    # The bytes are fed in chunks and each record body is decoded as soon as its closing brace has been received,
+    # so only the record being received (and not the whole response) is held in memory
+    #
+    # The scanner only looks at the characters which delimit strings, objects and arrays (the rest are skipped by a regex)
+    # It keeps the envelope (every top level key except the results) which can be read with close once the response ends
+
+    def __init__(self, json_codec, array_key="results"):
+        self.json_codec = json_codec
+        self.array_key = array_key.encode("utf-8")
+        self._buffer = bytearray()
+        self._position = 0
+        self._depth = 0
+        self._in_string = False
+        self._string_start = None
+        self._in_array = False
+        self._array_key_seen = False
+        self._element_start = None
+        self._envelope = bytearray()
+        self._envelope_position = 0
+
+    def feed(self, chunk):
+
+        # Returns the record bodies which were completed by the chunk
+        records = []
+        buffer = self._buffer
+        buffer += chunk
+        length = len(buffer)
+        position = self._position
+
+        while position < length:
+            if self._in_string:
+                match = _string_characters.search(buffer, position)
+                if match is None:
+                    position = length
+                    break
+                end = match.start()
+                if buffer[end] == 0x5c:
+                    # An escape, the escaped character may be in the next chunk
+                    if end + 1 >= length:
+                        position = end
+                        break
+                    position = end + 2
+                    continue
+                self._in_string = False
+                if self._depth == 1 and not self._in_array:
+                    self._array_key_seen = buffer[self._string_start:end] == self.array_key
+                self._string_start = None
+                position = end + 1
+                continue
+
+            match = _structural_characters.search(buffer, position)
+            if match is None:
+                position = length
+                break
+            index = match.start()
+            character = buffer[index]
+            position = index + 1
+
+            if character == 0x22:
+                self._in_string = True
+                # Only the keys of the envelope are needed, to find the results array
+                if self._depth == 1 and not self._in_array:
+                    self._string_start = position
+            elif character in (0x7b, 0x5b):
+                if self._depth == 1 and not self._in_array and character == 0x5b and self._array_key_seen:
+                    # The start of the results array, it is replaced by an empty array in the envelope
+                    self._envelope += buffer[self._envelope_position:index]
+                    self._envelope += b"[]"
+                    self._in_array = True
+                elif self._in_array and self._depth == 2:
+                    self._element_start = index
+                self._array_key_seen = False
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._in_array and self._depth == 1:
+                    self._in_array = False
+                    self._envelope_position = position
+                elif self._in_array and self._depth == 2 and self._element_start is not None:
+                    records.append(self.json_codec.loads(bytes(buffer[self._element_start:position])))
+                    self._element_start = None
+                self._array_key_seen = False
+
+        self._position = position
+        self._compact()
+        return records
+
+    def _compact(self):
+
+        # Drop the bytes which are no longer needed
+        # In the envelope they are copied to the envelope first, in the results array they are discarded
+        # unless they belong to the record being received
+        if self._in_array:
+            cut = self._element_start if self._element_start is not None else self._position
+        else:
+            cut = self._string_start if self._string_start is not None else self._position
+            self._envelope += self._buffer[self._envelope_position:cut]
+            self._envelope_position = cut
+
+        if cut == 0:
+            return
+        del self._buffer[:cut]
+        self._position -= cut
+        self._envelope_position = max(0, self._envelope_position - cut)
+        if self._string_start is not None:
+            self._string_start -= cut
+        if self._element_start is not None:
+            self._element_start -= cut
+
+    def close(self):
+
+        # Returns the envelope of the response (with an empty results array)
+        if self._depth != 0 or self._in_string:
+            raise Exception("The response ended before the json was complete.")
+        self._envelope += self._buffer[self._envelope_position:]
+        self._buffer = bytearray()
+        self._envelope_position = 0
+        return self.json_codec.loads(bytes(self._envelope))
@@ -0,0 +1,13 @@
+from requests.auth import HTTPBasicAuth
+
+
+class TokenAuthentication(HTTPBasicAuth):
+
+    # Authenticates with a Foreman personal access token rather than the password of the user
+    # Foreman accepts the token in place of the password in the basic authentication header
+    # The token is checked by Foreman itself, so no password hash or bind to an external auth source (eg. LDAP) is done per call
+    # A token is created in the Foreman ui under My Account > Personal Access Tokens
+
+    def __init__(self, username, token):
+        super().__init__(username, token)
+        self.token = token
@@ -40,15 +40,12 @@ def get_record_identifcation_properties(record):
     if record_type in ApiRecordIdentificationProperties.keys():
         identification_properties = ApiRecordIdentificationProperties[record_type]
 
-    # Remove the keys that are not found on the record
+    # Keep the properties found on the record, in order and without duplicates
+    # The id comes first, it is looked up directly rather than searched for
+    # The mapping is not modified as its lists are shared by every record of the type
     record_body = get_record_body_from_record(record)
-    record_properties = list(record_body.keys())
-    for identification_property in identification_properties.copy():
-        if identification_property not in record_properties:
-            identification_properties.remove(identification_property)
-
-    # Dedupe the list
-    identification_properties = list(set(identification_properties))
+    identification_properties = [x for x in dict.fromkeys(identification_properties) if x in record_body.keys()]
+    identification_properties.sort(key=lambda x: x != "id")
 
     # Raise an exception if the list is empty
     if len(identification_properties) == 0:
@@ -56,6 +53,23 @@ def get_record_identifcation_properties(record):
 
     return identification_properties
 
+def get_alternate_identification_properties(record_type):
+    # This function will return the properties other than the id which can be used to identify a record of a given type
+    # They are used to find records which have already been seen without querying the api
+
+    alternate_identification_properties = ["name"]
+    if record_type in ApiRecordIdentificationProperties.keys():
+        alternate_identification_properties += ApiRecordIdentificationProperties[record_type]
+    return [x for x in alternate_identification_properties if x != "id"]
+
+
+def normalize_identification_value(property_name, property_value):
+    # The api converts some fields to lower case (eg. the mac address) so we compare them in lower case
+    if property_name in ["mac"] and property_value is not None:
+        property_value = property_value.lower()
+    return str(property_value)
+
+
 def get_id_from_record(record):
     record_body = get_record_body_from_record(record)
     if "id" in record_body.keys():
@@ -0,0 +1,130 @@
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from ForemanApiWrapper.ApiStateEnforcer.ApiStateEnforcer import ApiStateEnforcer
+from ForemanApiWrapper.ApiStateEnforcer.RecordReference import RecordReference
+from ForemanApiWrapper.ForemanApiUtilities.ForemanApiWrapper import ForemanApiWrapper
+from ForemanApiWrapper.ForemanApiUtilities.InMemoryForemanTransport import InMemoryForemanTransport
+from ForemanApiWrapper.RecordUtilities import ForemanApiRecord
+
+
+class _Interrupted(BaseException):
+    pass
+
+
+class _InMemoryApiWrapper:
+
+    # Creates every record it is asked to read as missing and remembers the order of the writes
+
+    def __init__(self, failing_names=(), interrupted_names=()):
+        self.failing_names = failing_names
+        self.interrupted_names = interrupted_names
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.writes = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def read_record(self, minimal_record):
+        return None
+
+    def create_record(self, minimal_record):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.01)
+        record_type = ForemanApiRecord.get_record_type_from_record(minimal_record)
+        record_body = dict(minimal_record[record_type])
+        with self.lock:
+            self.in_flight -= 1
+            if record_body.get("name") in self.failing_names:
+                raise Exception("Create failed.")
+            if record_body.get("name") in self.interrupted_names:
+                raise _Interrupted()
+            record_body["id"] = next(self.ids)
+            self.writes.append(record_body["name"])
+        return {record_type: record_body}
+
+
+class Test_ApiStateEnforcer_ensure_states(TestCase):
+
+    def test_ensure_states__dependency_order(self):
+        api_wrapper = _InMemoryApiWrapper()
+        api_state_enforcer = ApiStateEnforcer(api_wrapper)
+        desired = [
+            ("present", {"subnet": {"name": "subnet", "domain_ids": [RecordReference("domain")]}}, "subnet"),
+            ("present", {"domain": {"name": "domain", "dns_id": RecordReference("proxy")}}, "domain"),
+            ("present", {"smart_proxy": {"name": "proxy"}}, "proxy"),
+            ("present", {"architecture": {"name": "x86_64"}}),
+            ("present", {"medium": {"name": "centos"}}),
+        ]
+        receipts = api_state_enforcer.ensure_states(desired, max_workers=3)
+
+        self.assertEqual(["subnet", "domain", "proxy", "x86_64", "centos"], [x.actual_record[ForemanApiRecord.get_record_type_from_record(x.actual_record)]["name"] for x in receipts])
+        self.assertLess(api_wrapper.writes.index("proxy"), api_wrapper.writes.index("domain"))
+        self.assertLess(api_wrapper.writes.index("domain"), api_wrapper.writes.index("subnet"))
+        proxy_id = receipts[2].actual_record["smart_proxy"]["id"]
+        domain_id = receipts[1].actual_record["domain"]["id"]
+        self.assertEqual(proxy_id, receipts[1].actual_record["domain"]["dns_id"])
+        self.assertEqual([domain_id], receipts[0].actual_record["subnet"]["domain_ids"])
+        self.assertGreater(api_wrapper.max_in_flight, 1)
+
+    def test_ensure_states__dependencies_key(self):
+        desired_states = [
+            ("present", {"os_default_template": {"name": "default"}, "dependencies": [{"operatingsystem": {"name": "centos"}}]}, None),
+            ("present", {"operatingsystem": {"name": "centos"}}, None),
+        ]
+        predecessors = ApiStateEnforcer._build_dependency_graph(desired_states, {})
+        self.assertEqual([{1}, set()], predecessors)
+
+        # Removal happens in the reverse order
+        desired_states = [("absent", x[1], None) for x in desired_states]
+        predecessors = ApiStateEnforcer._build_dependency_graph(desired_states, {})
+        self.assertEqual([set(), {0}], predecessors)
+
+    def test_ensure_states__cycle(self):
+        desired = [
+            ("present", {"domain": {"name": "a", "dns_id": RecordReference("b")}}, "a"),
+            ("present", {"domain": {"name": "b", "dns_id": RecordReference("a")}}, "b"),
+        ]
+        with self.assertRaises(Exception):
+            ApiStateEnforcer(_InMemoryApiWrapper()).ensure_states(desired)
+
+    def test_ensure_states__failure_skips_dependents(self):
+        api_wrapper = _InMemoryApiWrapper(failing_names=["proxy"])
+        desired = [
+            ("present", {"smart_proxy": {"name": "proxy"}}, "proxy"),
+            ("present", {"domain": {"name": "domain", "dns_id": RecordReference("proxy")}}, "domain"),
+            ("present", {"architecture": {"name": "x86_64"}}),
+        ]
+        with self.assertRaises(Exception):
+            ApiStateEnforcer(api_wrapper).ensure_states(desired)
+        self.assertEqual(["x86_64"], api_wrapper.writes)
+
+    def test_ensure_states__scheduler_error(self):
+        api_wrapper = _InMemoryApiWrapper(interrupted_names=["proxy"])
+        desired = [
+            ("present", {"smart_proxy": {"name": "proxy"}}, "proxy"),
+            ("present", {"domain": {"name": "domain", "dns_id": RecordReference("proxy")}}, "domain"),
+        ]
+
+        # The thread running the proxy never finishes it, the error is raised rather than waiting forever for the domain
+        with self.assertRaises(Exception) as context:
+            ApiStateEnforcer(api_wrapper).ensure_states(desired)
+        self.assertIsInstance(context.exception.__cause__, _Interrupted)
+        self.assertEqual([], api_wrapper.writes)
+
+    def test_ensure_state__concurrent_reads_coalesced(self):
+        transport = InMemoryForemanTransport(latency=0.2)
+        transport.add_record({"domain": {"name": "foobar.com", "fullname": "Foobar"}})
+        api_wrapper = ForemanApiWrapper("admin", "password", "https://15.4.5.1", False, transport=transport, index_records=False)
+        api_state_enforcer = ApiStateEnforcer(api_wrapper)
+
+        # Every host being reconciled reads the same domain at the same moment, the reads are made within pinned operations
+        with ThreadPoolExecutor(8) as executor:
+            receipts = list(executor.map(lambda x: api_state_enforcer.ensure_state("present", {"domain": {"name": "foobar.com", "fullname": "Foobar"}}), range(0, 8)))
+
+        self.assertEqual([False] * 8, [x.changed for x in receipts])
+        self.assertEqual([("GET", "/api/domains?search=name%3D%22foobar.com%22"), ("GET", "/api/domains/1")], transport.calls)
@@ -0,0 +1,59 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+from ForemanApiWrapper.ApiStateEnforcer.AsyncApiStateEnforcer import AsyncApiStateEnforcer
+from ForemanApiWrapper.ApiStateEnforcer.RecordReference import RecordReference
+from tests.ForemanApiWrapper.ForemanApiUtilities.test_AsyncForemanApiWrapper import _CannedAsyncForemanApiWrapper
+
+
+class Test_AsyncApiStateEnforcer(IsolatedAsyncioTestCase):
+
+    async def test_ensure_state__concurrent_creates(self):
+        responses = {}
+        for x in range(0, 20):
+            responses[("GET", "/api/domains?search=name%3D%22domain{0}.foobar.com%22".format(x))] = {"results": []}
+        api_wrapper = _CannedAsyncForemanApiWrapper(responses)
+
+        async def create_record(minimal_record):
+            return {"domain": dict(minimal_record["domain"], id=1)}
+        api_wrapper.create_record = create_record
+
+        api_state_enforcer = AsyncApiStateEnforcer(api_wrapper, max_concurrency=5)
+        receipts = await asyncio.gather(*[
+            api_state_enforcer.ensure_state("present", {"domain": {"name": "domain{0}.foobar.com".format(x)}})
+            for x in range(0, 20)])
+
+        self.assertTrue(all(receipt.changed for receipt in receipts))
+        self.assertEqual("domain7.foobar.com", receipts[7].actual_record["domain"]["name"])
+        self.assertLessEqual(api_wrapper.max_in_flight, 5)
+
+    async def test_ensure_state__exists(self):
+        api_wrapper = _CannedAsyncForemanApiWrapper({
+            ("GET", "/api/domains?search=name%3D%22test.foobar.com%22"): {"results": [{"id": 3, "name": "test.foobar.com"}]},
+            ("GET", "/api/domains/3"): {"id": 3, "name": "test.foobar.com", "dns_id": 1}
+        })
+        api_state_enforcer = AsyncApiStateEnforcer(api_wrapper)
+        receipt = await api_state_enforcer.ensure_state("present", {"domain": {"name": "test.foobar.com", "dns_id": 1}})
+        self.assertFalse(receipt.changed)
+
+    async def test_ensure_states__dependency_order(self):
+        api_wrapper = _CannedAsyncForemanApiWrapper({})
+        writes = []
+
+        async def read_record(minimal_record):
+            return None
+
+        async def create_record(minimal_record):
+            await asyncio.sleep(0)
+            record_type = list(minimal_record.keys())[0]
+            writes.append(minimal_record[record_type]["name"])
+            return {record_type: dict(minimal_record[record_type], id=len(writes))}
+        api_wrapper.read_record = read_record
+        api_wrapper.create_record = create_record
+
+        api_state_enforcer = AsyncApiStateEnforcer(api_wrapper)
+        receipts = await api_state_enforcer.ensure_states([
+            ("present", {"domain": {"name": "domain", "dns_id": RecordReference("proxy")}}),
+            ("present", {"smart_proxy": {"name": "proxy"}}, "proxy"),
+        ])
+        self.assertEqual(["proxy", "domain"], writes)
+        self.assertEqual(1, receipts[0].actual_record["domain"]["dns_id"])
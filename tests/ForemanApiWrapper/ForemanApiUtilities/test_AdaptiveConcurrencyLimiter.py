@@ -0,0 +1,129 @@
+import asyncio
+import threading
+from unittest import TestCase
+from ForemanApiWrapper.ForemanApiUtilities.AdaptiveConcurrencyLimiter import AdaptiveConcurrencyLimiter
+
+
+class Test_AdaptiveConcurrencyLimiter(TestCase):
+
+    def test_release__additive_increase(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=3)
+        for x in range(0, 3):
+            limiter.acquire()
+            limiter.release(0.01)
+        self.assertEqual(3, limiter.limit)
+
+        # The limit does not grow past the maximum
+        for x in range(0, 10):
+            limiter.acquire()
+            limiter.release(0.01)
+        self.assertEqual(3, limiter.limit)
+
+    def test_release__no_increase_when_quiet(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=8, max_limit=64)
+
+        # One call at a time never tests the limit, so it is not raised
+        for x in range(0, 50):
+            near_limit = limiter.acquire()
+            self.assertFalse(near_limit)
+            limiter.release(0.01, near_limit=near_limit)
+        self.assertEqual(8, limiter.limit)
+
+        # Calls made with half of the limit in flight raise it
+        near_limits = [limiter.acquire() for x in range(0, 4)]
+        self.assertEqual([False, False, False, True], near_limits)
+        for near_limit in near_limits:
+            limiter.release(0.01, near_limit=near_limit)
+        self.assertEqual(8, limiter.limit)
+        self.assertGreater(limiter._limit, 8)
+
+    def test_release__multiplicative_decrease(self):
+        now = [0.0]
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=16, clock=lambda: now[0])
+        limiter.acquire()
+        limiter.release(0.1)
+
+        # Several failures within one round trip only halve the limit once
+        for x in range(0, 3):
+            limiter.acquire()
+            limiter.release(0.1, overloaded=True)
+        self.assertEqual(8, limiter.limit)
+
+        # A latency far above the baseline also counts as overload
+        now[0] = 1.0
+        limiter.acquire()
+        self.assertEqual(4, limiter.release(0.5))
+
+        now[0] = 2.0
+        for x in range(0, 5):
+            limiter.acquire()
+            limiter.release(0.1, overloaded=True)
+            now[0] += 1.0
+        self.assertEqual(1, limiter.limit)
+
+    def test_acquire__blocks_at_limit(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=1)
+        limiter.acquire()
+        acquired = threading.Event()
+
+        def acquire():
+            limiter.acquire()
+            acquired.set()
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        self.assertFalse(acquired.wait(0.05))
+        limiter.release(0.01)
+        self.assertTrue(acquired.wait(1))
+        thread.join()
+        self.assertEqual(1, limiter.in_flight)
+
+    def test_acquire_async__blocks_at_limit(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=2)
+        in_flight = []
+
+        async def call():
+            await limiter.acquire_async()
+            in_flight.append(limiter.in_flight)
+            await asyncio.sleep(0.001)
+            limiter.release(0.001)
+
+        async def call_all():
+            await asyncio.gather(*[call() for x in range(0, 6)])
+        asyncio.run(call_all())
+        self.assertEqual(6, len(in_flight))
+        self.assertEqual(2, max(in_flight))
+
+    def test_acquire_async__cancelled_waiter(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=1, max_limit=1)
+
+        async def call_all():
+            await limiter.acquire_async()
+            first = asyncio.ensure_future(limiter.acquire_async())
+            second = asyncio.ensure_future(limiter.acquire_async())
+            await asyncio.sleep(0)
+
+            # The first waiter is woken by the release but cancelled before it runs, the second one gets the slot
+            limiter.release(0.001)
+            first.cancel()
+            await asyncio.wait_for(second, 1)
+            self.assertTrue(first.cancelled())
+            self.assertEqual(1, limiter.in_flight)
+            self.assertEqual(0, len(limiter._async_waiters))
+        asyncio.run(call_all())
+
+    def test_acquire__timeout(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=1, max_limit=1)
+        limiter.acquire()
+        with self.assertRaises(TimeoutError):
+            limiter.acquire(timeout=0.01)
+
+        async def acquire():
+            with self.assertRaises(TimeoutError):
+                await limiter.acquire_async(timeout=0.01)
+            self.assertEqual(0, len(limiter._async_waiters))
+        asyncio.run(acquire())
+
+        # A slot which was not used is given back without changing the limit
+        limiter.cancel()
+        self.assertEqual(0, limiter.in_flight)
+        self.assertEqual(1, limiter.limit)
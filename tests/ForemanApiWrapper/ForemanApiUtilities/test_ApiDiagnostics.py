@@ -0,0 +1,56 @@
+import logging
+from unittest import TestCase
+from ForemanApiWrapper.ForemanApiUtilities.ApiDiagnostics import ApiDiagnostics
+
+
+class _CountingHandler(logging.Handler):
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class Test_ApiDiagnostics(TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger("test_ApiDiagnostics")
+        self.logger.propagate = False
+        self.handler = _CountingHandler()
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def test_log_lines__not_rendered_when_disabled(self):
+        self.logger.setLevel(logging.INFO)
+        diagnostics = ApiDiagnostics(self.logger)
+        rendered = []
+
+        def render():
+            rendered.append(True)
+            return "line"
+
+        diagnostics.log_lines("Title:", render)
+        diagnostics.log_api_call("post", "https://foreman/api/hosts", {"host": {"name": "a"}})
+        self.assertEqual([], rendered)
+        self.assertEqual([], self.handler.messages)
+
+        self.logger.setLevel(logging.DEBUG)
+        diagnostics.log_json("Record:", {"host": {"name": "a"}})
+        self.assertEqual("Record:", self.handler.messages[0])
+        self.assertIn('        "name": "a"', self.handler.messages)
+
+    def test_sample_wire_log(self):
+        self.logger.setLevel(logging.INFO)
+        samples = iter([0.05, 0.5])
+        diagnostics = ApiDiagnostics(self.logger, wire_log_sample_rate=0.1, random_function=lambda: next(samples))
+        self.assertTrue(diagnostics.sample_wire_log())
+        self.assertFalse(diagnostics.sample_wire_log())
+
+        diagnostics.log_wire("get", "https://foreman/api/hosts", 200, 0.0125, 0, 42)
+        self.assertEqual(["[GET] https://foreman/api/hosts status=200 time=12.5ms request_bytes=0 response_bytes=42"], self.handler.messages)
+
+        self.assertFalse(ApiDiagnostics(self.logger).sample_wire_log())
@@ -0,0 +1,139 @@
+import asyncio
+import threading
+import urllib.parse
+from unittest import TestCase
+from ForemanApiWrapper.ForemanApiUtilities.ApiEndpointBalancer import ApiEndpointBalancer
+from ForemanApiWrapper.ForemanApiUtilities.Deadline import Deadline
+from ForemanApiWrapper.ForemanApiUtilities.ForemanApiWrapper import ForemanApiWrapper
+from ForemanApiWrapper.ForemanApiUtilities.InMemoryForemanTransport import InMemoryForemanTransport
+
+
+class _FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class _FrontendRecordingTransport(InMemoryForemanTransport):
+
+    # Records which frontend each api call was sent to
+    def __init__(self):
+        super().__init__()
+        self.frontends = []
+
+    def request(self, http_method, url, body=None, headers=None, timeout=None, stream=False):
+        self.frontends.append((http_method.upper(), urllib.parse.urlsplit(url).netloc))
+        return super().request(http_method, url, body, headers, timeout, stream)
+
+
+class Test_ApiEndpointBalancer(TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super(Test_ApiEndpointBalancer, self).__init__(*args, **kwargs)
+        self.urls = ["https://15.4.5.1", "https://15.4.5.2", "https://15.4.5.3"]
+
+    def test_acquire__round_robin(self):
+        balancer = ApiEndpointBalancer(self.urls)
+        urls = []
+        for x in range(0, 6):
+            url = balancer.acquire()
+            balancer.release(url, 0.01)
+            urls.append(url)
+        self.assertEqual(self.urls + self.urls, urls)
+
+    def test_acquire__least_in_flight(self):
+        balancer = ApiEndpointBalancer(self.urls, strategy="least_in_flight")
+        first = balancer.acquire()
+        second = balancer.acquire()
+        self.assertNotEqual(first, second)
+        balancer.release(first, 0.01)
+
+        # The frontend which has no call in progress is chosen over the busy one
+        third = balancer.acquire()
+        self.assertNotEqual(second, third)
+        self.assertEqual(1, len([x for x in balancer.backends if x.in_flight == 0]))
+
+    def test_acquire__latency_weighted(self):
+        balancer = ApiEndpointBalancer(self.urls, strategy="latency_weighted", latency_smoothing=1.0)
+        for url, latency in zip(self.urls, [0.5, 0.05, 0.12]):
+            balancer.backends[self.urls.index(url)].in_flight += 1
+            balancer.release(url, latency)
+        self.assertEqual([self.urls[1]] * 2, [balancer.acquire() for x in range(0, 2)])
+
+        # The fast frontend is avoided once it has enough calls in progress
+        self.assertEqual(self.urls[2], balancer.acquire())
+
+    def test_release__ejection_and_recovery(self):
+        clock = _FakeClock()
+        balancer = ApiEndpointBalancer(self.urls[0:2], failure_threshold=2, ejection_time=30, clock=clock)
+        for x in range(0, 2):
+            balancer.acquire()
+            balancer.release(self.urls[0], 0.01, failed=True)
+        self.assertEqual(1, balancer.ejections)
+        self.assertEqual([self.urls[1]] * 4, [balancer.acquire() for x in range(0, 4)])
+
+        # The frontend is used again once the ejection has expired, and a success clears its failures
+        clock.now += 31
+        self.assertIn(self.urls[0], [balancer.acquire() for x in range(0, 2)])
+        balancer.release(self.urls[0], 0.01)
+        self.assertEqual(0, balancer.backends[0].consecutive_failures)
+
+    def test_acquire__all_ejected(self):
+        clock = _FakeClock()
+        balancer = ApiEndpointBalancer(self.urls[0:2], failure_threshold=1, ejection_time=30, clock=clock)
+        balancer.release(self.urls[0], 0.01, failed=True)
+        clock.now += 1
+        balancer.release(self.urls[1], 0.01, failed=True)
+
+        # The frontend which is due back first is used rather than failing the api call
+        self.assertEqual(self.urls[0], balancer.acquire())
+
+    def test_pin(self):
+        balancer = ApiEndpointBalancer(self.urls)
+        with ApiEndpointBalancer.pin():
+            self.assertIsNone(balancer.get_pinned_url())
+            urls = [balancer.acquire() for x in range(0, 3)]
+            self.assertEqual(self.urls[0], balancer.get_pinned_url())
+            with ApiEndpointBalancer.pin():
+                urls.append(balancer.acquire())
+
+            # The pin is carried into threads started with Deadline.bind
+            thread_urls = []
+            thread = threading.Thread(target=Deadline.bind(lambda: thread_urls.append(balancer.acquire())))
+            thread.start()
+            thread.join()
+        self.assertEqual([self.urls[0]] * 4, urls)
+        self.assertEqual([self.urls[0]], thread_urls)
+        self.assertEqual(self.urls[1], balancer.acquire())
+        self.assertIsNone(balancer.get_pinned_url())
+
+    def test_pinned__coroutine(self):
+        balancer = ApiEndpointBalancer(self.urls)
+
+        @ApiEndpointBalancer.pinned
+        async def operation():
+            urls = [balancer.acquire()]
+            urls += await asyncio.gather(*[asyncio.sleep(0, balancer.acquire()) for x in range(0, 2)])
+            return urls
+
+        self.assertEqual([self.urls[0]] * 3, asyncio.run(operation()))
+        self.assertEqual([self.urls[1]] * 3, asyncio.run(operation()))
+
+    def test_api_wrapper__writes_are_pinned(self):
+        transport = _FrontendRecordingTransport()
+        api_wrapper = ForemanApiWrapper("admin", "password", self.urls, False, transport=transport, index_records=False)
+        self.assertEqual(self.urls, api_wrapper.endpoint_balancer.urls)
+
+        for x in range(0, 3):
+            api_wrapper.read_record({"domain": {"id": 1}})
+        self.assertEqual(set(urllib.parse.urlsplit(x).netloc for x in self.urls), set(x[1] for x in transport.frontends))
+
+        # The api calls made by an update (reading the record then putting it) go to one frontend
+        domain_id = api_wrapper.create_record({"domain": {"name": "foobar.com"}})["domain"]["id"]
+        transport.frontends = []
+        api_wrapper.update_record({"domain": {"id": domain_id, "name": "foobar.com", "fullname": "Foobar"}})
+        self.assertIn("PUT", [x[0] for x in transport.frontends])
+        self.assertEqual(1, len(set(x[1] for x in transport.frontends)))
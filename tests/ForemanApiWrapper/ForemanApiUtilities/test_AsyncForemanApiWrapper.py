@@ -0,0 +1,150 @@
+import asyncio
+import json
+from aiohttp import web
+from unittest import IsolatedAsyncioTestCase
+from ForemanApiWrapper.ForemanApiUtilities.AsyncForemanApiWrapper import AsyncForemanApiWrapper
+from ForemanApiWrapper.ForemanApiUtilities.ForemanApiCallException import ForemanApiCallException
+from ForemanApiWrapper.ForemanApiUtilities.SessionAuthentication import SessionAuthentication
+
+
+class _CannedAsyncForemanApiWrapper(AsyncForemanApiWrapper):
+
+    # Serves api calls from a dict of canned responses keyed by method and endpoint
+
+    def __init__(self, responses):
+        super().__init__("admin", "password", "https://15.4.5.1", False)
+        self.responses = responses
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def make_api_call(self, api_endpoint, http_method, arguments=None, headers=None):
+        self.calls.append((http_method, api_endpoint))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0)
+            key = (http_method, api_endpoint)
+            if key not in self.responses:
+                raise ForemanApiCallException("Not found", api_endpoint, http_method, None)
+            return self.responses[key]
+        finally:
+            self.in_flight -= 1
+
+
+class Test_AsyncForemanApiWrapper(IsolatedAsyncioTestCase):
+
+    async def test_read_record__by_name(self):
+        api_wrapper = _CannedAsyncForemanApiWrapper({
+            ("GET", "/api/domains?search=name%3D%22test.foobar.com%22"): {"results": [{"id": 3, "name": "test.foobar.com"}]},
+            ("GET", "/api/domains/3"): {"id": 3, "name": "test.foobar.com", "dns_id": 1}
+        })
+        record = await api_wrapper.read_record({"domain": {"name": "test.foobar.com"}})
+        self.assertEqual({"domain": {"id": 3, "name": "test.foobar.com", "dns_id": 1}}, record)
+
+    async def test_read_record__missing(self):
+        api_wrapper = _CannedAsyncForemanApiWrapper({
+            ("GET", "/api/domains?search=name%3D%22test.foobar.com%22"): {"results": []}
+        })
+        record = await api_wrapper.read_record({"domain": {"name": "test.foobar.com"}})
+        self.assertIsNone(record)
+
+    async def test_read_record__combined_search(self):
+        api_wrapper = _CannedAsyncForemanApiWrapper({
+            ("GET", "/api/domains?search=name%3D%22test.foobar.com%22%20or%20fullname%3D%22Test%22"): {"results": []}
+        })
+        record = await api_wrapper.read_record({"domain": {"name": "test.foobar.com", "fullname": "Test"}}, identification_properties=["name", "fullname"])
+        self.assertIsNone(record)
+        self.assertEqual(1, len(api_wrapper.calls))
+
+    async def test_create_record__dependencies_removed(self):
+        api_wrapper = _CannedAsyncForemanApiWrapper({
+            ("POST", "/api/operatingsystems/19/os_default_templates"): {"id": 7, "provisioning_template_id": 110}
+        })
+        minimal_record = {
+            "os_default_template": {"provisioning_template_id": 110},
+            "dependencies": [{"operatingsystem": {"id": 19}}]
+        }
+        record = await api_wrapper.create_record(minimal_record)
+        self.assertEqual({"os_default_template": {"id": 7, "provisioning_template_id": 110}}, record)
+        self.assertEqual([("POST", "/api/operatingsystems/19/os_default_templates")], api_wrapper.calls)
+
+    async def test_list_records__concurrent_pages(self):
+        responses = {}
+        for page in range(1, 11):
+            bodies = [{"id": x} for x in range((page - 1) * 10, min(page * 10, 95))]
+            responses[("GET", "/api/hosts?page={0}&per_page=10".format(page))] = {"subtotal": 95, "per_page": 10, "results": bodies}
+        api_wrapper = _CannedAsyncForemanApiWrapper(responses)
+        records = [record async for record in api_wrapper.list_records("host", per_page=10, page_concurrency=3)]
+        self.assertEqual([{"host": {"id": x}} for x in range(0, 95)], records)
+        self.assertLessEqual(api_wrapper.max_in_flight, 3)
+
+    async def test_read_records(self):
+        api_wrapper = _CannedAsyncForemanApiWrapper({
+            ("GET", "/api/domains?page=1&per_page=100&search=name%20%5E%20%28%22a.com%22%2C%22b.com%22%29"): {"subtotal": 1, "results": [{"id": 1, "name": "a.com"}]},
+            ("GET", "/api/domains/1"): {"id": 1, "name": "a.com", "dns_id": 1}
+        })
+        read_records = await api_wrapper.read_records([{"domain": {"name": "a.com"}}, {"domain": {"name": "b.com"}}])
+        self.assertEqual([{"domain": {"id": 1, "name": "a.com", "dns_id": 1}}, None], read_records)
+
+    async def test_list_records__stream(self):
+        rows = [{"id": x, "name": "web{0}.foobar.com".format(x)} for x in range(0, 250)]
+
+        async def hosts(request):
+            page = int(request.query["page"])
+            body = {"subtotal": len(rows), "page": page, "per_page": 100, "results": rows[(page - 1) * 100:page * 100]}
+            return web.Response(body=json.dumps(body).encode("utf-8"), content_type="application/json")
+
+        app = web.Application()
+        app.router.add_get("/api/hosts", hosts)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            async with AsyncForemanApiWrapper("admin", "password", "http://127.0.0.1:{0}".format(port), True) as api_wrapper:
+                records = [record async for record in api_wrapper.list_records("host", stream=True)]
+                self.assertEqual([{"host": row} for row in rows], records)
+                self.assertEqual(3, api_wrapper.metrics.get("api_calls"))
+        finally:
+            await runner.cleanup()
+
+    async def test_make_api_call__session_authentication(self):
+        sessions = set()
+        password_checks = []
+
+        async def domain(request):
+            if "Authorization" in request.headers:
+                password_checks.append(request.path)
+                session_id = str(len(password_checks))
+                sessions.add(session_id)
+                response = web.json_response({"id": 1, "name": "foobar.com"})
+                response.set_cookie("_session_id", session_id)
+                return response
+            if request.cookies.get("_session_id") not in sessions:
+                return web.Response(status=401)
+            return web.json_response({"id": 1, "name": "foobar.com"})
+
+        app = web.Application()
+        app.router.add_get("/api/domains/1", domain)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            authentication = SessionAuthentication("admin", "password")
+            async with AsyncForemanApiWrapper("admin", "password", "http://127.0.0.1:{0}".format(port), True, authentication=authentication) as api_wrapper:
+                for x in range(0, 3):
+                    self.assertEqual("foobar.com", (await api_wrapper.make_api_call("/api/domains/1", "GET"))["name"])
+                self.assertEqual(1, len(password_checks))
+
+                # An expired session is started again with the username and password
+                sessions.clear()
+                self.assertEqual("foobar.com", (await api_wrapper.make_api_call("/api/domains/1", "GET"))["name"])
+                self.assertEqual("foobar.com", (await api_wrapper.make_api_call("/api/domains/1", "GET"))["name"])
+                self.assertEqual(2, len(password_checks))
+                self.assertEqual(1, authentication.reauthentications)
+        finally:
+            await runner.cleanup()
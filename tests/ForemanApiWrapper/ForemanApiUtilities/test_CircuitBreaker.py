@@ -0,0 +1,56 @@
+from unittest import TestCase
+from ForemanApiWrapper.ForemanApiUtilities.CircuitBreaker import CircuitBreaker
+
+
+class _FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Test_CircuitBreaker(TestCase):
+
+    def test_get_endpoint_template(self):
+        self.assertEqual("/api/hosts", CircuitBreaker.get_endpoint_template("/api/hosts?search=name%3Dfoobar"))
+        self.assertEqual("/api/hosts/:id", CircuitBreaker.get_endpoint_template("/api/hosts/foobar.com"))
+        self.assertEqual("/api/operatingsystems/:id/os_default_templates/:id", CircuitBreaker.get_endpoint_template("/api/operatingsystems/19/os_default_templates/3"))
+
+    def test_acquire__opens_after_consecutive_failures(self):
+        circuit_breaker = CircuitBreaker(failure_threshold=3, clock=_FakeClock())
+        outcomes = [True, False, True, True, True]
+        transitions = []
+        for failed in outcomes:
+            self.assertEqual((True, None), circuit_breaker.acquire("/api/hosts/1", "GET"))
+            transitions.append(circuit_breaker.release("/api/hosts/1", "GET", failed))
+
+        # A success resets the count of consecutive failures
+        self.assertEqual([None, None, None, None, "open"], transitions)
+        self.assertEqual((False, None), circuit_breaker.acquire("/api/hosts/2", "GET"))
+
+        # The circuits are kept per method
+        self.assertEqual((True, None), circuit_breaker.acquire("/api/hosts/2", "PUT"))
+        self.assertEqual([("GET", "/api/hosts/:id")], circuit_breaker.get_open_circuits())
+
+    def test_acquire__half_open(self):
+        clock = _FakeClock()
+        circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, half_open_calls=1, clock=clock)
+        circuit_breaker.acquire("/api/hosts", "GET")
+        self.assertEqual("open", circuit_breaker.release("/api/hosts", "GET", True))
+
+        # Only one probe is sent at a time, a failed probe opens the circuit again
+        clock.now += 30
+        self.assertEqual((True, "half_open"), circuit_breaker.acquire("/api/hosts", "GET"))
+        self.assertEqual((False, None), circuit_breaker.acquire("/api/hosts", "GET"))
+        self.assertEqual("open", circuit_breaker.release("/api/hosts", "GET", True))
+        self.assertEqual((False, None), circuit_breaker.acquire("/api/hosts", "GET"))
+
+        # A probe without an outcome frees its slot, a successful probe closes the circuit
+        clock.now += 30
+        self.assertEqual((True, "half_open"), circuit_breaker.acquire("/api/hosts", "GET"))
+        self.assertIsNone(circuit_breaker.release("/api/hosts", "GET", None))
+        self.assertEqual((True, None), circuit_breaker.acquire("/api/hosts", "GET"))
+        self.assertEqual("closed", circuit_breaker.release("/api/hosts", "GET", False))
+        self.assertEqual("closed", circuit_breaker.get_state("/api/hosts", "GET"))
@@ -0,0 +1,55 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from ForemanApiWrapper.ForemanApiUtilities.Deadline import Deadline
+
+
+class _Operation:
+
+    def __init__(self, operation_timeout):
+        self.operation_timeout = operation_timeout
+
+    @Deadline.operation
+    def run(self):
+        return Deadline.current()
+
+    @Deadline.operation
+    async def run_async(self):
+        return Deadline.current()
+
+
+class Test_Deadline(TestCase):
+
+    def test_remaining__and_expired(self):
+        now = [100.0]
+        deadline = Deadline(5, clock=lambda: now[0])
+        self.assertEqual(5.0, deadline.remaining())
+        self.assertFalse(deadline.expired())
+        now[0] = 106.0
+        self.assertEqual(0.0, deadline.remaining())
+        self.assertTrue(deadline.expired())
+
+    def test_start__nested_keeps_earliest(self):
+        self.assertIsNone(Deadline.current())
+        with Deadline.start(5) as outer:
+            with Deadline.start(60) as inner:
+                self.assertIs(outer, inner)
+            with Deadline.start(1) as inner:
+                self.assertIsNot(outer, inner)
+                self.assertIs(inner, Deadline.current())
+            with Deadline.start(None) as inner:
+                self.assertIs(outer, inner)
+            self.assertIs(outer, Deadline.current())
+        self.assertIsNone(Deadline.current())
+
+    def test_bind__carries_deadline_into_threads(self):
+        with Deadline.start(5) as deadline:
+            with ThreadPoolExecutor(1) as executor:
+                self.assertIsNone(executor.submit(Deadline.current).result())
+                self.assertIs(deadline, executor.submit(Deadline.bind(Deadline.current)).result())
+
+    def test_operation(self):
+        self.assertIsNone(_Operation(None).run())
+        self.assertIsNotNone(_Operation(5).run())
+        self.assertIsNotNone(asyncio.run(_Operation(5).run_async()))
+        self.assertIsNone(Deadline.current())
@@ -1,6 +1,26 @@
+import gzip
+import io
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
 import logging
+import requests
 from unittest import TestCase
 from ForemanApiWrapper.ForemanApiUtilities.ForemanApiWrapper import ForemanApiWrapper
+from ForemanApiWrapper.ForemanApiUtilities.ForemanApiCallException import ForemanApiCallException
+from ForemanApiWrapper.ForemanApiUtilities.RecordCache import RecordCache
+from ForemanApiWrapper.ForemanApiUtilities.RetryPolicy import RetryPolicy
+from ForemanApiWrapper.ForemanApiUtilities.RateLimiter import RateLimiter
+from ForemanApiWrapper.ForemanApiUtilities.AdaptiveConcurrencyLimiter import AdaptiveConcurrencyLimiter
+from ForemanApiWrapper.ForemanApiUtilities.ApiCompression import ApiCompression
+from ForemanApiWrapper.ForemanApiUtilities.SessionAuthentication import SessionAuthentication
+from ForemanApiWrapper.ForemanApiUtilities.Deadline import Deadline
+from ForemanApiWrapper.ForemanApiUtilities.DeadlineExceededException import DeadlineExceededException
+from ForemanApiWrapper.ForemanApiUtilities.CircuitBreaker import CircuitBreaker
+from ForemanApiWrapper.ForemanApiUtilities.CircuitOpenException import CircuitOpenException
+from ForemanApiWrapper.ForemanApiUtilities.ApiEndpointBalancer import ApiEndpointBalancer
+from ForemanApiWrapper.ForemanApiUtilities.InMemoryForemanTransport import InMemoryForemanTransport
 from ForemanApiWrapper.RecordUtilities import RecordComparison
 
 # Configure logging format and level
@@ -13,6 +33,136 @@ logging.basicConfig(format=logFormat,
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
 
+class _CannedForemanApiWrapper(ForemanApiWrapper):
+
+    # Serves api calls from a dict of canned responses keyed by method and endpoint
+
+    def __init__(self, responses, **kwargs):
+        super(_CannedForemanApiWrapper, self).__init__("admin", "password", "https://15.4.5.1", False, **kwargs)
+        self.responses = responses
+        self.calls = []
+
+    def make_api_call(self, api_endpoint, http_method, arguments=None, headers=None):
+        self.calls.append((http_method, api_endpoint))
+        key = (http_method, api_endpoint)
+        if key not in self.responses:
+            raise ForemanApiCallException("Not found", api_endpoint, http_method, None)
+        return self.responses[key]
+
+
+class _ScriptedSession:
+
+    # Stands in for a requests session, answering each api call with the next scripted response
+    # A response is either an exception to raise or a tuple of status code and body
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.calls = []
+
+    def get(self, url, **kwargs):
+        return self._respond(url, kwargs)
+
+    def post(self, url, **kwargs):
+        return self._respond(url, kwargs)
+
+    def _respond(self, url, kwargs):
+        self.calls.append((url, kwargs))
+        step = self.script.pop(0)
+        if isinstance(step, Exception):
+            raise step
+        status_code, body, headers = step
+        response = requests.Response()
+        response.status_code = status_code
+        response.url = url
+        response.headers.update(headers)
+        if kwargs.get("stream"):
+            response.raw = io.BytesIO(json.dumps(body).encode("utf-8"))
+        else:
+            response._content = json.dumps(body).encode("utf-8")
+        return response
+
+
+class _BlockingTransport(InMemoryForemanTransport):
+
+    # Holds the next GET until it is released, so that other api calls can be made while it is in progress
+
+    def __init__(self):
+        super(_BlockingTransport, self).__init__()
+        self.blocking = False
+        self.started = threading.Event()
+        self.released = threading.Event()
+
+    def request(self, http_method, url, body=None, headers=None, timeout=None, stream=False):
+        if http_method.upper() == "GET" and self.blocking:
+            self.blocking = False
+            response = super(_BlockingTransport, self).request(http_method, url, body, headers, timeout, stream)
+            self.started.set()
+            self.released.wait()
+            return response
+        return super(_BlockingTransport, self).request(http_method, url, body, headers, timeout, stream)
+
+
+class _GzipRequestHandler(BaseHTTPRequestHandler):
+
+    # Answers with a gzip compressed template if the client accepts gzip and records the request bodies
+
+    template = {"id": 161, "name": "Kickstart default", "template": "\n".join(["<%# line {0} -%>".format(x) for x in range(0, 1000)])}
+    requests = []
+
+    def do_GET(self):
+        body = json.dumps(self.template).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        _GzipRequestHandler.requests.append((self.headers.get("Content-Encoding"), body))
+        self.do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _SessionRequestHandler(BaseHTTPRequestHandler):
+
+    # Authenticates with basic authentication or a session cookie, as Foreman does, and counts the password checks
+    # Clearing the sessions expires the cookies which have been handed out
+
+    sessions = set()
+    password_checks = []
+
+    def do_GET(self):
+        cookie = self.headers.get("Cookie", "")
+        session_id = cookie.split("_session_id=")[1].split(";")[0] if "_session_id=" in cookie else None
+        new_session_id = None
+        if "Authorization" in self.headers:
+            _SessionRequestHandler.password_checks.append(self.path)
+            new_session_id = str(len(_SessionRequestHandler.password_checks))
+            _SessionRequestHandler.sessions.add(new_session_id)
+        elif session_id not in _SessionRequestHandler.sessions:
+            self.send_response(401)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.dumps({"id": 1, "name": "foobar.com"}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        if new_session_id is not None:
+            self.send_header("Set-Cookie", "_session_id={0}; path=/; HttpOnly".format(new_session_id))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
 class Test_ForemanApiWrapper(TestCase):
 
     def __init__(self, *args, **kwargs):
@@ -36,3 +186,506 @@ class Test_ForemanApiWrapper(TestCase):
         except Exception as e:
             pass
 
+    def test__create_session__pool_configuration(self):
+        api_wrapper = ForemanApiWrapper(self.username, self.password, self.url, self.verifySsl, pool_connections=2, pool_maxsize=5, pool_block=True)
+        poolmanager = api_wrapper.session.get_adapter(self.url).poolmanager
+        self.assertEqual({"maxsize": 5, "block": True}, poolmanager.connection_pool_kw)
+        connection_pool = poolmanager.connection_from_url(self.url)
+        self.assertEqual(5, connection_pool.pool.maxsize)
+        self.assertTrue(connection_pool.block)
+
+        # Only the pools of the two most recently used hosts are kept
+        for url in ["https://15.4.5.2", "https://15.4.5.3"]:
+            poolmanager.connection_from_url(url)
+        self.assertEqual(2, len(poolmanager.pools))
+        self.assertEqual("keep-alive", api_wrapper.session.headers["Connection"])
+
+    def test__create_session__keep_alive_disabled(self):
+        api_wrapper = ForemanApiWrapper(self.username, self.password, self.url, self.verifySsl, keep_alive=False)
+        self.assertEqual("close", api_wrapper.session.headers["Connection"])
+
+    def test__close__session_released(self):
+        with ForemanApiWrapper(self.username, self.password, self.url, self.verifySsl) as api_wrapper:
+            self.assertIsNotNone(api_wrapper.session)
+        self.assertIsNone(api_wrapper.session)
+
+    def test__match_record_in_results__index_fields_used(self):
+        search_results = {"results": [{"id": x, "name": "host{0}.foobar.com".format(x)} for x in range(0, 50)]}
+        responses = {
+            ("GET", "/api/domains?search=name%3D%22host7.foobar.com%22"): search_results,
+            ("GET", "/api/domains/7"): {"id": 7, "name": "host7.foobar.com", "dns_id": 1}
+        }
+        api_wrapper = _CannedForemanApiWrapper(responses)
+        record = api_wrapper.read_record({"domain": {"name": "host7.foobar.com"}})
+        self.assertEqual({"domain": {"id": 7, "name": "host7.foobar.com", "dns_id": 1}}, record)
+        self.assertEqual(2, len(api_wrapper.calls))
+        self.assertEqual(1, api_wrapper.metrics.get("complete_record_lookups"))
+
+    def test__match_record_in_results__complete_record_reused(self):
+        # The index rows do not contain the queried field so each row needs a complete lookup
+        # The matching complete record is returned without another lookup
+        search_results = {"results": [{"id": x} for x in range(0, 5)]}
+        responses = {("GET", "/api/operatingsystems/19/os_default_templates?search=provisioning_template_id%3D%22110%22"): search_results}
+        for x in range(0, 5):
+            responses[("GET", "/api/operatingsystems/19/os_default_templates/{0}".format(x))] = {"id": x, "provisioning_template_id": 108 + x}
+        api_wrapper = _CannedForemanApiWrapper(responses, lookup_concurrency=3)
+        minimal_record = {
+            "os_default_template": {"provisioning_template_id": 110},
+            "dependencies": [{"operatingsystem": {"id": 19}}]
+        }
+        record = api_wrapper.read_record(minimal_record)
+        self.assertEqual({"os_default_template": {"id": 2, "provisioning_template_id": 110}}, record)
+        self.assertEqual(6, len(api_wrapper.calls))
+        self.assertEqual(5, api_wrapper.metrics.get("complete_record_lookups"))
+
+    def test__read_record__by_id(self):
+        responses = {
+            ("GET", "/api/operatingsystems/19/os_default_templates/3"): {"id": 3, "provisioning_template_id": 110},
+            ("GET", "/api/domains?search=name%3D%22foobar.com%22"): {"results": [{"id": 5, "name": "foobar.com"}]},
+            ("GET", "/api/domains/5"): {"id": 5, "name": "foobar.com", "dns_id": 1}
+        }
+        api_wrapper = _CannedForemanApiWrapper(responses, index_records=False)
+
+        # A nested record which carries its id is read with one GET and no search
+        minimal_record = {
+            "os_default_template": {"id": 3, "provisioning_template_id": 110},
+            "dependencies": [{"operatingsystem": {"id": 19}}]
+        }
+        record = api_wrapper.read_record(minimal_record)
+        self.assertEqual({"os_default_template": {"id": 3, "provisioning_template_id": 110}}, record)
+        self.assertEqual([("GET", "/api/operatingsystems/19/os_default_templates/3")], api_wrapper.calls)
+
+        # If there is no record with the id the other identification properties are tried
+        api_wrapper.calls = []
+        record = api_wrapper.read_record({"domain": {"id": 4, "name": "foobar.com"}})
+        self.assertEqual(5, record["domain"]["id"])
+        self.assertEqual([
+            ("GET", "/api/domains/4"),
+            ("GET", "/api/domains?search=name%3D%22foobar.com%22"),
+            ("GET", "/api/domains/5")], api_wrapper.calls)
+
+    def test__read_record__combined_search(self):
+        combined_search = "/api/operatingsystems?search=description%3D%22CentOS%207%22%20or%20title%3D%22CentOS%207.9%22"
+        responses = {
+            ("GET", combined_search): {"results": [
+                {"id": 3, "description": "CentOS 6", "title": "CentOS 7.9"},
+                {"id": 4, "description": "CentOS 7", "title": "CentOS 7.8"}]},
+            ("GET", "/api/operatingsystems/4"): {"id": 4, "description": "CentOS 7", "title": "CentOS 7.8", "major": "7"}
+        }
+        api_wrapper = _CannedForemanApiWrapper(responses, index_records=False)
+        minimal_record = {"operatingsystem": {"description": "CentOS 7", "title": "CentOS 7.9"}}
+
+        # The properties are searched together and the results are matched in the order of the properties
+        record = api_wrapper.read_record(minimal_record, identification_properties=["description", "title"])
+        self.assertEqual(4, record["operatingsystem"]["id"])
+        self.assertEqual([("GET", combined_search), ("GET", "/api/operatingsystems/4")], api_wrapper.calls)
+
+        # A missing record costs a single search
+        api_wrapper.calls = []
+        responses[("GET", combined_search)] = {"results": []}
+        self.assertIsNone(api_wrapper.read_record(minimal_record, identification_properties=["description", "title"]))
+        self.assertEqual([("GET", combined_search)], api_wrapper.calls)
+
+        # If the combined search is rejected the properties are searched one at a time
+        api_wrapper.calls = []
+        del responses[("GET", combined_search)]
+        self.assertIsNone(api_wrapper.read_record(minimal_record, identification_properties=["description", "title"]))
+        self.assertEqual([
+            ("GET", combined_search),
+            ("GET", "/api/operatingsystems?search=description%3D%22CentOS%207%22"),
+            ("GET", "/api/operatingsystems?search=title%3D%22CentOS%207.9%22")], api_wrapper.calls)
+
+    def test__list_records__all_pages(self):
+        responses = {}
+        for page in range(1, 4):
+            bodies = [{"id": x} for x in range((page - 1) * 2, min(page * 2, 5))]
+            endpoint = "/api/operatingsystems/19/os_default_templates?page={0}&per_page=2&search=provisioning_template_id%20%3E%201".format(page)
+            responses[("GET", endpoint)] = {"total": 9, "subtotal": 5, "page": page, "per_page": 2, "results": bodies}
+        api_wrapper = _CannedForemanApiWrapper(responses)
+        records = api_wrapper.list_records(
+            "os_default_template",
+            search="provisioning_template_id > 1",
+            per_page=2,
+            dependencies=[{"operatingsystem": {"id": 19}}])
+        self.assertEqual([{"os_default_template": {"id": x}} for x in range(0, 5)], list(records))
+        self.assertEqual(3, len(api_wrapper.calls))
+
+    def test__list_records__server_caps_page_size(self):
+        responses = {
+            ("GET", "/api/domains?page=1&per_page=1000"): {"subtotal": 3, "per_page": 2, "results": [{"id": 1}, {"id": 2}]},
+            ("GET", "/api/domains?page=2&per_page=1000"): {"subtotal": 3, "per_page": 2, "results": [{"id": 3}]}
+        }
+        api_wrapper = _CannedForemanApiWrapper(responses)
+        records = list(api_wrapper.list_records("domain", per_page=1000))
+        self.assertEqual(3, len(records))
+
+    def test__list_records__concurrent_pages(self):
+        responses = {}
+        for page in range(1, 11):
+            bodies = [{"id": x} for x in range((page - 1) * 10, min(page * 10, 95))]
+            responses[("GET", "/api/hosts?page={0}&per_page=10".format(page))] = {"subtotal": 95, "per_page": 10, "results": bodies}
+        api_wrapper = _CannedForemanApiWrapper(responses)
+
+        records = list(api_wrapper.list_records("host", per_page=10, page_concurrency=4))
+        self.assertEqual([{"host": {"id": x}} for x in range(0, 95)], records)
+
+        records = list(api_wrapper.list_records("host", per_page=10, page_concurrency=4, ordered=False))
+        self.assertEqual(list(range(0, 95)), sorted(record["host"]["id"] for record in records))
+        self.assertEqual(20, len(api_wrapper.calls))
+
+    def test__read_record__record_cache(self):
+        responses = {
+            ("GET", "/api/domains?search=name%3D%22test.foobar.com%22"): {"results": [{"id": 3, "name": "test.foobar.com"}]},
+            ("GET", "/api/domains/3"): {"id": 3, "name": "test.foobar.com", "dns_id": 1},
+            ("PUT", "/api/domains/3"): {"id": 3, "name": "test.foobar.com", "dns_id": 2},
+            ("DELETE", "/api/domains/3"): {"id": 3, "name": "test.foobar.com", "dns_id": 2}
+        }
+        api_wrapper = _CannedForemanApiWrapper(responses, record_cache=RecordCache())
+        minimal_record = {"domain": {"name": "test.foobar.com"}}
+
+        api_wrapper.read_record(minimal_record)
+        api_wrapper.read_record(minimal_record)
+        api_wrapper.read_record({"domain": {"id": 3}})
+        self.assertEqual(2, len(api_wrapper.calls))
+
+        # An update refreshes the cached record
+        api_wrapper.update_record({"domain": {"id": 3, "dns_id": 2}})
+        self.assertEqual(2, api_wrapper.read_record(minimal_record)["domain"]["dns_id"])
+        self.assertEqual(3, len(api_wrapper.calls))
+
+        # A delete invalidates the cached record
+        api_wrapper.delete_record({"domain": {"id": 3}})
+        api_wrapper.read_record(minimal_record)
+        self.assertEqual(6, len(api_wrapper.calls))
+
+    def test__read_record__record_index(self):
+        responses = {
+            ("GET", "/api/hosts?search=mac%3D%22AA%3ABB%3ACC%3ADD%3AEE%3AFF%22"): {"results": [{"id": 12, "mac": "aa:bb:cc:dd:ee:ff"}]},
+            ("GET", "/api/hosts/12"): {"id": 12, "name": "web1.foobar.com", "mac": "aa:bb:cc:dd:ee:ff"}
+        }
+        api_wrapper = _CannedForemanApiWrapper(responses)
+        minimal_record = {"host": {"mac": "AA:BB:CC:DD:EE:FF"}}
+        api_wrapper.read_record(minimal_record)
+        api_wrapper.calls = []
+
+        # A repeat lookup goes straight to the record by id
+        record = api_wrapper.read_record(minimal_record)
+        self.assertEqual(12, record["host"]["id"])
+        self.assertEqual([("GET", "/api/hosts/12")], api_wrapper.calls)
+
+    def test__read_record__record_index_stale(self):
+        responses = {
+            ("GET", "/api/domains?search=name%3D%22test.foobar.com%22"): {"results": [{"id": 4, "name": "test.foobar.com"}]},
+            ("GET", "/api/domains/3"): {"id": 3, "name": "renamed.foobar.com"},
+            ("GET", "/api/domains/4"): {"id": 4, "name": "test.foobar.com"}
+        }
+        api_wrapper = _CannedForemanApiWrapper(responses)
+        api_wrapper.record_index.add({"domain": {"id": 3, "name": "test.foobar.com"}})
+        record = api_wrapper.read_record({"domain": {"name": "test.foobar.com"}})
+        self.assertEqual(4, record["domain"]["id"])
+        self.assertEqual(4, api_wrapper.record_index.get_id("domain", "name", "test.foobar.com"))
+
+    def test__read_record__record_index_scoped_by_dependencies(self):
+        api_wrapper = _CannedForemanApiWrapper({})
+        responses = {}
+        for os_id, template_id in [(19, 5), (20, 6)]:
+            endpoint = "/api/operatingsystems/{0}/os_default_templates?page=1&per_page=100".format(os_id)
+            responses[("GET", endpoint)] = {"subtotal": 1, "results": [{"id": template_id, "provisioning_template_id": 110}]}
+            responses[("GET", "/api/operatingsystems/{0}/os_default_templates/{1}".format(os_id, template_id))] = {"id": template_id, "provisioning_template_id": 110}
+        api_wrapper.responses = responses
+        for os_id in [19, 20]:
+            list(api_wrapper.list_records("os_default_template", dependencies=[{"operatingsystem": {"id": os_id}}]))
+        api_wrapper.calls = []
+
+        record = api_wrapper.read_record({
+            "os_default_template": {"provisioning_template_id": 110},
+            "dependencies": [{"operatingsystem": {"id": 20}}]
+        })
+        self.assertEqual(6, record["os_default_template"]["id"])
+        self.assertEqual([("GET", "/api/operatingsystems/20/os_default_templates/6")], api_wrapper.calls)
+
+    def test__read_records__in_list_searches(self):
+        names = ["web{0}.foobar.com".format(x) for x in range(0, 6)]
+        rows = [{"id": x, "name": names[x]} for x in range(0, 5)]
+        responses = {
+            ("GET", "/api/domains?page=1&per_page=100&search=name%20%5E%20%28%22web0.foobar.com%22%2C%22web1.foobar.com%22%2C%22web2.foobar.com%22%29"): {"subtotal": 3, "results": rows[0:3]},
+            ("GET", "/api/domains?page=1&per_page=100&search=name%20%5E%20%28%22web3.foobar.com%22%2C%22web4.foobar.com%22%2C%22web5.foobar.com%22%29"): {"subtotal": 2, "results": rows[3:5]},
+            ("GET", "/api/domains/9"): {"id": 9, "name": "nine.foobar.com"}
+        }
+        api_wrapper = _CannedForemanApiWrapper(responses)
+        records = [{"domain": {"name": name}} for name in names] + [{"domain": {"id": 9}}]
+        read_records = api_wrapper.read_records(records, complete_records=False, max_search_length=100)
+        self.assertEqual([{"domain": row} for row in rows] + [None, {"domain": {"id": 9, "name": "nine.foobar.com"}}], read_records)
+        self.assertEqual(3, len(api_wrapper.calls))
+
+    def test__read_records__host_mac_and_name_normalisation(self):
+        responses = {
+            ("GET", "/api/hosts?page=1&per_page=100&search=mac%20%5E%20%28%22aa%3Abb%3Acc%3Add%3Aee%3Aff%22%29"): {"subtotal": 1, "results": [{"id": 1, "mac": "aa:bb:cc:dd:ee:ff"}]},
+            ("GET", "/api/hosts/1"): {"id": 1, "name": "web1.foobar.com", "mac": "aa:bb:cc:dd:ee:ff"}
+        }
+        api_wrapper = _CannedForemanApiWrapper(responses)
+        read_records = api_wrapper.read_records([{"host": {"mac": "AA:BB:CC:DD:EE:FF"}}])
+        self.assertEqual("web1.foobar.com", read_records[0]["host"]["name"])
+
+        bodies = [{"id": 1, "name": "web1.foobar.com"}, {"id": 2, "name": "web2.foobar.com"}]
+        matched = ForemanApiWrapper._match_batch_results("host", "name", [(0, {"host": {"name": "web2"}})], bodies)
+        self.assertEqual(2, matched[0]["id"])
+
+    def test__make_api_call__retries_transient_failures(self):
+        sleeps = []
+        api_wrapper = ForemanApiWrapper(self.username, self.password, self.url, self.verifySsl,
+                                        retry_policy=RetryPolicy(jitter=False, sleep=sleeps.append))
+        api_wrapper.session = _ScriptedSession([
+            requests.exceptions.ConnectionError("Connection reset by peer"),
+            (503, {}, {"Retry-After": "2"}),
+            (200, {"id": 1, "name": "foobar.com"}, {})])
+        results = api_wrapper.make_api_call("/api/domains/1", "GET")
+        self.assertEqual("foobar.com", results["name"])
+        self.assertEqual([0.5, 2.0], sleeps)
+        self.assertEqual(2, api_wrapper.metrics.get("retries"))
+        self.assertEqual(3, api_wrapper.metrics.get("api_calls"))
+
+        # The two retries were spent from the budget and the successful api call earned part of one back
+        self.assertAlmostEqual(98.1, api_wrapper.retry_policy.remaining_budget)
+
+    def test__read_record__transient_failure_is_not_a_missing_record(self):
+        api_wrapper = ForemanApiWrapper(self.username, self.password, self.url, self.verifySsl,
+                                        retry_policy=RetryPolicy(max_attempts=2, jitter=False, sleep=lambda x: None))
+        api_wrapper.session = _ScriptedSession([(503, {}, {}), (502, {}, {})])
+        with self.assertRaises(Exception) as context:
+            api_wrapper.read_record({"domain": {"name": "foobar.com", "fullname": "foobar"}})
+        self.assertTrue(context.exception.__cause__.transient)
+        self.assertEqual(2, len(api_wrapper.session.calls))
+
+        # A client error is not transient and is not retried
+        api_wrapper.session = _ScriptedSession([(404, {}, {})])
+        with self.assertRaises(ForemanApiCallException) as context:
+            api_wrapper.make_api_call("/api/domains/1", "GET")
+        self.assertFalse(context.exception.transient)
+
+    def test__make_api_call__rate_limiter(self):
+        sleeps = []
+        rate_limiter = RateLimiter(rate=5, burst=1, clock=lambda: 0.0, sleep=sleeps.append)
+        api_wrapper = ForemanApiWrapper(self.username, self.password, self.url, self.verifySsl, rate_limiter=rate_limiter)
+        api_wrapper.session = _ScriptedSession([(200, {"id": 1}, {}), (200, {"id": 1}, {})])
+        api_wrapper.make_api_call("/api/domains/1", "GET")
+        api_wrapper.make_api_call("/api/domains/1", "GET")
+        self.assertEqual([0.2], sleeps)
+        self.assertEqual(1, api_wrapper.metrics.get("rate_limited_calls"))
+
+    def test__make_api_call__concurrency_limiter(self):
+        concurrency_limiter = AdaptiveConcurrencyLimiter(initial_limit=8)
+        api_wrapper = ForemanApiWrapper(self.username, self.password, self.url, self.verifySsl,
+                                        retry_policy=RetryPolicy(max_attempts=1), concurrency_limiter=concurrency_limiter)
+        api_wrapper.session = _ScriptedSession([(503, {}, {})])
+        with self.assertRaises(ForemanApiCallException):
+            api_wrapper.make_api_call("/api/domains/1", "GET")
+        self.assertEqual(4, api_wrapper.metrics.get("concurrency_limit"))
+        self.assertEqual(0, concurrency_limiter.in_flight)
+
+    def test__make_api_call__body_encoded_by_codec(self):
+        api_wrapper = ForemanApiWrapper(self.username, self.password, self.url, self.verifySsl)
+        api_wrapper.session = _ScriptedSession([(200, {"id": 1, "name": "foobar.com"}, {})])
+        results = api_wrapper.make_api_call("/api/domains", "POST", {"domain": {"name": "foobar.com"}}, {"Content-type": "application/json"})
+        self.assertEqual({"id": 1, "name": "foobar.com"}, results)
+        url, kwargs = api_wrapper.session.calls[0]
+        self.assertEqual({"domain": {"name": "foobar.com"}}, json.loads(kwargs["data"]))
+        self.assertNotIn("json", kwargs)
+
+    def test__make_api_call__timeouts(self):
+        api_wrapper = ForemanApiWrapper(self.username, self.password, self.url, self.verifySsl, connect_timeout=5, read_timeout=60)
+        api_wrapper.session = _ScriptedSession([(200, {"id": 1}, {}), (200, {"id": 1}, {})])
+        api_wrapper.make_api_call("/api/domains/1", "GET")
+        self.assertEqual((5, 60), api_wrapper.session.calls[0][1]["timeout"])
+
+        # The timeouts are shortened to the time remaining before the deadline
+        with Deadline.start(2):
+            api_wrapper.make_api_call("/api/domains/1", "GET")
+        connect_timeout, read_timeout = api_wrapper.session.calls[1][1]["timeout"]
+        self.assertLessEqual(connect_timeout, 2)
+        self.assertLessEqual(read_timeout, 2)
+
+    def test__make_api_call__deadline_exceeded(self):
+        api_wrapper = ForemanApiWrapper(self.username, self.password, self.url, self.verifySsl,
+                                        retry_policy=RetryPolicy(jitter=False, sleep=lambda x: None))
+
+        # No api call is made once the deadline has passed
+        api_wrapper.session = _ScriptedSession([])
+        with Deadline.start(0):
+            with self.assertRaises(DeadlineExceededException) as context:
+                api_wrapper.make_api_call("/api/domains/1", "GET")
+        self.assertTrue(context.exception.transient)
+        self.assertEqual([], api_wrapper.session.calls)
+
+        # A retry which would wait past the deadline is not made
+        api_wrapper.session = _ScriptedSession([(503, {}, {"Retry-After": "30"})])
+        with Deadline.start(5):
+            with self.assertRaises(DeadlineExceededException) as context:
+                api_wrapper.make_api_call("/api/domains/1", "GET")
+        self.assertEqual(503, context.exception.__cause__.results.status_code)
+        self.assertEqual(1, len(api_wrapper.session.calls))
+
+    def test__make_api_call__circuit_breaker(self):
+        clock = [0.0]
+        circuit_breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=lambda: clock[0])
+        api_wrapper = ForemanApiWrapper(self.username, self.password, self.url, self.verifySsl, circuit_breaker=circuit_breaker,
+                                        retry_policy=RetryPolicy(max_attempts=4, jitter=False, sleep=lambda x: None))
+
+        # The circuit opens after two timeouts and the remaining attempts fail without an api call being made
+        api_wrapper.session = _ScriptedSession([requests.exceptions.ReadTimeout("Read timed out"), requests.exceptions.ReadTimeout("Read timed out")])
+        with self.assertRaises(CircuitOpenException) as context:
+            api_wrapper.make_api_call("/api/operatingsystems/19/os_default_templates", "GET")
+        self.assertTrue(context.exception.transient)
+        self.assertEqual(2, len(api_wrapper.session.calls))
+        self.assertEqual("open", circuit_breaker.get_state("/api/operatingsystems/7/os_default_templates", "GET"))
+        self.assertEqual(1, api_wrapper.metrics.get("open_circuits"))
+
+        # Other endpoints are not affected, and a 404 shows the endpoint is working
+        api_wrapper.session = _ScriptedSession([(404, {}, {})])
+        with self.assertRaises(ForemanApiCallException):
+            api_wrapper.make_api_call("/api/domains/1", "GET")
+        self.assertEqual("closed", circuit_breaker.get_state("/api/domains/2", "GET"))
+
+        # Once the reset timeout has passed a probe is sent, and closes the circuit when it succeeds
+        clock[0] += 31
+        api_wrapper.session = _ScriptedSession([(200, {"results": []}, {})])
+        api_wrapper.make_api_call("/api/operatingsystems/19/os_default_templates", "GET")
+        self.assertEqual("closed", circuit_breaker.get_state("/api/operatingsystems/19/os_default_templates", "GET"))
+        self.assertEqual(
+            {"circuits_opened": 1, "circuits_half_opened": 1, "circuits_closed": 1, "circuit_rejected_calls": 1, "open_circuits": 0},
+            {x: api_wrapper.metrics.get(x) for x in ["circuits_opened", "circuits_half_opened", "circuits_closed", "circuit_rejected_calls", "open_circuits"]})
+
+    def test__make_api_call__timeout_shortened_by_deadline(self):
+        circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        api_wrapper = ForemanApiWrapper(self.username, self.password, self.url, self.verifySsl, circuit_breaker=circuit_breaker, read_timeout=60,
+                                        retry_policy=RetryPolicy(max_attempts=1, jitter=False, sleep=lambda x: None))
+
+        # A timeout shortened to fit the deadline is a missed deadline, not a failure of the endpoint
+        api_wrapper.session = _ScriptedSession([requests.exceptions.ReadTimeout("Read timed out")])
+        with Deadline.start(5):
+            with self.assertRaises(DeadlineExceededException):
+                api_wrapper.make_api_call("/api/domains/1", "GET")
+        self.assertEqual("closed", circuit_breaker.get_state("/api/domains/1", "GET"))
+
+        # The configured read timeout still counts towards opening the circuit
+        api_wrapper.session = _ScriptedSession([requests.exceptions.ReadTimeout("Read timed out")])
+        with Deadline.start(120):
+            with self.assertRaises(ForemanApiCallException) as context:
+                api_wrapper.make_api_call("/api/domains/1", "GET")
+        self.assertNotIsInstance(context.exception, DeadlineExceededException)
+        self.assertEqual("open", circuit_breaker.get_state("/api/domains/1", "GET"))
+
+    def test__make_api_call__deadline_exceeded_while_waiting(self):
+        sleeps = []
+        rate_limiter = RateLimiter(rate=0.1, burst=1, clock=lambda: 0.0, sleep=sleeps.append)
+        concurrency_limiter = AdaptiveConcurrencyLimiter(initial_limit=1, max_limit=1)
+        api_wrapper = ForemanApiWrapper(self.username, self.password, self.url, self.verifySsl, rate_limiter=rate_limiter, concurrency_limiter=concurrency_limiter)
+        api_wrapper.session = _ScriptedSession([(200, {"id": 1}, {})])
+        api_wrapper.make_api_call("/api/domains/1", "GET")
+
+        # The next token is 10 seconds away, the call fails straight away rather than waiting past the deadline
+        with Deadline.start(5):
+            with self.assertRaises(DeadlineExceededException):
+                api_wrapper.make_api_call("/api/domains/1", "GET")
+        self.assertEqual([], sleeps)
+        self.assertEqual(1, len(api_wrapper.session.calls))
+
+        # A wait for a slot from the concurrency limiter ends at the deadline
+        api_wrapper.rate_limiter = None
+        concurrency_limiter.acquire()
+        with Deadline.start(0.05):
+            with self.assertRaises(DeadlineExceededException):
+                api_wrapper.make_api_call("/api/domains/1", "GET")
+        self.assertEqual(1, concurrency_limiter.in_flight)
+        self.assertEqual(1, len(api_wrapper.session.calls))
+
+    def test__make_api_call__reads_not_coalesced_across_writes(self):
+        transport = _BlockingTransport()
+        api_wrapper = ForemanApiWrapper(self.username, self.password, self.url, self.verifySsl, transport=transport)
+        domain_id = api_wrapper.make_api_call("/api/domains", "POST", {"domain": {"name": "foobar.com", "fullname": "Foobar"}})["id"]
+        endpoint = "/api/domains/{0}".format(domain_id)
+
+        # A GET which read the domain before it was updated is still in progress
+        transport.blocking = True
+        executor = ThreadPoolExecutor(max_workers=1)
+        stale_read = executor.submit(api_wrapper.make_api_call, endpoint, "GET")
+        transport.started.wait()
+        try:
+            api_wrapper.make_api_call(endpoint, "PUT", {"domain": {"fullname": "Foobar updated"}})
+
+            # The reads made after the write do not join it, whether they are made within a pinned operation or not
+            # (a read which joined it would wait until the deadline)
+            with Deadline.start(5):
+                self.assertEqual("Foobar updated", api_wrapper.make_api_call(endpoint, "GET")["fullname"])
+                with ApiEndpointBalancer.pin():
+                    self.assertEqual("Foobar updated", api_wrapper.make_api_call(endpoint, "GET")["fullname"])
+        finally:
+            transport.released.set()
+            executor.shutdown()
+        self.assertEqual("Foobar", stale_read.result()["fullname"])
+        self.assertEqual(0, api_wrapper.metrics.get("coalesced_calls"))
+
+    def test__make_api_call__session_authentication(self):
+        server = HTTPServer(("127.0.0.1", 0), _SessionRequestHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            url = "http://127.0.0.1:{0}".format(server.server_port)
+            authentication = SessionAuthentication(self.username, self.password)
+            with ForemanApiWrapper(self.username, self.password, url, self.verifySsl, authentication=authentication) as api_wrapper:
+                for x in range(0, 3):
+                    self.assertEqual("foobar.com", api_wrapper.make_api_call("/api/domains/1", "GET")["name"])
+                self.assertEqual(1, len(_SessionRequestHandler.password_checks))
+
+                # An expired session is started again with the username and password
+                _SessionRequestHandler.sessions.clear()
+                self.assertEqual("foobar.com", api_wrapper.make_api_call("/api/domains/1", "GET")["name"])
+                self.assertEqual("foobar.com", api_wrapper.make_api_call("/api/domains/1", "GET")["name"])
+                self.assertEqual(2, len(_SessionRequestHandler.password_checks))
+                self.assertEqual(1, authentication.reauthentications)
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    def test__list_records__stream(self):
+        rows = [{"id": x, "name": "web{0}.foobar.com".format(x)} for x in range(0, 5)]
+        api_wrapper = ForemanApiWrapper(self.username, self.password, self.url, self.verifySsl)
+        api_wrapper.session = _ScriptedSession([
+            (200, {"total": 5, "subtotal": 5, "page": 1, "per_page": 3, "results": rows[0:3]}, {}),
+            (200, {"total": 5, "subtotal": 5, "page": 2, "per_page": 3, "results": rows[3:5]}, {})])
+        records = list(api_wrapper.list_records("host", per_page=3, stream=True))
+        self.assertEqual([{"host": row} for row in rows], records)
+        self.assertEqual(2, len(api_wrapper.session.calls))
+        self.assertTrue(all(kwargs["stream"] for url, kwargs in api_wrapper.session.calls))
+        self.assertEqual(4, api_wrapper.record_index.get_id("host", "name", "web4.foobar.com", None))
+
+    def test__make_api_call__compression(self):
+        server = HTTPServer(("127.0.0.1", 0), _GzipRequestHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            url = "http://127.0.0.1:{0}".format(server.server_port)
+            compression = ApiCompression(accept_encoding=["gzip"], compress_requests=True, min_request_size=100)
+            with ForemanApiWrapper(self.username, self.password, url, self.verifySsl, compression=compression) as api_wrapper:
+                results = api_wrapper.make_api_call("/api/provisioning_templates/161", "GET")
+                self.assertEqual(_GzipRequestHandler.template, results)
+                metrics = api_wrapper.metrics.snapshot()
+                self.assertGreater(metrics["response_decoded_bytes"], 5 * metrics["response_wire_bytes"])
+
+                api_wrapper.make_api_call("/api/provisioning_templates/161", "PUT", {"provisioning_template": _GzipRequestHandler.template})
+                content_encoding, body = _GzipRequestHandler.requests[-1]
+                self.assertEqual("gzip", content_encoding)
+                self.assertEqual({"provisioning_template": _GzipRequestHandler.template}, json.loads(gzip.decompress(body)))
+                metrics = api_wrapper.metrics.snapshot()
+                self.assertEqual(len(body), metrics["request_wire_bytes"])
+                self.assertGreater(metrics["request_decoded_bytes"], 5 * metrics["request_wire_bytes"])
+
+            with ForemanApiWrapper(self.username, self.password, url, self.verifySsl, compression=ApiCompression(accept_encoding=[])) as api_wrapper:
+                api_wrapper.make_api_call("/api/provisioning_templates/161", "GET")
+                metrics = api_wrapper.metrics.snapshot()
+                self.assertEqual(metrics["response_decoded_bytes"], metrics["response_wire_bytes"])
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
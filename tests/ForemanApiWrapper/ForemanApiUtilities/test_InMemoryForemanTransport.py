@@ -0,0 +1,86 @@
+import json
+import urllib.parse
+from unittest import TestCase
+from ForemanApiWrapper.ForemanApiUtilities.ForemanApiWrapper import ForemanApiWrapper
+from ForemanApiWrapper.ForemanApiUtilities.InMemoryForemanTransport import InMemoryForemanTransport
+from ForemanApiWrapper.ApiStateEnforcer.ApiStateEnforcer import ApiStateEnforcer
+
+
+class Test_InMemoryForemanTransport(TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super(Test_InMemoryForemanTransport, self).__init__(*args, **kwargs)
+        self.url = "https://15.4.5.1"
+
+    def _create_api_wrapper(self, transport, **kwargs):
+        return ForemanApiWrapper("admin", "password", self.url, False, transport=transport, **kwargs)
+
+    def _search(self, transport, search):
+        response = transport.request("GET", self.url + "/api/hosts?search=" + urllib.parse.quote(search))
+        return [x["name"] for x in json.loads(response.content)["results"]]
+
+    def test_request__crud(self):
+        transport = InMemoryForemanTransport()
+        api_wrapper = self._create_api_wrapper(transport, index_records=False)
+
+        created_record = api_wrapper.create_record({"domain": {"name": "foobar.com"}})
+        domain_id = created_record["domain"]["id"]
+        self.assertEqual("foobar.com", api_wrapper.read_record({"domain": {"name": "foobar.com"}})["domain"]["name"])
+        api_wrapper.update_record({"domain": {"id": domain_id, "name": "foobar.com", "fullname": "Foobar"}})
+        self.assertEqual("Foobar", api_wrapper.read_record({"domain": {"id": domain_id}})["domain"]["fullname"])
+        api_wrapper.delete_record({"domain": {"id": domain_id, "name": "foobar.com"}})
+        self.assertIsNone(api_wrapper.read_record({"domain": {"name": "foobar.com"}}))
+        self.assertEqual([], transport.get_records("/api/domains"))
+        self.assertEqual(transport.get_call_count(), api_wrapper.metrics.get("api_calls"))
+        self.assertEqual(1, transport.get_call_count("POST"))
+
+        # Names are unique, as they are in Foreman
+        api_wrapper.create_record({"domain": {"name": "foobar.com"}})
+        with self.assertRaises(Exception):
+            api_wrapper.create_record({"domain": {"name": "foobar.com"}})
+
+    def test_request__nested_records(self):
+        transport = InMemoryForemanTransport()
+        api_wrapper = self._create_api_wrapper(transport, index_records=False)
+        operatingsystem = transport.add_record({"operatingsystem": {"name": "CentOS", "major": "7", "description": "CentOS 7"}})
+        dependencies = [{"operatingsystem": {"id": operatingsystem["id"]}}]
+        transport.add_record({"os_default_template": {"provisioning_template_id": 110, "template_kind_id": 1}, "dependencies": dependencies})
+        transport.add_record({"os_default_template": {"provisioning_template_id": 161, "template_kind_id": 2}, "dependencies": dependencies})
+
+        record = api_wrapper.read_record({"os_default_template": {"provisioning_template_id": 161}, "dependencies": dependencies})
+        self.assertEqual(operatingsystem["id"], record["os_default_template"]["operatingsystem_id"])
+        self.assertEqual(2, record["os_default_template"]["template_kind_id"])
+        self.assertEqual(
+            ("GET", "/api/operatingsystems/{0}/os_default_templates?search=provisioning_template_id%3D%22161%22".format(operatingsystem["id"])),
+            transport.calls[0])
+
+    def test_request__scoped_search(self):
+        transport = InMemoryForemanTransport()
+        for x in range(0, 5):
+            transport.add_record({"host": {"name": "web{0}.foobar.com".format(x), "build": x % 2 == 0}})
+        self.assertEqual(["web1.foobar.com"], self._search(transport, 'name = "web1.foobar.com"'))
+        self.assertEqual(["web1.foobar.com", "web3.foobar.com"], self._search(transport, 'name ^ ("web1.foobar.com","web3.foobar.com")'))
+        self.assertEqual(["web0.foobar.com", "web4.foobar.com"], self._search(transport, 'build = true and not name = web2.foobar.com'))
+        self.assertEqual(["web0.foobar.com", "web3.foobar.com"], self._search(transport, 'name ~ web3 or (name ~ web0)'))
+        self.assertEqual(5, len(self._search(transport, "")))
+        response = transport.request("GET", self.url + "/api/hosts?search=" + urllib.parse.quote('name = ('))
+        self.assertEqual(422, response.status_code)
+
+    def test_list_records__pages(self):
+        transport = InMemoryForemanTransport()
+        api_wrapper = self._create_api_wrapper(transport)
+        for x in range(0, 25):
+            transport.add_record({"host": {"name": "web{0}.foobar.com".format(x)}})
+        self.assertEqual(25, len(list(api_wrapper.list_records("host", per_page=10))))
+        self.assertEqual(3, transport.get_call_count())
+        self.assertEqual(11, len(list(api_wrapper.list_records("host", search="name ~ web1", per_page=5, stream=True))))
+
+    def test_ensure_state__call_counts(self):
+        transport = InMemoryForemanTransport()
+        api_state_enforcer = ApiStateEnforcer(self._create_api_wrapper(transport))
+        receipt = api_state_enforcer.ensure_state("present", {"domain": {"name": "foobar.com"}})
+        self.assertTrue(receipt.changed)
+        transport.reset_calls()
+        receipt = api_state_enforcer.ensure_state("present", {"domain": {"name": "foobar.com"}})
+        self.assertFalse(receipt.changed)
+        self.assertEqual([("GET", "/api/domains/1")], transport.calls)
@@ -0,0 +1,22 @@
+from unittest import TestCase
+from ForemanApiWrapper.ForemanApiUtilities import JsonCodec as JsonCodecModule
+from ForemanApiWrapper.ForemanApiUtilities.JsonCodec import JsonCodec
+
+
+class Test_JsonCodec(TestCase):
+
+    def test_loads_dumps__backends(self):
+        backends = ["json"]
+        if JsonCodecModule.orjson is not None:
+            backends.append("orjson")
+        record = {"host": {"name": "web1.foobar.com", "comment": "café", "build": False, "id": 1}}
+        for backend in backends:
+            codec = JsonCodec(backend)
+            content = codec.dumps(record)
+            self.assertIsInstance(content, bytes)
+            self.assertEqual(record, codec.loads(content))
+            self.assertEqual(record, codec.loads(bytearray(content)))
+
+    def test_init__unsupported_backend(self):
+        with self.assertRaises(Exception):
+            JsonCodec("simplejson")
@@ -0,0 +1,67 @@
+import asyncio
+from unittest import TestCase
+from ForemanApiWrapper.ForemanApiUtilities.RateLimiter import RateLimiter
+
+
+class _FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class Test_RateLimiter(TestCase):
+
+    def test_acquire__burst_then_rate(self):
+        clock = _FakeClock()
+        rate_limiter = RateLimiter(rate=10, burst=2, clock=clock, sleep=clock.sleep)
+        delays = [rate_limiter.acquire("GET") for x in range(0, 4)]
+        self.assertEqual([0, 0], delays[0:2])
+        self.assertAlmostEqual(0.1, delays[2])
+        self.assertAlmostEqual(0.1, delays[3])
+        self.assertAlmostEqual(0.2, clock.now)
+
+        # An idle period refills the bucket up to the burst size
+        clock.now += 10
+        self.assertEqual([0, 0], [rate_limiter.acquire("GET") for x in range(0, 2)])
+
+    def test_acquire__waiting_callers_queue(self):
+        clock = _FakeClock()
+        rate_limiter = RateLimiter(rate=10, burst=1, clock=clock)
+        self.assertEqual(0, rate_limiter._reserve("GET"))
+        self.assertAlmostEqual(0.1, rate_limiter._reserve("GET"))
+        self.assertAlmostEqual(0.2, rate_limiter._reserve("GET"))
+
+    def test_acquire__method_rates(self):
+        clock = _FakeClock()
+        rate_limiter = RateLimiter(method_rates={"post": (1, 1), "PUT": 1}, clock=clock)
+        self.assertEqual(0, rate_limiter._reserve("GET"))
+        self.assertEqual(0, rate_limiter._reserve("GET"))
+        self.assertEqual(0, rate_limiter._reserve("POST"))
+        self.assertAlmostEqual(1.0, rate_limiter._reserve("POST"))
+        self.assertEqual(0, rate_limiter._reserve("put"))
+
+    def test_acquire_async(self):
+        rate_limiter = RateLimiter(rate=1000, burst=1)
+
+        async def acquire_all():
+            return await asyncio.gather(*[rate_limiter.acquire_async("GET") for x in range(0, 3)])
+        delays = asyncio.run(acquire_all())
+        self.assertEqual(0, delays[0])
+        self.assertGreater(delays[2], delays[1])
+
+    def test_acquire__timeout(self):
+        clock = _FakeClock()
+        rate_limiter = RateLimiter(rate=1, burst=1, clock=clock, sleep=clock.sleep)
+        rate_limiter.acquire("GET")
+
+        # A wait longer than the timeout is not made and the token is not taken
+        with self.assertRaises(TimeoutError):
+            rate_limiter.acquire("GET", timeout=0.5)
+        self.assertEqual(0.0, clock.now)
+        self.assertAlmostEqual(1.0, rate_limiter.acquire("GET", timeout=1.0))
@@ -0,0 +1,75 @@
+from unittest import TestCase
+from ForemanApiWrapper.ForemanApiUtilities.RecordCache import RecordCache
+
+
+class _Clock:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class Test_RecordCache(TestCase):
+
+    def test_get__by_id_and_property(self):
+        record_cache = RecordCache()
+        record_cache.put({"host": {"id": 4, "name": "web1.foobar.com", "mac": "AA:BB:CC:DD:EE:FF"}})
+        self.assertEqual(4, record_cache.get("host", "4")["host"]["id"])
+        self.assertEqual(4, record_cache.get_by_property("host", "name", "web1.foobar.com")["host"]["id"])
+        self.assertEqual(4, record_cache.get_by_property("host", "mac", "aa:bb:cc:dd:ee:ff")["host"]["id"])
+        self.assertIsNone(record_cache.get_by_property("host", "name", "web2.foobar.com"))
+        self.assertEqual(3, record_cache.metrics.get("hits"))
+        self.assertEqual(1, record_cache.metrics.get("misses"))
+
+    def test_get__returns_copy(self):
+        record_cache = RecordCache()
+        record_cache.put({"domain": {"id": 1, "name": "foobar.com"}})
+        record = record_cache.get("domain", 1)
+        record["domain"]["name"] = "modified.com"
+        self.assertEqual("foobar.com", record_cache.get("domain", 1)["domain"]["name"])
+
+    def test_get__expired(self):
+        clock = _Clock()
+        record_cache = RecordCache(ttl=10, clock=clock)
+        record_cache.put({"domain": {"id": 1, "name": "foobar.com"}})
+        clock.now = 9
+        self.assertIsNotNone(record_cache.get("domain", 1))
+        clock.now = 10
+        self.assertIsNone(record_cache.get_by_property("domain", "name", "foobar.com"))
+        self.assertEqual(1, record_cache.metrics.get("expirations"))
+        self.assertEqual(0, len(record_cache))
+
+    def test_put__least_recently_used_evicted(self):
+        record_cache = RecordCache(max_size=2)
+        record_cache.put({"domain": {"id": 1, "name": "one.com"}})
+        record_cache.put({"domain": {"id": 2, "name": "two.com"}})
+        record_cache.get("domain", 1)
+        record_cache.put({"domain": {"id": 3, "name": "three.com"}})
+        self.assertIsNone(record_cache.get("domain", 2))
+        self.assertIsNone(record_cache.get_by_property("domain", "name", "two.com"))
+        self.assertIsNotNone(record_cache.get("domain", 1))
+        self.assertEqual(1, record_cache.metrics.get("evictions"))
+
+    def test_put__renamed_record_alias_replaced(self):
+        record_cache = RecordCache()
+        record_cache.put({"domain": {"id": 1, "name": "old.com"}})
+        record_cache.put({"domain": {"id": 1, "name": "new.com"}})
+        self.assertIsNone(record_cache.get_by_property("domain", "name", "old.com"))
+        self.assertEqual(1, record_cache.get_by_property("domain", "name", "new.com")["domain"]["id"])
+
+    def test_invalidate(self):
+        record_cache = RecordCache()
+        record_cache.put({"domain": {"id": 1, "name": "foobar.com"}})
+        record_cache.invalidate("domain", 1)
+        self.assertIsNone(record_cache.get_by_property("domain", "name", "foobar.com"))
+        self.assertEqual(1, record_cache.metrics.get("invalidations"))
+
+    def test_get_by_property__scoped(self):
+        record_cache = RecordCache()
+        record_cache.put({"os_default_template": {"id": 5, "provisioning_template_id": 110}}, "/operatingsystems/19/os_default_templates")
+        record_cache.put({"os_default_template": {"id": 6, "provisioning_template_id": 110}}, "/operatingsystems/20/os_default_templates")
+        record = record_cache.get_by_property("os_default_template", "provisioning_template_id", 110, "/operatingsystems/20/os_default_templates")
+        self.assertEqual(6, record["os_default_template"]["id"])
+        self.assertIsNone(record_cache.get_by_property("os_default_template", "provisioning_template_id", 110))
@@ -0,0 +1,39 @@
+from unittest import TestCase
+from ForemanApiWrapper.ForemanApiUtilities.RecordIdentityIndex import RecordIdentityIndex
+
+
+class Test_RecordIdentityIndex(TestCase):
+
+    def test_remove_id(self):
+        record_index = RecordIdentityIndex()
+        record_index.add({"host": {"id": 12, "name": "web01.foobar.com", "mac": "AA:BB:CC:DD:EE:FF"}})
+        record_index.add({"host": {"id": 13, "name": "web02.foobar.com"}})
+        record_index.add({"domain": {"id": 12, "name": "foobar.com"}})
+
+        # Only the keys of the host with that id are removed
+        record_index.remove_id("host", "12")
+        self.assertIsNone(record_index.get_id("host", "name", "web01.foobar.com"))
+        self.assertIsNone(record_index.get_id("host", "mac", "aa:bb:cc:dd:ee:ff"))
+        self.assertEqual(13, record_index.get_id("host", "name", "web02.foobar.com"))
+        self.assertEqual(12, record_index.get_id("domain", "name", "foobar.com"))
+        self.assertEqual(2, record_index.metrics.get("removals"))
+        self.assertEqual([("domain", "12"), ("host", "13")], sorted(record_index._keys.keys()))
+
+    def test_add__reverse_keys_follow_the_index(self):
+        record_index = RecordIdentityIndex(max_size=2)
+
+        # A name which moves to another record no longer belongs to the old one
+        record_index.add({"domain": {"id": 1, "name": "foobar.com"}})
+        record_index.add({"domain": {"id": 2, "name": "foobar.com"}})
+        record_index.remove_id("domain", 1)
+        self.assertEqual(2, record_index.get_id("domain", "name", "foobar.com"))
+
+        # Keys dropped from the index (least recently used first) are dropped from the reverse keys as well
+        record_index.add({"domain": {"id": 3, "name": "example.com"}})
+        record_index.add({"domain": {"id": 4, "name": "example.org"}})
+        self.assertEqual(2, len(record_index))
+        self.assertEqual([("domain", "3"), ("domain", "4")], sorted(record_index._keys.keys()))
+
+        record_index.remove("domain", "name", "example.com")
+        record_index.clear()
+        self.assertEqual({}, record_index._keys)
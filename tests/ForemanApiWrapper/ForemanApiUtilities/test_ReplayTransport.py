@@ -0,0 +1,73 @@
+import os
+import tempfile
+from unittest import TestCase
+from ForemanApiWrapper.ForemanApiUtilities.ForemanApiWrapper import ForemanApiWrapper
+from ForemanApiWrapper.ForemanApiUtilities.ApiCassette import ApiCassette
+from ForemanApiWrapper.ForemanApiUtilities.ApiCompression import ApiCompression
+from ForemanApiWrapper.ForemanApiUtilities.InMemoryForemanTransport import InMemoryForemanTransport
+from ForemanApiWrapper.ForemanApiUtilities.ReplayTransport import ReplayTransport
+
+
+class Test_ReplayTransport(TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super(Test_ReplayTransport, self).__init__(*args, **kwargs)
+        self.url = "https://15.4.5.1"
+
+    def _create_api_wrapper(self, transport, **kwargs):
+        return ForemanApiWrapper("admin", "password", self.url, False, transport=transport, index_records=False, **kwargs)
+
+    def _workload(self, api_wrapper):
+        api_wrapper.create_record({"domain": {"name": "foobar.com"}})
+        api_wrapper.update_record({"domain": {"id": 1, "name": "foobar.com", "fullname": "Foobar"}})
+        return [
+            api_wrapper.read_record({"domain": {"name": "foobar.com"}}),
+            api_wrapper.read_record({"domain": {"name": "missing.com"}}),
+            len(list(api_wrapper.list_records("domain", stream=True)))]
+
+    def _record(self):
+        api_wrapper = self._create_api_wrapper(InMemoryForemanTransport())
+        cassette = api_wrapper.start_recording()
+        results = self._workload(api_wrapper)
+        self.assertIs(cassette, api_wrapper.stop_recording())
+        self.assertIsInstance(api_wrapper.transport, InMemoryForemanTransport)
+        return cassette, results
+
+    def test_request__replays_recording(self):
+        cassette, results = self._record()
+        self.assertEqual(["POST", "PUT", "GET", "GET", "GET", "GET"], [x["method"] for x in cassette.interactions])
+        self.assertEqual({"domain": {"name": "foobar.com"}}, cassette.interactions[0]["request"])
+
+        # The cassette survives being saved and loaded
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cassette.jsonl.gz")
+            cassette.save(path)
+            cassette = ApiCassette.load(path)
+
+        transport = ReplayTransport(cassette)
+        api_wrapper = self._create_api_wrapper(transport, compression=ApiCompression(compress_requests=True, min_request_size=1))
+        self.assertEqual(results, self._workload(api_wrapper))
+        self.assertEqual(len(cassette.interactions), transport.get_call_count())
+        self.assertEqual([], transport.unmatched)
+
+    def test_request__latency_and_unmatched_calls(self):
+        cassette = ApiCassette()
+        cassette.add("GET", self.url + "/api/domains/1", None, 503, {"Retry-After": "1"}, b"{}", 0.25)
+        cassette.add("GET", self.url + "/api/domains/1", None, 200, {}, b'{"id": 1, "name": "foobar.com"}', 0.5)
+        sleeps = []
+        transport = ReplayTransport(cassette, emulate_latency=True, latency_scale=2, sleep=sleeps.append)
+
+        response = transport.request("GET", self.url + "/api/domains/1")
+        self.assertEqual(503, response.status_code)
+        self.assertEqual("1", response.headers["Retry-After"])
+
+        # The responses are matched on the endpoint whatever the url of the server, the last one is repeated
+        self.assertEqual(200, transport.request("GET", "https://15.4.5.2/api/domains/1").status_code)
+        self.assertEqual(200, transport.request("GET", self.url + "/api/domains/1").status_code)
+        self.assertEqual([0.5, 1.0, 1.0], sleeps)
+        self.assertEqual(404, transport.request("GET", self.url + "/api/domains/2").status_code)
+        self.assertEqual([("GET", "/api/domains/2", None)], transport.unmatched)
+
+        transport = ReplayTransport(cassette, strict=True)
+        with self.assertRaises(Exception):
+            transport.request("GET", self.url + "/api/domains/2")
@@ -0,0 +1,55 @@
+from unittest import TestCase
+from ForemanApiWrapper.ForemanApiUtilities.RetryPolicy import RetryPolicy
+
+
+class Test_RetryPolicy(TestCase):
+
+    def test_get_retry_delay__backoff(self):
+        retry_policy = RetryPolicy(max_attempts=4, backoff_factor=0.5, max_backoff=1.5, jitter=False)
+        self.assertEqual([0.5, 1.0, 1.5, None], [retry_policy.get_retry_delay("GET", x, 503) for x in range(0, 4)])
+
+        retry_policy = RetryPolicy(backoff_factor=1, random_function=lambda: 0.25)
+        self.assertEqual(0.5, retry_policy.get_retry_delay("GET", 1, None))
+
+    def test_get_retry_delay__methods_and_status_codes(self):
+        retry_policy = RetryPolicy(jitter=False)
+        self.assertIsNone(retry_policy.get_retry_delay("POST", 0, 503))
+        self.assertIsNone(retry_policy.get_retry_delay("GET", 0, 404))
+        self.assertIsNotNone(retry_policy.get_retry_delay("PUT", 0, 429))
+
+        # A retried delete which was applied would get a 404, so deletes are only retried when asked for
+        self.assertIsNone(retry_policy.get_retry_delay("DELETE", 0, 503))
+        retry_policy = RetryPolicy(jitter=False, retry_methods=RetryPolicy.default_retry_methods + ("delete",))
+        self.assertIsNotNone(retry_policy.get_retry_delay("DELETE", 0, 503))
+
+    def test_get_retry_delay__retry_after(self):
+        retry_policy = RetryPolicy(jitter=False, max_backoff=10)
+        self.assertEqual(7.0, retry_policy.get_retry_delay("GET", 0, 503, "7"))
+        self.assertEqual(10, retry_policy.get_retry_delay("GET", 0, 503, "120"))
+        self.assertEqual(30.0, RetryPolicy.parse_retry_after("Wed, 21 Oct 2015 07:28:30 GMT", now=1445412480))
+        self.assertIsNone(RetryPolicy.parse_retry_after("soon"))
+
+    def test_get_retry_delay__budget(self):
+        retry_policy = RetryPolicy(retry_budget=2)
+        self.assertIsNotNone(retry_policy.get_retry_delay("GET", 0, 503))
+        self.assertIsNotNone(retry_policy.get_retry_delay("GET", 0, 503))
+        self.assertIsNone(retry_policy.get_retry_delay("GET", 0, 503))
+        self.assertEqual(2, retry_policy.retries)
+        retry_policy.reset_budget()
+        self.assertIsNotNone(retry_policy.get_retry_delay("GET", 0, 503))
+
+    def test_get_retry_delay__budget_earned_by_successes(self):
+        retry_policy = RetryPolicy(retry_budget=1, retry_budget_ratio=0.25)
+        self.assertIsNotNone(retry_policy.get_retry_delay("GET", 0, 503))
+        self.assertIsNone(retry_policy.get_retry_delay("GET", 0, 503))
+
+        # Four successful api calls earn back a retry, and the budget never grows beyond retry_budget
+        for x in range(0, 3):
+            retry_policy.record_success()
+        self.assertIsNone(retry_policy.get_retry_delay("GET", 0, 503))
+        for x in range(0, 10):
+            retry_policy.record_success()
+        self.assertEqual(1, retry_policy.remaining_budget)
+        self.assertIsNotNone(retry_policy.get_retry_delay("GET", 0, 503))
+        self.assertIsNone(retry_policy.get_retry_delay("GET", 0, 503))
+        self.assertEqual(2, retry_policy.retries)
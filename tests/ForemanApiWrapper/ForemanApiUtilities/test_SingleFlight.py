@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from ForemanApiWrapper.ForemanApiUtilities.SingleFlight import SingleFlight
+
+
+class Test_SingleFlight(TestCase):
+
+    def test_do__coalesces_concurrent_calls(self):
+        single_flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def function():
+            calls.append(True)
+            release.wait(1)
+            return {"id": 19}
+
+        with ThreadPoolExecutor(4) as executor:
+            futures = [executor.submit(single_flight.do, "/api/operatingsystems/19", function) for x in range(0, 4)]
+            while "/api/operatingsystems/19" not in single_flight._calls or single_flight._calls["/api/operatingsystems/19"].followers < 3:
+                time.sleep(0.001)
+            release.set()
+            results = [x.result() for x in futures]
+
+        self.assertEqual(1, len(calls))
+        self.assertEqual([({"id": 19}, True)] * 4, results)
+
+        # Every caller gets its own copy of a shared result
+        self.assertEqual(4, len(set(id(x[0]) for x in results)))
+
+        # Calls made one after the other are not coalesced
+        self.assertEqual(({"id": 19}, False), single_flight.do("/api/operatingsystems/19", lambda: {"id": 19}))
+
+    def test_do__shares_exceptions(self):
+        single_flight = SingleFlight()
+        release = threading.Event()
+
+        def function():
+            release.wait(1)
+            raise Exception("Service Unavailable")
+
+        with ThreadPoolExecutor(2) as executor:
+            futures = [executor.submit(single_flight.do, "/api/domains/1", function) for x in range(0, 2)]
+            while "/api/domains/1" not in single_flight._calls or single_flight._calls["/api/domains/1"].followers < 1:
+                time.sleep(0.001)
+            release.set()
+            for future in futures:
+                with self.assertRaises(Exception):
+                    future.result()
+        self.assertEqual({}, single_flight._calls)
+
+    def test_do_async__coalesces_concurrent_calls(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        async def function():
+            calls.append(True)
+            await asyncio.sleep(0.01)
+            return {"id": 19}
+
+        async def call_all():
+            return await asyncio.gather(*[single_flight.do_async("/api/operatingsystems/19", function) for x in range(0, 3)])
+        results = asyncio.run(call_all())
+        self.assertEqual(1, len(calls))
+        self.assertEqual([({"id": 19}, True)] * 3, results)
+
+    def test_do_async__leader_cancelled(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        async def function():
+            calls.append(True)
+            await asyncio.sleep(0.05)
+            return {"id": 19}
+
+        async def call_all():
+            leader = asyncio.ensure_future(single_flight.do_async("/api/operatingsystems/19", function))
+            await asyncio.sleep(0)
+            followers = [asyncio.ensure_future(single_flight.do_async("/api/operatingsystems/19", function)) for x in range(0, 2)]
+            await asyncio.sleep(0.01)
+            leader.cancel()
+
+            # The followers were not cancelled, one of them makes the call again and the other shares its result
+            results = await asyncio.gather(*followers)
+            return leader.cancelled(), results
+        cancelled, results = asyncio.run(call_all())
+        self.assertTrue(cancelled)
+        self.assertEqual([({"id": 19}, True)] * 2, results)
+        self.assertEqual(2, len(calls))
+
+    def test_do__follower_timeout(self):
+        single_flight = SingleFlight()
+        release = threading.Event()
+
+        def function():
+            release.wait(1)
+            return {"id": 19}
+
+        with ThreadPoolExecutor(1) as executor:
+            leader = executor.submit(single_flight.do, "/api/operatingsystems/19", function)
+            while "/api/operatingsystems/19" not in single_flight._calls:
+                time.sleep(0.001)
+
+            # The follower gives up at its timeout, the leader carries on
+            with self.assertRaises(TimeoutError):
+                single_flight.do("/api/operatingsystems/19", function, timeout=0.01)
+            release.set()
+            self.assertEqual(({"id": 19}, True), leader.result())
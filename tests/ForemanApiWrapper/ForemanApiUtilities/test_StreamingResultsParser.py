@@ -0,0 +1,37 @@
+import json
+from unittest import TestCase
+from ForemanApiWrapper.ForemanApiUtilities.JsonCodec import JsonCodec
+from ForemanApiWrapper.ForemanApiUtilities.StreamingResultsParser import StreamingResultsParser
+
+
+class Test_StreamingResultsParser(TestCase):
+
+    def _parse(self, content, chunk_size):
+        parser = StreamingResultsParser(JsonCodec("json"))
+        records = []
+        for x in range(0, len(content), chunk_size):
+            records += parser.feed(content[x:x + chunk_size])
+        return records, parser.close()
+
+    def test_feed__any_chunk_size(self):
+        rows = [{"id": x, "name": "web{0}.foobar.com".format(x), "comment": 'a "quoted" ]} value \\', "interfaces": [{"id": x, "tags": ["[", "{"]}]} for x in range(0, 10)]
+        response = {"total": 20, "subtotal": 10, "page": 1, "per_page": 10, "search": "results", "sort": {"by": None, "order": None}, "results": rows}
+        content = json.dumps(response, indent=2, ensure_ascii=False).encode("utf-8")
+        envelope = dict(response, results=[])
+        for chunk_size in [1, 2, 3, 7, 64, len(content)]:
+            records, parsed_envelope = self._parse(content, chunk_size)
+            self.assertEqual(rows, records)
+            self.assertEqual(envelope, parsed_envelope)
+
+    def test_feed__records_yielded_as_they_complete(self):
+        parser = StreamingResultsParser(JsonCodec("json"))
+        self.assertEqual([{"id": 1}], parser.feed(b'{"results": [{"id": 1}, {"id"'))
+        self.assertEqual([{"id": 2}], parser.feed(b': 2}]'))
+        self.assertEqual([], parser.feed(b', "subtotal": 2}'))
+        self.assertEqual({"results": [], "subtotal": 2}, parser.close())
+
+    def test_close__incomplete_response(self):
+        parser = StreamingResultsParser(JsonCodec("json"))
+        parser.feed(b'{"results": [{"id": 1}')
+        with self.assertRaises(Exception):
+            parser.close()
@@ -0,0 +1,22 @@
+from unittest import TestCase
+from ForemanApiWrapper.ForemanApiUtilities.Mappings.ApiRecordIdentificationProperties import ApiRecordIdentificationProperties
+from ForemanApiWrapper.RecordUtilities import ForemanApiRecord
+
+
+class Test_ForemanApiRecord(TestCase):
+
+    def test__get_record_identifcation_properties__ordered(self):
+        record = {"domain": {"name": "foobar.com", "fullname": "Foobar", "id": 5}}
+        for x in range(0, 10):
+            self.assertEqual(["id", "name"], ForemanApiRecord.get_record_identifcation_properties(record))
+        self.assertEqual(["name"], ForemanApiRecord.get_record_identifcation_properties({"domain": {"name": "foobar.com"}}))
+
+    def test__get_record_identifcation_properties__mapping_unchanged(self):
+        mapping = {x: list(y) for x, y in ApiRecordIdentificationProperties.items()}
+        self.assertEqual(["mac"], ForemanApiRecord.get_record_identifcation_properties({"host": {"name": "web1", "mac": "00:11:22:33:44:55"}}))
+        self.assertEqual(["id", "mac"], ForemanApiRecord.get_record_identifcation_properties({"host": {"mac": "00:11:22:33:44:55", "id": 7}}))
+        self.assertEqual(mapping, ApiRecordIdentificationProperties)
+
+    def test__get_record_identifcation_properties__none(self):
+        with self.assertRaises(Exception):
+            ForemanApiRecord.get_record_identifcation_properties({"domain": {"fullname": "Foobar"}})